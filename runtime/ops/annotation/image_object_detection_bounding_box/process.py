@@ -8,7 +8,8 @@ Create: 2025/12/17
 import os
 import json
 import time
-from typing import Dict, Any
+from functools import partial
+from typing import Dict, Any, List, Tuple
 import cv2
 import numpy as np
 from loguru import logger
@@ -19,6 +20,7 @@ except ImportError:
     logger.warning("ultralytics not installed. Please install it using: pip install ultralytics")
     YOLO = None
 
+from datamate.common.utils.model_server import get_model_server
 from datamate.core.base_op import Mapper
 
 
@@ -46,6 +48,29 @@ COCO_CLASS_MAP = {
 }
 
 
+def load_yolo_model(model_filename: str, model_path: str):
+    if not os.path.exists(model_path):
+        logger.warning(f"Model file {model_path} not found. Downloading from ultralytics...")
+        return YOLO(model_filename)  # 自动下载
+    return YOLO(model_path)
+
+
+def detect_objects(model, items: List[Tuple[np.ndarray, float]]) -> List[List[Tuple[int, float, List[float]]]]:
+    """批量目标检测，入参为(图像, 置信度阈值)，按批次内最低阈值推理后再按各自阈值过滤"""
+    min_conf = min(conf for _, conf in items)
+    results = model([img for img, _ in items], conf=min_conf, verbose=False)
+    outputs = []
+    for (_, conf_threshold), r in zip(items, results):
+        detections = []
+        if r.boxes is not None:
+            for box in r.boxes:
+                conf = float(box.conf[0])
+                if conf >= conf_threshold:
+                    detections.append((int(box.cls[0]), conf, [float(x) for x in box.xyxy[0]]))
+        outputs.append(detections)
+    return outputs
+
+
 class ImageObjectDetectionBoundingBox(Mapper):
     """图像目标检测算子"""
 
@@ -83,12 +108,10 @@ class ImageObjectDetectionBoundingBox(Mapper):
         if YOLO is None:
             raise ImportError("ultralytics is not installed. Please install it.")
         
-        if not os.path.exists(model_path):
-            logger.warning(f"Model file {model_path} not found. Downloading from ultralytics...")
-            self.model = YOLO(model_filename)  # 自动下载
-        else:
-            self.model = YOLO(model_path)
-        
+        # 各算子actor共用一份模型，检测请求在模型服务中合并为批次推理
+        self.model = get_model_server(f"yolo_{model_filename}", partial(load_yolo_model, model_filename, model_path),
+                                      detect_objects, op_kwargs=kwargs)
+
         logger.info(f"Loaded YOLOv8 model: {model_filename}, "
                    f"conf_threshold: {self._conf_threshold}, "
                    f"target_classes: {self._target_classes}")
@@ -117,9 +140,22 @@ class ImageObjectDetectionBoundingBox(Mapper):
             return sample
         
         # 执行目标检测
-        results = self.model(img, conf=self._conf_threshold)
-        r = results[0]
-        
+        detections = self.model.infer((img, self._conf_threshold))
+        self.save_annotations(sample, image_path, img, detections)
+
+        logger.info(f"Image: {os.path.basename(image_path)}, "
+                   f"Detections: {sample['detection_count']}, "
+                   f"Time: {(time.time() - start):.4f}s")
+
+        return sample
+
+    def detect_batch(self, images: List[np.ndarray]) -> List[List[Tuple[int, float, List[float]]]]:
+        """批量目标检测，返回每张图像的(类别ID, 置信度, [x1, y1, x2, y2])列表"""
+        return self.model.infer_batch([(img, self._conf_threshold) for img in images])
+
+    def save_annotations(self, sample: Dict[str, Any], image_path: str, img: np.ndarray,
+                         detections: List[Tuple[int, float, List[float]]]) -> Dict[str, Any]:
+        """根据检测结果生成标注数据并保存 JSON，同时在图像上绘制检测框"""
         # 准备标注数据
         h, w = img.shape[:2]
         annotations = {
@@ -133,46 +169,41 @@ class ImageObjectDetectionBoundingBox(Mapper):
         }
         
         # 处理检测结果
-        if r.boxes is not None:
-            for box in r.boxes:
-                cls_id = int(box.cls[0])
-                
-                # 过滤目标类别
-                if self._target_classes is not None and cls_id not in self._target_classes:
-                    continue
-                
-                conf = float(box.conf[0])
-                x1, y1, x2, y2 = map(float, box.xyxy[0])
-                label = COCO_CLASS_MAP.get(cls_id, f"class_{cls_id}")
-                
-                # 记录检测结果
-                annotations["detections"].append({
-                    "label": label,
-                    "class_id": cls_id,
-                    "confidence": round(conf, 4),
-                    "bbox_xyxy": [x1, y1, x2, y2],
-                    "bbox_xywh": [x1, y1, x2 - x1, y2 - y1]
-                })
-                
-                # 在图像上绘制
-                color = self._get_color_by_class_id(cls_id)
-                cv2.rectangle(
-                    img,
-                    (int(x1), int(y1)),
-                    (int(x2), int(y2)),
-                    color,
-                    2
-                )
-                
-                cv2.putText(
-                    img,
-                    f"{label} {conf:.2f}",
-                    (int(x1), max(int(y1) - 5, 10)),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    color,
-                    1
-                )
+        for cls_id, conf, (x1, y1, x2, y2) in detections:
+            # 过滤目标类别
+            if self._target_classes is not None and cls_id not in self._target_classes:
+                continue
+
+            label = COCO_CLASS_MAP.get(cls_id, f"class_{cls_id}")
+            
+            # 记录检测结果
+            annotations["detections"].append({
+                "label": label,
+                "class_id": cls_id,
+                "confidence": round(conf, 4),
+                "bbox_xyxy": [x1, y1, x2, y2],
+                "bbox_xywh": [x1, y1, x2 - x1, y2 - y1]
+            })
+            
+            # 在图像上绘制
+            color = self._get_color_by_class_id(cls_id)
+            cv2.rectangle(
+                img,
+                (int(x1), int(y1)),
+                (int(x2), int(y2)),
+                color,
+                2
+            )
+            
+            cv2.putText(
+                img,
+                f"{label} {conf:.2f}",
+                (int(x1), max(int(y1) - 5, 10)),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                color,
+                1
+            )
         
         # 确定输出目录
         if self._output_dir and os.path.exists(self._output_dir):
@@ -200,9 +231,4 @@ class ImageObjectDetectionBoundingBox(Mapper):
         sample["output_image"] = image_path
         sample["annotations_file"] = json_path
         sample["annotations"] = annotations
-        
-        logger.info(f"Image: {os.path.basename(image_path)}, "
-                   f"Detections: {len(annotations['detections'])}, "
-                   f"Time: {(time.time() - start):.4f}s")
-        
         return sample
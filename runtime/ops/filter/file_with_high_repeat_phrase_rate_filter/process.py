@@ -13,7 +13,7 @@ from pathlib import Path
 from typing import Dict, Any
 from loguru import logger
 
-import jieba
+from datamate.common.utils.tokenizer import get_tokenizer, lcut
 from datamate.core.base_op import Filter
 
 
@@ -26,10 +26,12 @@ class FileWithHighRepeatPhraseRateFilter(Filter):
         self._min_threshold = kwargs.get("repeatPhraseRatio", 0.5)  # 重复词符占全文的比例阈值，默认值为0.5
         self._hit_stopword_trigger = kwargs.get("hitStopwords", False)  # 计算重复词率时是否去除停用词，默认为False不去除，True为去除
         self._file_path = Path(__file__).parent / 'resources' / 'hit_stopwords.txt'
-        self._hit_stopwords = []
+        self._hit_stopwords = set()
         if self._hit_stopword_trigger:
             with open(self._file_path, 'r', encoding='utf-8') as f:
-                self._hit_stopwords = f.read().splitlines()
+                self._hit_stopwords = set(f.read().splitlines())
+        # 算子初始化时加载分词词典
+        get_tokenizer()
 
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         start = time.time()
@@ -49,7 +51,7 @@ class FileWithHighRepeatPhraseRateFilter(Filter):
             words_list: 切割后的词列表
         """
 
-        for word in jieba.lcut(text):
+        for word in lcut(text):
             if not self.PUNCTUATION_PATTERN.match(word) and word not in self._hit_stopwords:
                 yield word
 
@@ -13,9 +13,10 @@ import numpy as np
 from loguru import logger
 
 from datamate.common.utils import bytes_transform
+from datamate.common.utils.model_server import get_model_server
 from datamate.core.base_op import Filter
 
-from .wechat_qrcode_model import WechatQRCodeModel
+from .wechat_qrcode_model import WechatQRCodeModel, detect_qr_codes
 
 
 class ImgAdvertisementImagesCleaner(Filter):
@@ -71,21 +72,11 @@ class ImgAdvertisementImagesCleaner(Filter):
 
     @staticmethod
     def _detect_qr_code_using_wechat_model(img, file_name, model):
-        res = ""
-        try:
-            res, points = model.detectAndDecode(img)
-        except UnicodeDecodeError as ex:
-            res = ex.object.decode('ISO-8859-1').split(" ")[0]
-        except Exception as err:
-            logger.exception(f"fileName: {file_name}, method: ImgAdvertisementImagesCleaner. "
-                             f"An error occurred when using the WeChat model to detect the QR code. "
-                             f"The error is: {err}")
-        if res:
-            return True
-        return False
+        return model.infer((img, file_name))
 
     def init_model(self, *args, **kwargs):
-        return WechatQRCodeModel(*args, **kwargs).wechat_qr_model
+        # 各算子actor共用一份模型，避免每个actor各自加载
+        return get_model_server("wechat_qrcode", WechatQRCodeModel, detect_qr_codes, op_kwargs=kwargs)
 
     def resize_img(self, image):
         """图片等比压缩"""
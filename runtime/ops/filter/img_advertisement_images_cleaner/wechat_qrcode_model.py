@@ -3,8 +3,11 @@
 import gc
 import os
 from pathlib import Path
+from typing import List, Tuple
 
 import cv2
+import numpy as np
+from loguru import logger
 
 
 class WechatQRCodeModel:
@@ -21,3 +24,20 @@ class WechatQRCodeModel:
     def __del__(self):
         del self.wechat_qr_model
         gc.collect()
+
+
+def detect_qr_codes(model: WechatQRCodeModel, items: List[Tuple[np.ndarray, str]]) -> List[bool]:
+    """逐张检测图片是否含有二维码，入参为(图片, 文件名)，单张图片检测异常时视为不含二维码"""
+    outputs = []
+    for img, file_name in items:
+        res = ""
+        try:
+            res, points = model.wechat_qr_model.detectAndDecode(img)
+        except UnicodeDecodeError as ex:
+            res = ex.object.decode('ISO-8859-1').split(" ")[0]
+        except Exception as err:
+            logger.exception(f"fileName: {file_name}, method: ImgAdvertisementImagesCleaner. "
+                             f"An error occurred when using the WeChat model to detect the QR code. "
+                             f"The error is: {err}")
+        outputs.append(bool(res))
+    return outputs
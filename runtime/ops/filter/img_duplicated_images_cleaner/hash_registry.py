@@ -0,0 +1,83 @@
+# -- encoding: utf-8 --
+
+"""
+Description: 重复图片MD5登记表
+Create: 2025/1/7
+"""
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import text
+
+from datamate.sql_manager.sql_manager import SQLManager
+
+
+class ImageHashRegistry:
+    """
+    重复图片MD5登记表，同一任务内的所有算子actor共享一个登记表。
+
+    查重与登记在一次调用内完成，保证多个actor间的原子性；新图片特征批量写入数据库用于审计，
+    登记表重建时从数据库加载已有特征。
+    """
+
+    def __init__(self, task_uuid: str, sql_dict: Dict, persist: bool = True, flush_size: int = 200):
+        self.task_uuid = task_uuid
+        self.sql_dict = sql_dict
+        self.persist = persist
+        self.flush_size = flush_size
+        self.features = set()
+        # 原始文件字节的MD5，相同字节的图片无需解码即可判定重复
+        self.raw_features = set()
+        self.pending_rows: List[Dict] = []
+        if self.persist:
+            self._load()
+
+    def contains_raw(self, raw_feature: str) -> bool:
+        return raw_feature in self.raw_features
+
+    def check_and_add(self, feature: str, file_name: str, timestamp: str, raw_feature: Optional[str] = None) -> bool:
+        """
+        判断图片是否重复，不重复时登记该图片
+
+        Returns:
+            图片是否与已登记的图片重复
+        """
+        if raw_feature:
+            self.raw_features.add(raw_feature)
+        if feature in self.features:
+            return True
+        self.features.add(feature)
+        if self.persist:
+            self.pending_rows.append({"task_uuid": self.task_uuid, "file_feature": feature,
+                                      "file_name": file_name.encode("utf-8"), "timestamp": timestamp})
+            if len(self.pending_rows) >= self.flush_size:
+                self.flush()
+        return False
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        rows, self.pending_rows = self.pending_rows, []
+        try:
+            with SQLManager.create_connect() as conn:
+                conn.execute(text(self.sql_dict.get("insert_sql")), rows)
+        except Exception as e:
+            logger.error(f"taskId: {self.task_uuid}, persist {len(rows)} image features failed: {e}")
+
+    def close(self):
+        """任务结束释放登记表前持久化尚未写入数据库的图片特征"""
+        self.flush()
+
+    def __len__(self):
+        return len(self.features)
+
+    def _load(self):
+        """从数据库加载该任务已持久化的图片特征，用于登记表actor重建后恢复"""
+        start = time.time()
+        with SQLManager.create_connect() as conn:
+            conn.execute(text(self.sql_dict.get("create_tables_sql")))
+            rows = conn.execute(text(self.sql_dict.get("query_task_uuid_sql")),
+                                {"task_uuid": self.task_uuid}).fetchall()
+        self.features.update(row[0] for row in rows if row[0])
+        logger.info(f"taskId: {self.task_uuid}, load {len(self)} image features costs {time.time() - start:6f} s")
@@ -3,25 +3,26 @@
 """
 Description:
 于MD5值计算当前图片与数据集中其它图片是否相同。相同该图片过滤，保留原数据集图片。
-将文件特征数据即MD5值，存到数据库。根据任务uuid获取历史文件特征，遍历特征并进行去重比较
+将文件特征数据即MD5值，存到数据库。同一任务共享图片MD5登记表，查重与登记原子完成
 Create: 2025/1/7
 """
 
 import json
 import time
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 import cv2
 from Crypto.Hash import MD5
-from sqlalchemy import text
 from loguru import logger
 
-from datamate.sql_manager.sql_manager import SQLManager
 from datamate.common.utils import get_now_time
 from datamate.common.utils import bytes_to_numpy, numpy_to_bytes
+from datamate.common.utils.shared_actor import get_shared_instance
 from datamate.core.base_op import Filter
 
+from .hash_registry import ImageHashRegistry
+
 
 class ImgDuplicatedImagesCleaner(Filter):
     """去除重复图片插件
@@ -35,9 +36,10 @@ class ImgDuplicatedImagesCleaner(Filter):
         self.img_resize = 200  # 图片压缩尺寸
         # 获取数据库sql
         self.sql_dict = self.load_sql_dict()
-        # 获取数据库连接池
-        self.conn = None  # 数据库连接
-        self.trans = None  # 数据库事务
+        # 是否先基于原始文件字节计算MD5，字节完全相同的图片无需解码即可判定重复
+        self.raw_bytes_hash = kwargs.get("rawBytesHash", False)
+        # 任务内共享的图片MD5登记表
+        self.registry = None
 
     @staticmethod
     def load_sql_dict():
@@ -70,35 +72,26 @@ class ImgDuplicatedImagesCleaner(Filter):
             f"fileName: {file_name}, method: DuplicateImagesCleaner costs {(time.time() - start):6f} s")
         return sample
 
+    def get_registry(self) -> ImageHashRegistry:
+        """获取任务内共享的图片MD5登记表，所有算子actor的查重与登记在同一登记表内串行完成"""
+        if self.registry is None:
+            try:
+                self.registry = get_shared_instance(ImageHashRegistry, f"duplicate_image_registry_{self.task_uuid}",
+                                                    self.task_uuid, self.sql_dict)
+            except Exception as e:
+                logger.error(f"taskId: {self.task_uuid}, create image hash registry failed: {str(e)}")
+                raise RuntimeError(82000, str(e)) from None
+        return self.registry
+
     def execute_sql(self, md5: str, file_name: str,
-                    img_bytes: bytes) -> bytes:
-        """从数据库中获取文件特征、比较MD5，插入新的文件特征"""
+                    img_bytes: bytes, raw_md5: Optional[str] = None) -> bytes:
+        """在图片MD5登记表中比较MD5，不重复时登记新的文件特征"""
         timestamp = get_now_time('Asia/Shanghai', '%Y-%m-%d %H:%M:%S', file_name,
                                  "DuplicateImagesCleaner")
-        query_sql = str(self.sql_dict.get("query_sql"))
-        insert_sql = str(self.sql_dict.get("insert_sql"))
-        create_tables_sql = str(self.sql_dict.get("create_tables_sql"))
-        query_sql_params = {"task_uuid": self.task_uuid, "file_feature": md5}
-        insert_sql_params = {"task_uuid": self.task_uuid, "file_feature": md5, "file_name": file_name.encode("utf-8"),
-                             "timestamp": timestamp}
-
-        db_manager = SQLManager()
-        try:
-            self.conn = db_manager.create_connect()
-        except Exception as e:
-            logger.error(f"fileName: {file_name}, database connection failed: {str(e)}")
-            raise RuntimeError(82000, str(e)) from None
-
-        with self.conn as connection:
-            connection.execute(text(create_tables_sql))
-            # 判断是否有重复文件
-            result = connection.execute(text(query_sql), query_sql_params).fetchall()
-            # 查询记录为空，无重复图片, 插入新文件特征
-            if not result:
-                connection.execute(text(insert_sql), insert_sql_params)
-                return img_bytes
-            logger.info(f"taskId: {self.task_uuid} fileName: {file_name}, method: Duplicate ImagesCleaner. "
-                        f"The image is duplicated and filtered ")
+        if not self.get_registry().check_and_add(md5, file_name, timestamp, raw_md5):
+            return img_bytes
+        logger.info(f"taskId: {self.task_uuid} fileName: {file_name}, method: Duplicate ImagesCleaner. "
+                    f"The image is duplicated and filtered ")
         return b""
 
     def _duplicate_images_filter(self, file_name: str, img_bytes: bytes) -> bytes:
@@ -106,5 +99,13 @@ class ImgDuplicatedImagesCleaner(Filter):
         # 如果文件为空，则无需去重，返回原图
         if not img_bytes:
             return img_bytes
+        raw_md5 = None
+        if self.raw_bytes_hash:
+            # 原始字节完全相同的图片直接判定重复，无需解码、压缩和重新编码
+            raw_md5 = MD5.new(img_bytes).hexdigest()
+            if self.get_registry().contains_raw(raw_md5):
+                logger.info(f"taskId: {self.task_uuid} fileName: {file_name}, method: Duplicate ImagesCleaner. "
+                            f"The image is duplicated and filtered ")
+                return b""
         md5 = self.compute_md5(img_bytes)
-        return self.execute_sql(md5, file_name, img_bytes)
+        return self.execute_sql(md5, file_name, img_bytes, raw_md5)
@@ -0,0 +1,231 @@
+# -- encoding: utf-8 --
+
+"""
+Description: 基于pHash汉明距离的相似图片索引
+Create: 2025/1/7
+"""
+import ast
+import os
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from loguru import logger
+from sqlalchemy import text
+
+from datamate.sql_manager.sql_manager import SQLManager
+
+PHASH_BITS = 64
+# 每个字节的置位数，numpy不支持bitwise_count时用于计算汉明距离
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def pack_p_hash(p_hash: str) -> np.uint64:
+    """将64位'0'/'1'字符串形式的pHash压缩为uint64"""
+    return np.uint64(int(p_hash, 2))
+
+
+def hamming_distance(p_hashes: np.ndarray, p_hash: np.uint64) -> np.ndarray:
+    """向量化计算一个pHash与一组pHash的汉明距离"""
+    xor = np.bitwise_xor(p_hashes, p_hash)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor).astype(np.int64)
+    return _POPCOUNT_TABLE[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+
+def get_orb_similarity(des_matrix: np.ndarray, des_matrix_history: np.ndarray, orb_ratio: float) -> float:
+    """获取图片orb相似度"""
+    # 若描述符矩阵为空，则相似度为0
+    if not des_matrix.size or not des_matrix_history.size:
+        return 0.0
+    # 根据矩阵对角线上元素和的大小，选择描述符矩阵作为训练或查询矩阵
+    train_matrix, query_matrix = des_matrix, des_matrix_history
+    if train_matrix.shape[0] > des_matrix_history.shape[0]:
+        train_matrix, query_matrix = des_matrix_history, des_matrix
+    elif des_matrix.shape[0] == des_matrix_history.shape[0]:
+        if np.trace(des_matrix) > np.trace(des_matrix_history):
+            train_matrix, query_matrix = des_matrix_history, des_matrix
+
+    # knn筛选结果
+    matches = (cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False).
+               knnMatch(query_matrix, trainDescriptors=train_matrix, k=2))
+    if not matches:
+        return 0.0
+    # 遍历每一对特征点，筛选距离更近的特征点
+    count = 0
+    for match in matches:
+        if len(match) == 2 and match[0].distance < orb_ratio * match[1].distance:
+            count += 1
+    return count / len(matches)
+
+
+class SimilarImageIndex:
+    """
+    相似图片索引，同一任务内的所有算子actor共享一个索引。
+
+    pHash压缩为uint64后按汉明距离向量化筛选候选图片，仅对候选图片进行ORB特征匹配；
+    新图片特征批量持久化到数据库，索引重建时从数据库加载已有特征。
+    内存中按最近使用顺序最多保留max_descriptors个ORB描述符（环境变量SIMILAR_IMAGE_MAX_DESCRIPTORS，默认50000），
+    被淘汰的描述符在需要比较时从数据库读取。
+    """
+
+    def __init__(self, task_uuid: str, sql_dict: Dict, similar_threshold: float, mix_similarity: float,
+                 orb_ratio: float, candidate_distance: int, max_candidates: int,
+                 persist: bool = True, flush_size: int = 100, max_descriptors: Optional[int] = None):
+        self.task_uuid = task_uuid
+        self.sql_dict = sql_dict
+        self.similar_threshold = similar_threshold
+        self.mix_similarity = mix_similarity
+        self.orb_ratio = orb_ratio
+        self.candidate_distance = candidate_distance
+        self.max_candidates = max_candidates
+        self.persist = persist
+        self.flush_size = flush_size
+        # pHash数组按容量倍增，避免每次插入都复制整个数组
+        self.p_hashes = np.empty(1024, dtype=np.uint64)
+        if max_descriptors is None:
+            max_descriptors = int(os.getenv("SIMILAR_IMAGE_MAX_DESCRIPTORS", "50000"))
+        self.max_descriptors = max(1, max_descriptors)
+        self.des_matrices: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self.file_names: List[str] = []
+        self.pending_rows: List[Dict] = []
+        if self.persist:
+            self._load()
+
+    def query_and_insert(self, p_hash: str, des_matrix: np.ndarray, file_name: str,
+                         timestamp: str) -> Optional[Tuple[str, float]]:
+        """
+        查询与当前图片相似的历史图片，不存在相似图片时将当前图片加入索引。
+
+        Returns:
+            相似图片名称及相似度，不存在相似图片时返回None
+        """
+        similar = self.query(p_hash, des_matrix, file_name)
+        if similar is None:
+            self._insert(p_hash, des_matrix, file_name)
+            if self.persist:
+                self.pending_rows.append({
+                    "task_uuid": self.task_uuid,
+                    "p_hash": p_hash,
+                    "des_matrix": zlib.compress(des_matrix.tobytes()),  # 使用 zlib 进行压缩数组
+                    "matrix_shape": str(des_matrix.shape),
+                    "file_name": file_name.encode("utf-8").hex(),
+                    "timestamp": timestamp
+                })
+                if len(self.pending_rows) >= self.flush_size:
+                    self.flush()
+        return similar
+
+    def query(self, p_hash: str, des_matrix: np.ndarray, file_name: str) -> Optional[Tuple[str, float]]:
+        if not p_hash or not self.file_names:
+            return None
+        distances = hamming_distance(self.p_hashes[:len(self.file_names)], pack_p_hash(p_hash))
+        candidates = np.flatnonzero(distances <= self.candidate_distance)
+        if candidates.size > self.max_candidates:
+            nearest = np.argpartition(distances[candidates], self.max_candidates - 1)[:self.max_candidates]
+            candidates = candidates[nearest]
+        # 按汉明距离由近及远比较，命中即返回
+        for key in candidates[np.argsort(distances[candidates], kind="stable")]:
+            phash_similarity = 1 - distances[key] / PHASH_BITS
+            similarity = self._get_similarity(phash_similarity, des_matrix, int(key), file_name)
+            if similarity >= self.similar_threshold:
+                return self.file_names[key], similarity
+        return None
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        rows, self.pending_rows = self.pending_rows, []
+        try:
+            with SQLManager.create_connect() as conn:
+                conn.execute(text(self.sql_dict.get("insert_sql")), rows)
+        except Exception as e:
+            logger.error(f"taskId: {self.task_uuid}, persist {len(rows)} image features failed: {e}")
+
+    def close(self):
+        """任务结束释放索引前持久化尚未写入数据库的图片特征"""
+        self.flush()
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def _cache_descriptor(self, key: int, des_matrix: np.ndarray):
+        self.des_matrices[key] = des_matrix
+        self.des_matrices.move_to_end(key)
+        if len(self.des_matrices) > self.max_descriptors:
+            # 淘汰前先持久化尚未写入数据库的特征，保证被淘汰的描述符可以从数据库读回
+            if self.pending_rows:
+                self.flush()
+            self.des_matrices.popitem(last=False)
+
+    def _get_descriptor(self, key: int) -> np.ndarray:
+        des_matrix = self.des_matrices.get(key)
+        if des_matrix is not None:
+            self.des_matrices.move_to_end(key)
+            return des_matrix
+        des_matrix = self._load_descriptor(key)
+        self._cache_descriptor(key, des_matrix)
+        return des_matrix
+
+    def _load_descriptor(self, key: int) -> np.ndarray:
+        """从数据库读取已被淘汰的描述符，未开启持久化或读取失败时返回空矩阵（仅按pHash计算相似度）"""
+        if not self.persist:
+            return np.array([])
+        try:
+            with SQLManager.create_connect() as conn:
+                row = conn.execute(text(self.sql_dict.get("query_des_matrix_sql")),
+                                   {"task_uuid": self.task_uuid,
+                                    "file_name": self.file_names[key].encode("utf-8").hex()}).fetchone()
+        except Exception as e:
+            logger.warning(f"taskId: {self.task_uuid}, load image feature of {self.file_names[key]} failed: {e}")
+            return np.array([])
+        if row is None:
+            return np.array([])
+        return np.frombuffer(zlib.decompress(row[0]), dtype=np.uint8).reshape(ast.literal_eval(row[1]))
+
+    def _get_similarity(self, phash_similarity: float, des_matrix: np.ndarray, key: int, file_name: str) -> float:
+        """感知哈希与ORB相似度高于mix_similarity时取二者较大值，否则取二者较小值"""
+        if phash_similarity >= max(self.similar_threshold, self.mix_similarity):
+            # 较大值已超过阈值，无需再进行ORB匹配
+            return round(float(phash_similarity), 2)
+        try:
+            orb_similarity = get_orb_similarity(des_matrix, self._get_descriptor(key), self.orb_ratio)
+        except Exception as e:
+            logger.exception(f"taskId: {self.task_uuid}, failed to compare the similarity between "
+                             f"{file_name} and {self.file_names[key]}: {e}")
+            orb_similarity = 0.0
+        max_similarity = max(phash_similarity, orb_similarity)
+        min_similarity = min(phash_similarity, orb_similarity)
+        result = max_similarity if max_similarity >= self.mix_similarity else min_similarity
+        return round(float(result), 2)
+
+    def _insert(self, p_hash: str, des_matrix: np.ndarray, file_name: str):
+        if not p_hash:
+            # 若图片为空，p_hash、des_matrix为空，不参与比对
+            return
+        key = len(self.file_names)
+        if key >= self.p_hashes.shape[0]:
+            self.p_hashes = np.concatenate([self.p_hashes, np.empty_like(self.p_hashes)])
+        self.p_hashes[key] = pack_p_hash(p_hash)
+        self._cache_descriptor(key, des_matrix)
+        self.file_names.append(file_name)
+
+    def _load(self):
+        """从数据库加载该任务已持久化的图片特征，用于索引actor重建后恢复"""
+        start = time.time()
+        with SQLManager.create_connect() as conn:
+            conn.execute(text(self.sql_dict.get("create_tables_sql")))
+            rows = conn.execute(text(self.sql_dict.get("query_task_uuid_sql")),
+                                {"task_uuid": self.task_uuid}).fetchall()
+        for row in rows:
+            p_hash, orb_feature, matrix_shape, file_name = row[2], row[3], row[4], row[5]
+            if not p_hash:
+                continue
+            # 解压缩数据并将字节流转换回矩阵
+            des_matrix = np.frombuffer(zlib.decompress(orb_feature), dtype=np.uint8).reshape(
+                ast.literal_eval(matrix_shape))
+            self._insert(p_hash, des_matrix, bytes.fromhex(file_name).decode("utf-8"))
+        logger.info(f"taskId: {self.task_uuid}, load {len(self)} image features costs {time.time() - start:6f} s")
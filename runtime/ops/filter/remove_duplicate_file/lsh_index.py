@@ -0,0 +1,138 @@
+#!/user/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Description: 基于MinHash LSH的相似文档索引
+Create: 2025/01/07
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from datasketch import MinHashLSH
+from loguru import logger
+from sqlalchemy import text
+
+from datamate.sql_manager.sql_manager import SQLManager
+
+
+def signature_to_string(signature: np.ndarray) -> str:
+    """MinHash签名以uint64数组的十六进制形式持久化"""
+    return signature.astype(np.uint64).tobytes().hex()
+
+
+def string_to_signature(file_feature: str) -> np.ndarray:
+    """兼容历史数据中np.array2string格式的签名"""
+    file_feature = file_feature.strip()
+    if file_feature.startswith("["):
+        return np.array(file_feature.strip("[]").split(), dtype=np.uint64)
+    return np.frombuffer(bytes.fromhex(file_feature), dtype=np.uint64)
+
+
+class SimilarTextIndex:
+    """
+    相似文档索引，同一任务内的所有算子actor共享一个索引。
+
+    使用LSH分桶对签名进行候选检索，仅对候选文档计算Jaccard相似度；
+    新文档签名写入内存索引，并批量持久化到数据库，索引重建时从数据库加载已有签名。
+    """
+
+    def __init__(self, task_uuid: str, threshold: float, num_perm: int, sql_dict: Dict,
+                 persist: bool = True, flush_size: int = 100):
+        self.task_uuid = task_uuid
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.sql_dict = sql_dict
+        self.persist = persist
+        self.flush_size = flush_size
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        # 签名矩阵按容量倍增，避免每次插入都复制整个矩阵
+        self.signatures = np.empty((1024, num_perm), dtype=np.uint64)
+        self.file_names: List[str] = []
+        self.pending_rows: List[Dict] = []
+        if self.persist:
+            self._load()
+
+    def query_and_insert(self, signature: np.ndarray, file_name: str, timestamp: str) -> Optional[Tuple[str, float]]:
+        """
+        查询与当前文档相似的历史文档，不存在相似文档时将当前文档加入索引。
+
+        Returns:
+            相似文档名称及相似度，不存在相似文档时返回None
+        """
+        signature = np.asarray(signature, dtype=np.uint64)
+        similar = self.query(signature, file_name)
+        if similar is None:
+            self._insert(signature, file_name)
+            if self.persist:
+                self.pending_rows.append({
+                    "task_uuid": self.task_uuid,
+                    "file_feature": signature_to_string(signature),
+                    "file_name": file_name.encode("utf-8").hex(),
+                    "timestamp": timestamp
+                })
+                if len(self.pending_rows) >= self.flush_size:
+                    self.flush()
+        return similar
+
+    def query(self, signature: np.ndarray, file_name: str) -> Optional[Tuple[str, float]]:
+        candidates = [key for key in self.lsh.query(_HashValues(signature)) if self.file_names[key] != file_name]
+        if not candidates:
+            return None
+        similarities = np.mean(self.signatures[candidates] == signature, axis=1)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.threshold:
+            return self.file_names[candidates[best]], float(similarities[best])
+        return None
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        rows, self.pending_rows = self.pending_rows, []
+        try:
+            with SQLManager.create_connect() as conn:
+                conn.execute(text(self.sql_dict.get("insert_sql")), rows)
+        except Exception as e:
+            logger.error(f"taskId: {self.task_uuid}, persist {len(rows)} text features failed: {e}")
+
+    def close(self):
+        """任务结束释放索引前持久化尚未写入数据库的签名"""
+        self.flush()
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def _insert(self, signature: np.ndarray, file_name: str):
+        key = len(self.file_names)
+        self.lsh.insert(key, _HashValues(signature), check_duplication=False)
+        if key >= self.signatures.shape[0]:
+            self.signatures = np.concatenate([self.signatures, np.empty_like(self.signatures)])
+        self.signatures[key] = signature
+        self.file_names.append(file_name)
+
+    def _load(self):
+        """从数据库加载该任务已持久化的签名，用于索引actor重建后恢复"""
+        start = time.time()
+        with SQLManager.create_connect() as conn:
+            conn.execute(text(self.sql_dict.get("create_tables_sql")))
+            rows = conn.execute(text(self.sql_dict.get("query_task_uuid_sql")),
+                                {"task_uuid": self.task_uuid}).fetchall()
+        for row in rows:
+            file_feature, file_name = row[2], row[3]
+            if not file_feature:
+                continue
+            signature = string_to_signature(file_feature)
+            if signature.shape[0] != self.num_perm:
+                continue
+            self._insert(signature, bytes.fromhex(file_name).decode("utf-8"))
+        logger.info(f"taskId: {self.task_uuid}, load {len(self)} text features costs {time.time() - start:6f} s")
+
+
+class _HashValues:
+    """MinHashLSH只读取hashvalues属性，避免为每个签名构造MinHash对象"""
+
+    def __init__(self, hashvalues: np.ndarray):
+        self.hashvalues = hashvalues
+
+    def __len__(self):
+        return len(self.hashvalues)
@@ -13,55 +13,11 @@ from typing import Dict, Any
 from loguru import logger
 
 from datamate.core.base_op import Filter
-from datamate.common.utils.aho_corasick import build_trie, add_fail_pointer
+from datamate.common.utils.lexicon_scanner import LexiconScanner
 
 sys.setrecursionlimit(5000)
 
 
-class AhoCorasic:
-    """AC自动机算法进行目标字符串搜索"""
-
-    def __init__(self, words):
-        self._root = add_fail_pointer(build_trie(words))
-
-    def search_and_count(self, text: str, special_symbols: set):
-        """
-        匹配敏感词，统计敏感词字数。
-
-        Args:
-            text: 文本
-            special_symbols: 特殊字符（需跳过）
-        Returns:
-            统计敏感词字数
-        """
-        target_count = 0
-        node = self._root
-
-        valid_len = 0  # 当前遍历的有效长度
-        for _, s in enumerate(text):
-            if s in special_symbols:  # 跳过特殊字符
-                continue
-
-            matched = True
-            while s not in node.child:  # 当node.child没有字符s
-                if node == self._root:  # 当node为root（无node.fail），有效长度归0且跳出
-                    valid_len = 0
-                    matched = False
-                    break
-                elif node.fail == self._root:  # node.fail为root场景，有效长度归0，但可继续
-                    valid_len = 0
-                node = node.fail  # 移动到失败指针节点
-            if not matched:
-                continue
-
-            node = node.child.get(s)
-            valid_len += 1
-            if node.word:  # node是单词尾字母
-                target_count += valid_len
-                valid_len = 0
-        return target_count
-
-
 class FileWithManySensitiveWordsFilter(Filter):
     """外部输入的暴力、色情文本过滤插件"""
 
@@ -78,8 +34,12 @@ class FileWithManySensitiveWordsFilter(Filter):
         self.political_words = self.load_words_list(political_file_path)
         self.special_symbols = self.load_words_list(special_symbols_path)
         self.symbols = self.special_symbols | {"\n", "\t", "\r"}  # 符号，不纳入文本字数统计
-        self.words = self.violent_words | self.sexual_words | self.political_words
-        self.ac_automaton = AhoCorasic(self.words)
+        # 与其它敏感词算子使用相同的合并词表，流水线中的敏感词算子共用同一次扫描结果
+        self.scanner = LexiconScanner({
+            "political": self.political_words,
+            "sexual": self.sexual_words,
+            "violent": self.violent_words,
+        }, self.special_symbols)
 
     @staticmethod
     def load_words_list(path):
@@ -91,14 +51,27 @@ class FileWithManySensitiveWordsFilter(Filter):
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         start = time.time()
         self.read_file_first(sample)
-        sample[self.text_key] = self._file_with_many_sensitive_words_filter(sample[self.text_key],
-                                                                            sample[self.filename_key])
+        sample[self.text_key] = self._file_with_many_sensitive_words_filter(sample, sample[self.filename_key])
         logger.info(f"fileName: {sample[self.filename_key]}, "
                     f"method: FileWithManySensitiveWordsFilter costs {(time.time() - start):6f} s")
         return sample
 
-    def _file_with_many_sensitive_words_filter(self, input_data: str, file_name):
+    def count_sensitive_words(self, sample: Dict[str, Any]) -> int:
+        """统计敏感词字数，重叠的敏感词只统计一次，特殊字符不纳入统计"""
+        input_data = sample[self.text_key]
+        target_count = 0
+        last_end = 0
+        for start, end in sorted(self.scanner.search_spans(sample, self.text_key, self.scanner.categories)):
+            start = max(start, last_end)
+            if end <= start:
+                continue
+            target_count += sum(1 for s in input_data[start:end] if s not in self.special_symbols)
+            last_end = end
+        return target_count
+
+    def _file_with_many_sensitive_words_filter(self, sample: Dict[str, Any], file_name):
         """过滤敏感词过多的文档"""
+        input_data = sample[self.text_key]
         total_count = 0
         for s in input_data:
             if s not in self.symbols:
@@ -107,7 +80,7 @@ class FileWithManySensitiveWordsFilter(Filter):
             return input_data
 
         # 敏感词率 = 敏感词字数 / 总字数，符号不纳入统计
-        sensitive_rate = self.ac_automaton.search_and_count(input_data, self.special_symbols) / total_count
+        sensitive_rate = self.count_sensitive_words(sample) / total_count
         if sensitive_rate >= self._file_sensitive_words_rate:
             logger.info(f"This document contains too many sensitive words. "
                         f"The proportion of sensitive words is {sensitive_rate}. "
@@ -7,12 +7,14 @@ Create: 2025/10/29 17:24
 """
 import asyncio
 import glob
+import io
 import os
 import shutil
+import threading
 import time
 import uuid
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 from datamate.core.base_op import Mapper, FileExporter
 from datamate.sql_manager.persistence_atction import TaskInfoPersistence
@@ -21,10 +23,15 @@ from mineru.cli.common import aio_do_parse, read_fn
 from mineru.cli.fast_api import get_infer_result
 from pypdf import PdfReader
 
+# 每次解析请求的页数
+PAGE_WINDOW_SIZE = 10
+
 
 class MineruFormatter(Mapper):
     """基于外部API，抽取PDF中的文本"""
 
+    checkpoint_output = True
+
     def __init__(self, *args, **kwargs):
         super(MineruFormatter, self).__init__(*args, **kwargs)
         self.server_url = kwargs.get("mineruApi", "http://datamate-mineru:8000")
@@ -32,6 +39,12 @@ class MineruFormatter(Mapper):
         self.output_dir = "/dataset/outputs"
         self.max_retries = 3
         self.target_type = kwargs.get("exportType", "md")
+        # 同时解析的页窗口数，本算子actor内所有文件共用该上限
+        self.max_concurrency = max(1, int(kwargs.get("maxConcurrency", os.getenv("MINERU_MAX_CONCURRENCY", "4"))))
+        # actor内常驻的事件循环，各文件的解析协程均提交到该循环执行，避免每个文件创建和销毁事件循环
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="mineru-formatter", daemon=True).start()
+        self._semaphore: Optional[asyncio.Semaphore] = None
 
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         start = time.time()
@@ -39,7 +52,8 @@ class MineruFormatter(Mapper):
         if not filename.lower().endswith((".png", ".jpeg", ".jpg", ".webp", ".gif", ".pdf")):
             return sample
         try:
-            sample[self.text_key] = asyncio.run(self.async_process_file(sample))
+            sample[self.text_key] = asyncio.run_coroutine_threadsafe(self.async_process_file(sample),
+                                                                     self._loop).result()
             sample[self.target_type_key] = self.target_type
             logger.info(
                 f"fileName: {filename}, method: MineruFormatter costs {(time.time() - start):6f} s")
@@ -49,43 +63,76 @@ class MineruFormatter(Mapper):
         return sample
 
     async def async_process_file(self, sample):
+        """
+        按页窗口并发解析文件，结果按页码顺序拼接。
+        每轮只重试上一轮失败的页窗口，重试次数耗尽后仍有失败的页窗口时抛出异常。
+        """
         filename = sample[self.filename_key]
-        filename_without_ext = os.path.splitext(filename)[0]
-        filepath = sample[self.filepath_key]
-        parse_dir = os.path.join(self.output_dir, filename_without_ext, "vlm")
-        pdf_bytes = read_fn(filepath)
-        total_page = len(PdfReader(filepath).pages)
-        content = ""
-        for page in range(0, total_page, 10):
-            logger.info(f"fileName: {filename}, total_page: {total_page}, page: {page}.")
-            for attempt in range(self.max_retries):
-                try:
-                    await aio_do_parse(
-                        output_dir=self.output_dir,
-                        pdf_file_names=[filename_without_ext],
-                        pdf_bytes_list=[pdf_bytes],
-                        p_lang_list=["ch"],
-                        backend=self.backend,
-                        server_url=self.server_url,
-                        start_page_id=page,
-                        end_page_id=min(page + 9, total_page - 1),
-                    )
-                    break  # 成功则跳出重试循环
-                except Exception as e:
+        # 读取文件、统计页数在线程池中执行，不阻塞事件循环中其它文件的解析
+        loop = asyncio.get_running_loop()
+        pdf_bytes = await loop.run_in_executor(None, read_fn, sample[self.filepath_key])
+        total_page = await loop.run_in_executor(None, lambda: len(PdfReader(io.BytesIO(pdf_bytes)).pages))
+        windows = [(page, min(page + PAGE_WINDOW_SIZE - 1, total_page - 1))
+                   for page in range(0, total_page, PAGE_WINDOW_SIZE)]
+        contents: List[Optional[str]] = [None] * len(windows)
+        pending = list(range(len(windows)))
+        errors = {}
+        for attempt in range(self.max_retries):
+            results = await asyncio.gather(*(self.parse_window(sample, pdf_bytes, windows[idx]) for idx in pending),
+                                           return_exceptions=True)
+            failed = []
+            for idx, result in zip(pending, results):
+                if isinstance(result, Exception):
+                    errors[idx] = result
                     logger.warning(
-                        f"Extract {filename} [{page}-{page + 9}] failed (attempt {attempt + 1}/{self.max_retries}). "
-                        f"Error: {e}. Retrying in 5s..."
+                        f"Extract {filename} [{windows[idx][0]}-{windows[idx][1]}] failed "
+                        f"(attempt {attempt + 1}/{self.max_retries}). Error: {result}."
                     )
-                    if attempt < self.max_retries - 1:
-                        await asyncio.sleep(5)
-                    else:
-                        logger.error(f"aio_do_parse failed after {self.max_retries} attempts.")
-                        raise  # 耗尽次数后抛出异常，交给上层 execute 处理
-            if os.path.exists(parse_dir):
-                content += get_infer_result(".md", filename_without_ext, parse_dir)
-                self.save_images(parse_dir, sample["dataset_id"], os.path.abspath(sample[self.export_path_key]) + "/images")
-                shutil.rmtree(parse_dir)
-        return content
+                    failed.append(idx)
+                else:
+                    contents[idx] = result
+            pending = failed
+            if not pending:
+                break
+            if attempt < self.max_retries - 1:
+                logger.info(f"fileName: {filename}, retry {len(pending)} failed page windows in 5s...")
+                await asyncio.sleep(5)
+        if pending:
+            logger.error(f"aio_do_parse failed after {self.max_retries} attempts, "
+                         f"failed page windows: {[windows[idx] for idx in pending]}.")
+            raise errors[pending[0]]  # 耗尽次数后抛出异常，交给上层 execute 处理
+        return "".join(contents)
+
+    async def parse_window(self, sample: Dict[str, Any], pdf_bytes: bytes, window: Tuple[int, int]) -> str:
+        """解析一个页窗口，各页窗口使用独立的输出目录，并发解析时互不覆盖"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        filename = sample[self.filename_key]
+        filename_without_ext = os.path.splitext(filename)[0]
+        output_dir = os.path.join(self.output_dir, uuid.uuid4().hex)
+        parse_dir = os.path.join(output_dir, filename_without_ext, "vlm")
+        async with self._semaphore:
+            logger.info(f"fileName: {filename}, page: {window[0]}-{window[1]}.")
+            try:
+                await aio_do_parse(
+                    output_dir=output_dir,
+                    pdf_file_names=[filename_without_ext],
+                    pdf_bytes_list=[pdf_bytes],
+                    p_lang_list=["ch"],
+                    backend=self.backend,
+                    server_url=self.server_url,
+                    start_page_id=window[0],
+                    end_page_id=window[1],
+                )
+                if not os.path.exists(parse_dir):
+                    return ""
+                content = get_infer_result(".md", filename_without_ext, parse_dir)
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.save_images, parse_dir, sample["dataset_id"],
+                    os.path.abspath(sample[self.export_path_key]) + "/images")
+                return content
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
 
     def save_images(self, parse_dir, dataset_id, export_path):
         Path(export_path).mkdir(parents=True, exist_ok=True)
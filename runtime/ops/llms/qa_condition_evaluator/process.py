@@ -5,10 +5,12 @@ Description: 基于LLM通过用户设置维度和相应描述进行QA对评估
 Create: 2023/11/7 9:26
 """
 import json
+import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 from loguru import logger
 
@@ -20,7 +22,9 @@ class QAConditionEvaluator(LLM):
     def __init__(self, *args, **kwargs):
         super(QAConditionEvaluator, self).__init__(*args, **kwargs)
         self.pattern = r'结果[:：] ?[YN]'
+        self.packed_pattern = r'标准(\d+) ?结果[:：] ?([YN])'
         self.template_path = Path(__file__).parent / "resources/template.txt"
+        self.packed_template_path = Path(__file__).parent / "resources/template_packed.txt"
         self.examples_path = Path(__file__).parent / "resources/examples.json"
         self.task_id = kwargs.get("taskId", "default_id")
         self.dimensions = kwargs.get("dimension", [
@@ -41,8 +45,15 @@ class QAConditionEvaluator(LLM):
                     }
                 ])
 
+        # 并发请求数，默认与LLM_MAX_CONCURRENCY一致；开启维度合并时同一QA对的所有维度在一次请求中评估
+        self.max_workers = max(1, int(kwargs.get("maxWorkers", os.getenv("LLM_MAX_CONCURRENCY", "8"))))
+        self.pack_dimensions = kwargs.get("packDimensions", False)
+
         self.llm = self.get_llm(*args, **kwargs)
         self.prompts = self.build_llm_prompt(*args, **kwargs)
+        # 合并评估时标准的编号与结果的对应均以此为准，同名维度只保留一个
+        self.dimension_names = list(self.prompts)
+        self.packed_prompt = self.build_packed_prompt() if self.pack_dimensions else None
 
     @staticmethod
     def _process_examples(dimension_example: List) -> str:
@@ -59,18 +70,40 @@ class QAConditionEvaluator(LLM):
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         start = time.time()
         qas = json.loads(sample[self.text_key])
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            if self.pack_dimensions:
+                qa_results = list(executor.map(self._evaluate_packed, qas))
+                # 合并评估时未能解析出结果的维度，逐维度重新评估
+                retry_jobs = [(qa_idx, dimension) for qa_idx, qa_res in enumerate(qa_results)
+                              for dimension, local_result in qa_res.items() if local_result is None]
+            else:
+                qa_results = [dict.fromkeys(self.prompts) for _ in qas]
+                retry_jobs = [(qa_idx, dimension) for qa_idx in range(len(qas)) for dimension in self.prompts]
+            futures = [executor.submit(self._llm_call_parse, qas[qa_idx], self.prompts[dimension], 2)
+                       for qa_idx, dimension in retry_jobs]
+            for (qa_idx, dimension), future in zip(retry_jobs, futures):
+                qa_results[qa_idx][dimension] = future.result()
+
         single_content_res = []
-        for qa in qas:
+        failed_count = 0
+        for qa, qa_res in zip(qas, qa_results):
             single_qa_res = []
-            for dimension, prompt in self.prompts.items():
-                local_result = self._llm_call_parse(qa, prompt, retry=2)
-                single_qa_res.append({"dimension": dimension, "result": local_result})
-            qa_response = {"qaId": qa["qaId"], "result": single_qa_res}
-            single_content_res.append(qa_response)
+            for dimension in self.prompts:
+                local_result = qa_res[dimension]
+                if local_result is None:
+                    # 请求失败的维度记为不满足标准，并标记失败，不影响其它QA对及维度的结果
+                    failed_count += 1
+                    single_qa_res.append({"dimension": dimension, "result": False, "status": "failed"})
+                else:
+                    single_qa_res.append({"dimension": dimension, "result": local_result, "status": "success"})
+            single_content_res.append({"qaId": qa["qaId"], "result": single_qa_res})
 
         sample[self.text_key] = "Sucess"
         self.save_sample(single_content_res, sample)
         cost_time = time.time() - start
+        if failed_count:
+            logger.warning(f"task id: {self.task_id}, {failed_count} of {len(qas) * len(self.prompts)} "
+                           f"evaluations failed")
         logger.info(f"task id: {self.task_id}, method: QAConditionEvaluator costs {cost_time:.6f} s")
         return sample
 
@@ -86,7 +119,33 @@ class QAConditionEvaluator(LLM):
             prompts_dict[name] = dimension_prompt
         return prompts_dict
 
-    def _llm_call_parse(self, data: Dict, prompt: str, retry: int = 2):
+    def build_packed_prompt(self) -> str:
+        """构建将所有维度合并在一次请求中评估的提示词"""
+        templates = self.packed_template_path.read_text(encoding="utf-8")
+        examples_dict = json.loads(self.examples_path.read_text(encoding="utf-8"))
+        descriptions = {dimension["dimension"]: dimension["description"] for dimension in self.dimensions}
+        criteria = ""
+        for idx, name in enumerate(self.dimension_names, start=1):
+            criteria += f"标准{idx}：\"{descriptions[name]}\"{self._process_examples(examples_dict.get(name))}"
+        return templates.format(criteria=criteria, question="{question}", answer="{answer}")
+
+    def _evaluate_packed(self, data: Dict) -> Dict[str, Optional[bool]]:
+        """合并评估一个QA对的所有维度，返回各维度结果，未解析出结果的维度为None"""
+        names = self.dimension_names
+        results = dict.fromkeys(names)
+        try:
+            response = self.llm(self.packed_prompt.format(question=data["question"], answer=data["answer"]))
+        except RuntimeError as e:
+            logger.error(f"method: QAConditionEvaluator execution error, cause by {e}")
+            return results
+        for idx, result in re.findall(self.packed_pattern, response):
+            idx = int(idx) - 1
+            if 0 <= idx < len(names) and results[names[idx]] is None:
+                results[names[idx]] = result == "Y"
+        return results
+
+    def _llm_call_parse(self, data: Dict, prompt: str, retry: int = 2) -> Optional[bool]:
+        """评估单个维度，响应格式不符合要求时重试，请求失败时返回None"""
         try:
             for _ in range(retry):
                 response = self.llm(prompt.format(question=data["question"], answer=data["answer"]))
@@ -95,4 +154,5 @@ class QAConditionEvaluator(LLM):
                     return "Y" in result[0]
         except RuntimeError as e:
             logger.error(f"method: QAConditionEvaluator execution error, cause by {e}")
+            return None
         return False
@@ -3,6 +3,9 @@
 import gc
 import os
 from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
 
 
 class BaseModel:
@@ -17,3 +20,14 @@ class BaseModel:
     def __del__(self):
         del self.infer
         gc.collect()
+
+
+def predict_directions(model: BaseModel, images: List[np.ndarray]) -> List[Tuple[int, float]]:
+    """批量预测图片方向，返回(旋转角度, 置信度)"""
+    outputs = []
+    # cls_res为模型预测结果，格式应当类似于: [('90', 0.9815167)]
+    for cls_res in model.infer.predict(images):
+        rotate_angle = int(cls_res.get("class_ids", np.array([0], dtype='int32')).item())
+        pro = float(cls_res.get("scores", np.array([0], dtype='int32')).item())
+        outputs.append((rotate_angle, pro))
+    return outputs
@@ -13,9 +13,10 @@ import numpy as np
 from loguru import logger
 
 from datamate.common.utils import bytes_transform
+from datamate.common.utils.model_server import get_model_server
 from datamate.core.base_op import Mapper
 
-from .base_model import BaseModel
+from .base_model import BaseModel, predict_directions
 
 
 class ImgDirectionCorrect(Mapper):
@@ -56,13 +57,10 @@ class ImgDirectionCorrect(Mapper):
         Args:
             image: 待预测的图片
             file_name: 文件名
-            model: 使用的模型， vertical_model 和 standard_model
+            model: 方向分类模型服务
         Returns: 旋转后的图片
         """
-        # cls_res为模型预测结果，格式应当类似于: [('90', 0.9815167)]
-        cls_res = model.infer.predict([image])[0]
-        rotate_angle = int(cls_res.get("class_ids", np.array([0], dtype='int32')).item())
-        pro = float(cls_res.get("scores", np.array([0], dtype='int32')).item())
+        rotate_angle, pro = model.infer(image)
         logger.info(
             f"fileName: {file_name}, model detect result is {rotate_angle} with confidence {pro}")
         if rotate_angle == 90 and pro > 0.89:
@@ -95,7 +93,8 @@ class ImgDirectionCorrect(Mapper):
         return dst_img
 
     def init_model(self, *args, **kwargs):
-        return BaseModel(*args, **kwargs)
+        # 各算子actor共用一份模型，请求在模型服务中合并为批次推理
+        return get_model_server("img_direction_correct", BaseModel, predict_directions, op_kwargs=kwargs)
 
     def execute(self, sample: Dict[str, Any]):
         start = time.time()
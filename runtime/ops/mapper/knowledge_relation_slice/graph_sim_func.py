@@ -3,8 +3,10 @@
 
 
 import math
+from collections import Counter
 from multiprocessing import Pool, cpu_count
 
+import numpy as np
 from six import iteritems
 from six.moves import range
 from loguru import logger
@@ -106,3 +108,80 @@ class SimilarityAlgBM25(object):
         eps = EPSILON * self.average_idf
         for word in negative_idfs_list:
             self.idf_dict[word] = eps
+
+
+class IncrementalBM25Index(object):
+    """
+    BM25 index that supports removing documents.
+
+    The corpus is counted once and stored as a sparse term matrix in posting lists
+    (term -> document ids, term frequencies). Removing a document updates document
+    frequencies, average document length and IDF over the remaining documents, so
+    scores match a SimilarityAlgBM25 rebuilt on the remaining documents while removed
+    documents are masked out with -inf.
+    """
+
+    def __init__(self, corpus_docs):
+        self.vocab = {}
+        posting_docs = []
+        posting_tfs = []
+        doc_len = []
+        self.doc_terms = []
+        for doc_id, document_file in enumerate(corpus_docs):
+            doc_len.append(len(document_file))
+            term_ids = []
+            for word, freq in Counter(document_file).items():
+                term_id = self.vocab.setdefault(word, len(self.vocab))
+                if term_id == len(posting_docs):
+                    posting_docs.append([])
+                    posting_tfs.append([])
+                posting_docs[term_id].append(doc_id)
+                posting_tfs[term_id].append(freq)
+                term_ids.append(term_id)
+            self.doc_terms.append(np.array(term_ids, dtype=np.int64))
+
+        self.postings = [(np.array(docs, dtype=np.int64), np.array(tfs, dtype=np.float64))
+                         for docs, tfs in zip(posting_docs, posting_tfs)]
+        self.doc_len = np.array(doc_len, dtype=np.float64)
+        self.doc_freqs = np.array([len(docs) for docs in posting_docs], dtype=np.float64)
+        self.active = np.ones(len(doc_len), dtype=bool)
+        self.corpus_files_size = len(doc_len)
+        self.total_len = float(sum(doc_len))
+        self._idf = None
+
+    def remove(self, index):
+        """Mask a document so that it is neither scored nor counted in corpus statistics."""
+        if not self.active[index]:
+            return
+        self.active[index] = False
+        self.corpus_files_size -= 1
+        self.total_len -= self.doc_len[index]
+        self.doc_freqs[self.doc_terms[index]] -= 1
+        self._idf = None
+
+    def get_idf(self):
+        if self._idf is None:
+            present = self.doc_freqs > 0
+            idf = np.log(self.corpus_files_size - self.doc_freqs + 0.5) - np.log(self.doc_freqs + 0.5)
+            average_idf = idf[present].sum() / np.count_nonzero(present)
+            self._idf = np.where(idf < 0, EPSILON * average_idf, idf)
+        return self._idf
+
+    def get_sim_scores(self, document):
+        """Scores of all documents for the query, removed documents score -inf."""
+        scores = np.zeros(len(self.doc_len), dtype=np.float64)
+        if self.corpus_files_size < 1:
+            scores[:] = -np.inf
+            return scores
+
+        idf = self.get_idf()
+        avg_dl = self.total_len / self.corpus_files_size
+        norm = PARAM_K1 * (1 - PARAM_B + PARAM_B * self.doc_len / avg_dl)
+        for word in document:
+            term_id = self.vocab.get(word)
+            if term_id is None:
+                continue
+            docs, tfs = self.postings[term_id]
+            scores[docs] += idf[term_id] * tfs * (PARAM_K1 + 1) / (tfs + norm[docs])
+        scores[~self.active] = -np.inf
+        return scores
@@ -6,9 +6,11 @@ __all__ = ['build_llm_prompt', 'get_json_list']
 
 import math
 
-import jieba
+import numpy as np
 from loguru import logger
 
+from datamate.common.utils.tokenizer import lcut
+
 from . import graph_sim_func as bm25
 from .knowledge_slice import TextSegmentationOperator
 
@@ -58,48 +60,18 @@ class KnowledgeSlice:
         return chunks
 
 
-class BM25Model:
-    def __init__(self, data_list):
-        self.data_list = data_list
-        self.corpus = self.load_corpus()
-
-    def bm25_similarity(self, query, num_best=1):
-        query = jieba.lcut(query)
-        bm = bm25.SimilarityAlgBM25(self.corpus)
-        scores = bm.get_sim_scores(query)
-        id_score = [(i, score) for i, score in enumerate(scores)]
-        id_score.sort(key=lambda e: e[1], reverse=True)
-
-        return id_score[0: num_best]
-
-    def load_corpus(self):
-        corpus = [jieba.lcut(data) for data in self.data_list]
-
-        return corpus
-
-
 class KnowledgeGraph:
     # class for document segmentation and create relation between knowledge
-    def __init__(self, corpus_file_string, chunk_size=500, overlap_size=100, kg_relation=True):
+    def __init__(self, corpus_file_string, chunk_size=500, overlap_size=100, kg_relation=True,
+                 search_space_size=50):
         self.corpus_file_string = corpus_file_string
         self.chunk_size = chunk_size
         self.overlap_size = overlap_size
         self.kg_relation = kg_relation
+        self.search_space_size = search_space_size
         self.slicing_corpus = []
         self.knowledge_slice = KnowledgeSlice(self.corpus_file_string, self.chunk_size, self.overlap_size)
 
-    @staticmethod
-    def update_gallery_list(gallery_list, iterated_dict):
-        # get a gallery list which not in iterated_dict
-        gallery_list_update = []
-        gallery_list_index = []
-        for i, _ in enumerate(gallery_list):
-            if i not in iterated_dict:
-                gallery_list_update.append(gallery_list[i])
-                gallery_list_index.append(i)
-
-        return gallery_list_update, gallery_list_index
-
     def document_slicing(self):
         json_list = []
         all_slices_info = self.knowledge_slice.execute()
@@ -115,41 +87,36 @@ class KnowledgeGraph:
         # knowledge relation for each paragraph
         if not self.kg_relation:
             return slicing_corpus_list
-        iterated_dict = {}
         kr_result_json_list = []
-        gallery_list = []
-        kr_relation_list = []
 
         if len(slicing_corpus_list) < 3:
             return slicing_corpus_list
 
-        for _, item in enumerate(slicing_corpus_list):
-            gallery_list.append(item['slice_data'])
-
-        for k, item in enumerate(slicing_corpus_list):
-            if k not in iterated_dict:
-                iterated_dict[k] = 1
-                cur_gallery_list, cur_gallery_src_index = self.update_gallery_list(gallery_list, iterated_dict)
-                if len(cur_gallery_list) < 1:
-                    kr_result_json_list.append({
-                        "slice_data": item['slice_data']
-                    })
-                    return kr_result_json_list
-                bm25_class = BM25Model(cur_gallery_list)
-                id_scores = bm25_class.bm25_similarity(item['slice_data'], 1)
-                kr_result_doc = item['slice_data'] + cur_gallery_list[id_scores[0][0]]
+        gallery_list = [item['slice_data'] for item in slicing_corpus_list]
+        # tokenize the window once, paired chunks are masked in the index instead of rebuilding the gallery
+        corpus = [lcut(data) for data in gallery_list]
+        bm25_index = bm25.IncrementalBM25Index(corpus)
+
+        for k, slice_data in enumerate(gallery_list):
+            if not bm25_index.active[k]:
+                continue
+            bm25_index.remove(k)
+            if bm25_index.corpus_files_size < 1:
                 kr_result_json_list.append({
-                    "slice_data": kr_result_doc
+                    "slice_data": slice_data
                 })
-                if cur_gallery_src_index[id_scores[0][0]] not in iterated_dict:
-                    iterated_dict[cur_gallery_src_index[id_scores[0][0]]] = 1
-            else:
-                continue
+                return kr_result_json_list
+            best_index = int(np.argmax(bm25_index.get_sim_scores(corpus[k])))
+            kr_result_json_list.append({
+                "slice_data": slice_data + gallery_list[best_index]
+            })
+            bm25_index.remove(best_index)
 
         return kr_result_json_list
 
-    def build_graph_efficiently(self, search_space_size=50):
+    def build_graph_efficiently(self):
         # build knowledge relation in a efficient way
+        search_space_size = self.search_space_size
         knowledge_total_num = len(self.slicing_corpus)
         knowledge_chunk_num = math.ceil(knowledge_total_num / search_space_size)
         knowledge_relation_result = []
@@ -174,9 +141,9 @@ class KnowledgeGraph:
         return kr_result_list_json
 
 
-def get_json_list(txt_string, chunk_size=500, overlap_size=100, kg_relation=True):
+def get_json_list(txt_string, chunk_size=500, overlap_size=100, kg_relation=True, search_space_size=50):
     if len(txt_string) > 0:
-        kg_extract = KnowledgeGraph(txt_string, chunk_size, overlap_size, kg_relation)
+        kg_extract = KnowledgeGraph(txt_string, chunk_size, overlap_size, kg_relation, search_space_size)
         kr_result_json_list = kg_extract.knowledge_corpus_list_json()
     else:
         kr_result_json_list = []
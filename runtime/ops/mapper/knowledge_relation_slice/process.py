@@ -18,6 +18,8 @@ from .knowledge_relation import get_json_list
 CHUNK_SIZE = 500
 # 相邻切片重合长度
 OVERLAP_SIZE = 100
+# 关联切片的搜索窗口大小
+SEARCH_SPACE_SIZE = 50
 
 
 class KnowledgeRelationSlice(Mapper):
@@ -33,11 +35,14 @@ class KnowledgeRelationSlice(Mapper):
         else:
             self.overlap_size = kwargs.get("overlap_size")
 
+        self.search_space_size = int(kwargs.get("search_space_size", SEARCH_SPACE_SIZE))
+
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         start_time = time.time()
         self.read_file_first(sample)
 
-        chunk_item = get_json_list(sample[self.text_key], chunk_size=self.chunk_size, overlap_size=self.overlap_size)
+        chunk_item = get_json_list(sample[self.text_key], chunk_size=self.chunk_size, overlap_size=self.overlap_size,
+                                   search_space_size=self.search_space_size)
         chunk_item_json = json.dumps(chunk_item, ensure_ascii=False)
         sample[self.text_key] = chunk_item_json
 
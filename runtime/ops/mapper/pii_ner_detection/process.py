@@ -1,11 +1,74 @@
+import os
+import re
+from collections import defaultdict
+from typing import List, Tuple
+
 import presidio_analyzer as analyzer
 import presidio_anonymizer as anonymizer
 import spacy
 
+from datamate.common.utils.model_server import get_model_server
+from datamate.common.utils.text_splitter import TextSplitter
 from datamate.core.base_op import Mapper
 
 from .custom_entities import id_recognizer, phone_recognizer, zipcode_recognizer, url_recognizer
 
+CUSTOM_RECOGNIZERS = [id_recognizer, phone_recognizer, zipcode_recognizer, url_recognizer]
+
+# NER实体（人名、地名、机构名等）的候选特征：中文字符或首字母大写的英文单词，不含候选特征的切片只做正则识别
+NER_CANDIDATE_PATTERN = re.compile(r"[\u4e00-\u9fff]|\b[A-Z][a-z]+")
+
+
+def load_text_analyzer() -> analyzer.AnalyzerEngine:
+    spacy.load("zh_core_web_sm")
+    provider = analyzer.nlp_engine.NlpEngineProvider(
+        nlp_configuration={
+            "nlp_engine_name": "spacy",
+            "models": [
+                {"lang_code": "zh", "model_name": "zh_core_web_sm"}
+            ]
+        }
+    )
+
+    # 创建NLP Engine
+    nlp_engine = provider.create_engine()
+
+    #  初始化AnalyzerEngine
+    text_analyzer = analyzer.AnalyzerEngine(nlp_engine=nlp_engine, supported_languages=["zh"])
+    text_analyzer.registry.load_predefined_recognizers()
+    for recognizer in CUSTOM_RECOGNIZERS:
+        text_analyzer.registry.add_recognizer(recognizer)
+    return text_analyzer
+
+
+def load_pattern_recognizers(language: str) -> List[analyzer.PatternRecognizer]:
+    """加载不依赖NLP模型的正则识别器"""
+    registry = analyzer.RecognizerRegistry()
+    registry.load_predefined_recognizers(languages=[language])
+    for recognizer in CUSTOM_RECOGNIZERS:
+        registry.add_recognizer(recognizer)
+    return [recognizer for recognizer in registry.get_recognizers(language=language, all_fields=True)
+            if isinstance(recognizer, analyzer.PatternRecognizer)]
+
+
+def analyze_texts(text_analyzer: analyzer.AnalyzerEngine,
+                  items: List[Tuple[str, str]]) -> List[List[Tuple[str, int, int, float]]]:
+    """批量识别实体，入参为(文本, 语言)，同一语言的文本通过nlp.pipe批量处理，返回(实体类型, 起始位置, 结束位置, 置信度)"""
+    outputs = [[] for _ in items]
+    language_idxes = defaultdict(list)
+    for idx, (_, language) in enumerate(items):
+        language_idxes[language].append(idx)
+    batch_analyzer = analyzer.BatchAnalyzerEngine(analyzer_engine=text_analyzer)
+    # nlp.pipe的进程数，大于1时同一批次的文本在多个进程中并行处理
+    n_process = int(os.getenv("PII_NLP_PROCESSES", "1"))
+    pipe_kwargs = {"n_process": n_process} if n_process > 1 else {}
+    for language, idxes in language_idxes.items():
+        results = batch_analyzer.analyze_iterator([items[idx][0] for idx in idxes], language=language,
+                                                  batch_size=len(idxes), **pipe_kwargs)
+        for idx, analyzer_results in zip(idxes, results):
+            outputs[idx] = [(res.entity_type, res.start, res.end, res.score) for res in analyzer_results]
+    return outputs
+
 
 class PiiDetector(Mapper):
     custom_ops = True
@@ -13,32 +76,24 @@ class PiiDetector(Mapper):
     def __init__(self, *args, **kwargs):
         super(PiiDetector, self).__init__(*args, **kwargs)
         self.support_language = kwargs.get("support_language", "zh")
+        # 按段落、句子将长文档切分为不超过chunk_size的切片分别识别，避免超出spaCy的max_length限制；
+        # 相邻切片重叠chunk_overlap个字符（不小于最长实体），被截断处切开的实体在下一切片中可完整识别
+        chunk_size = int(kwargs.get("chunk_size", os.getenv("PII_CHUNK_SIZE", "5000")))
+        chunk_overlap = int(kwargs.get("chunk_overlap", os.getenv("PII_CHUNK_OVERLAP", "128")))
+        self.text_splitter = TextSplitter(-1, chunk_size, min(chunk_overlap, chunk_size // 2))
 
-        self.nlp_engine = None
         self.text_analyzer = None
+        self.pattern_recognizers = []
         self.anom = None
 
         self.init_model(*args, **kwargs)
 
     def init_model(self, *args, **kwargs):
-        spacy.load("zh_core_web_sm")
-        provider = analyzer.nlp_engine.NlpEngineProvider(
-            nlp_configuration={
-                "nlp_engine_name": "spacy",
-                "models": [
-                    {"lang_code": "zh", "model_name": "zh_core_web_sm"}
-                ]
-            }
-        )
-
-        # 创建NLP Engine
-        self.nlp_engine = provider.create_engine()
-
-        #  初始化AnalyzerEngine
-        self.text_analyzer = analyzer.AnalyzerEngine(nlp_engine=self.nlp_engine, supported_languages=["zh"])
-        self.text_analyzer.registry.load_predefined_recognizers()
-        for recognizer in [id_recognizer, phone_recognizer, zipcode_recognizer, url_recognizer]:
-            self.text_analyzer.registry.add_recognizer(recognizer)
+        # 各算子actor共用一份spaCy模型，识别请求在模型服务中合并为批次处理
+        self.text_analyzer = get_model_server("pii_text_analyzer", load_text_analyzer, analyze_texts,
+                                              op_kwargs=kwargs)
+
+        self.pattern_recognizers = load_pattern_recognizers(self.support_language)
 
         # 初始化AnonymizerEngine
         self.anom = anonymizer.AnonymizerEngine()
@@ -46,7 +101,55 @@ class PiiDetector(Mapper):
     def execute(self, sample):
         self.read_file_first(sample)
         text = sample.get('text')
-        analyzer_results = self.text_analyzer.analyze(text=text, language=self.support_language)
-        res = self.anom.anonymize(text=text, analyzer_results=analyzer_results)
+        res = self.anom.anonymize(text=text, analyzer_results=self.analyze(text))
         sample['text'] = res.text
         return sample
+
+    def analyze(self, text: str) -> List[analyzer.RecognizerResult]:
+        """分片识别文本中的实体，返回全文坐标下的识别结果"""
+        spans = self.text_splitter.split_spans(text)
+        ner_spans, pattern_spans = [], []
+        for start, end in spans:
+            if NER_CANDIDATE_PATTERN.search(text, start, end):
+                ner_spans.append((start, end))
+            else:
+                pattern_spans.append((start, end))
+
+        analyzer_results = []
+        # 含候选实体的切片批量提交给模型服务，识别结果的位置加上切片起始位置映射回全文
+        if ner_spans:
+            chunk_results = self.text_analyzer.infer_batch([(text[start:end], self.support_language)
+                                                            for start, end in ner_spans])
+            for (offset, _), results in zip(ner_spans, chunk_results):
+                analyzer_results.extend(
+                    analyzer.RecognizerResult(entity_type=entity_type, start=start + offset, end=end + offset,
+                                              score=score)
+                    for entity_type, start, end, score in results)
+        # 不含候选实体的切片只需正则识别，无需NLP模型
+        for offset, end in pattern_spans:
+            chunk = text[offset:end]
+            for recognizer in self.pattern_recognizers:
+                for res in recognizer.analyze(chunk, recognizer.supported_entities, None) or []:
+                    analyzer_results.append(
+                        analyzer.RecognizerResult(entity_type=res.entity_type, start=res.start + offset,
+                                                  end=res.end + offset, score=res.score))
+        return self.merge_results(analyzer_results)
+
+    @staticmethod
+    def merge_results(results: List[analyzer.RecognizerResult]) -> List[analyzer.RecognizerResult]:
+        """
+        合并重叠切片的识别结果：同一实体在多个切片中重复识别时保留置信度最高的一个，
+        被切片边界截断的实体包含于同类型的完整实体中，予以去除
+        """
+        best = {}
+        for res in results:
+            key = (res.entity_type, res.start, res.end)
+            if key not in best or res.score > best[key].score:
+                best[key] = res
+        merged = []
+        # 同类型实体按起始位置升序、长度降序排列，被前一个实体包含的结果即为截断的片段
+        for res in sorted(best.values(), key=lambda item: (item.entity_type, item.start, -item.end)):
+            if merged and merged[-1].entity_type == res.entity_type and merged[-1].end >= res.end:
+                continue
+            merged.append(res)
+        return merged
@@ -11,7 +11,7 @@ from typing import Dict, Any
 
 from loguru import logger
 
-from datamate.common.utils.aho_corasick import AhoCorasic
+from datamate.common.utils.lexicon_scanner import LexiconScanner
 from datamate.core.base_op import Mapper
 
 
@@ -25,7 +25,14 @@ class PoliticalWordCleaner(Mapper):
         special_symbols_path = str(root_path / 'special_symbols.txt')
         self.special_symbols = self.load_words_list(special_symbols_path)
         self.political_words = self.load_words_list(political_file_path)
-        self.ac_automaton = AhoCorasic(self.political_words)
+        # 与其它敏感词算子使用相同的合并词表，流水线中的敏感词算子共用同一次扫描结果；
+        # 色情、暴力词表直接读取色情暴力词过滤算子的资源文件，不另存副本
+        sexual_and_violent_path = Path(__file__).parent.parent / 'sexual_and_violent_word_cleaner'
+        self.scanner = LexiconScanner({
+            "political": self.political_words,
+            "sexual": self.load_words_list(str(sexual_and_violent_path / 'resources' / 'sexual.txt')),
+            "violent": self.load_words_list(str(sexual_and_violent_path / 'resources' / 'violent.txt')),
+        }, self.special_symbols)
 
     @staticmethod
     def load_words_list(path):
@@ -34,35 +41,14 @@ class PoliticalWordCleaner(Mapper):
             words = set(f.read().splitlines())
         return words
 
-    @staticmethod
-    def words_replace(target_strings: list, text: str):
-        """
-        目标字符串替换。
-
-        Args:
-            target_strings: 前缀树根节点。
-            text: 待清洗文本。
-        returns:
-            清洗后文本。
-        """
-        target_strings.sort(key=lambda x: -len(x))
-        for s in target_strings:
-            tmp_text = text.replace(s, '*' * len(s))
-            text = tmp_text
-        return text
-
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         start = time.time()
         self.read_file_first(sample)
-        sample[self.text_key] = self._political_word_filter(sample[self.text_key])
+        sample[self.text_key] = self._political_word_filter(sample)
         logger.info(
             f"fileName: {sample[self.filename_key]}, method: PoliticalWordCleaner costs {time.time() - start:6f} s")
         return sample
 
-    def _political_word_filter(self, text):
-        """词语过滤主函数，分行过滤"""
-        filtered_rows = []
-        for row in text.split('\n'):
-            matched_words = self.ac_automaton.search(row, self.special_symbols)
-            filtered_rows.append(self.words_replace(matched_words, row))
-        return '\n'.join(filtered_rows)
+    def _political_word_filter(self, sample):
+        """词语过滤主函数，匹配敏感词区间后一次遍历完成替换，敏感词不跨行匹配"""
+        return self.scanner.replace(sample, self.text_key, ["political"])
@@ -11,7 +11,7 @@ from typing import Dict, Any
 
 from loguru import logger
 
-from datamate.common.utils.aho_corasick import AhoCorasic
+from datamate.common.utils.lexicon_scanner import LexiconScanner
 from datamate.core.base_op import Mapper
 
 
@@ -20,6 +20,9 @@ class SexualAndViolentWordCleaner(Mapper):
     root_path = Path(__file__).parent / 'resources'
     VIOLENT_FILE_PATH = str(root_path / 'violent.txt')
     SEXUAL_FILE_PATH = str(root_path / 'sexual.txt')
+    # 政治词表直接读取政治词过滤算子的资源文件，不另存副本
+    POLITICAL_FILE_PATH = str(Path(__file__).parent.parent / 'political_word_cleaner' / 'resources'
+                              / 'political.txt')
     SPECIAL_SYMBOLS_PATH = str(root_path / 'special_symbols.txt')
 
     def __init__(self, *args, **kwargs):
@@ -27,8 +30,12 @@ class SexualAndViolentWordCleaner(Mapper):
         self.violent_words = self.load_words_list(self.VIOLENT_FILE_PATH)
         self.sexual_words = self.load_words_list(self.SEXUAL_FILE_PATH)
         self.special_symbols = self.load_words_list(self.SPECIAL_SYMBOLS_PATH)
-        self.words = self.violent_words | self.sexual_words
-        self.ac_automaton = AhoCorasic(self.words)
+        # 与其它敏感词算子使用相同的合并词表，流水线中的敏感词算子共用同一次扫描结果
+        self.scanner = LexiconScanner({
+            "political": self.load_words_list(self.POLITICAL_FILE_PATH),
+            "sexual": self.sexual_words,
+            "violent": self.violent_words,
+        }, self.special_symbols)
 
     @staticmethod
     def load_words_list(path):
@@ -37,35 +44,14 @@ class SexualAndViolentWordCleaner(Mapper):
             words = set(f.read().splitlines())
         return words
 
-    @staticmethod
-    def words_replace(target_strings: list, text: str):
-        """
-        目标字符串替换。
-
-        Args:
-            target_strings: 前缀树根节点。
-            text: 待清洗文本。
-        returns:
-            清洗后文本。
-        """
-        target_strings.sort(key=lambda x: -len(x))
-        for s in target_strings:
-            tmp_text = text.replace(s, '*' * len(s))
-            text = tmp_text
-        return text
-
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         start = time.time()
         self.read_file_first(sample)
-        sample[self.text_key] = self._sexual_and_violent_word_filter(sample[self.text_key])
+        sample[self.text_key] = self._sexual_and_violent_word_filter(sample)
         logger.info(f"fileName: {sample[self.filename_key]}, "
                     f"method: SexualAndViolentWordCleaner costs {time.time() - start:6f} s")
         return sample
 
-    def _sexual_and_violent_word_filter(self, text):
-        """词语过滤主函数，分行过滤"""
-        filtered_rows = []
-        for row in text.split('\n'):
-            matched_words = self.ac_automaton.search(row, self.special_symbols)
-            filtered_rows.append(self.words_replace(matched_words, row))
-        return '\n'.join(filtered_rows)
+    def _sexual_and_violent_word_filter(self, sample):
+        """词语过滤主函数，匹配敏感词区间后一次遍历完成替换，敏感词不跨行匹配"""
+        return self.scanner.replace(sample, self.text_key, ["sexual", "violent"])
@@ -5,12 +5,12 @@
 Description: URL网址匿名化
 Create: 2024/12/26 15:43
 """
-import re
 import time
 from typing import Dict, Any
 
 from loguru import logger
 
+from datamate.common.utils.pii_scrubber import get_pii_scrubber
 from datamate.core.base_op import Mapper
 
 
@@ -19,19 +19,15 @@ class AnonymizedUrlCleaner(Mapper):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.url_pattern = r'((?:(?:https?|ftp|file)://|(?<![a-zA-Z\-\.])www\.)' \
-                           r'[\-A-Za-z0-9\+&@\(\)#/%\?=\^~_|!:\,\.\;]+[\-A-Za-z0-9\+&@#/%=\~_\|])' \
-                           r'(?![\-A-Za-z0-9\+&@#/%=\~_\|])'
-        self.url_re_compile = re.compile(self.url_pattern, re.MULTILINE)
+        # 与其它匿名化算子共用同一次扫描结果
+        self.scrubber = get_pii_scrubber()
 
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         start = time.time()
         self.read_file_first(sample)
-        sample[self.text_key] = self._url_filter(sample[self.text_key])
+        sample[self.text_key] = self._url_filter(sample)
         logger.info(f"fileName: {sample[self.filename_key]}, method: UrlCleaner costs {time.time() - start:6f} s")
         return sample
 
-    def _url_filter(self, input_data: str):
-        input_data = ''.join(['【', input_data, '】'])
-        text = self.url_re_compile.sub("<url>", input_data)
-        return text[1:-1]
+    def _url_filter(self, sample: Dict[str, Any]):
+        return self.scrubber.scrub(sample, self.text_key, ["url"])
@@ -4,39 +4,38 @@
 Description: 医疗图片按坐标切片
 Create: 2025/02/08 11:00
 """
-import copy
 import time
-import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 import xml.etree.ElementTree as ET
 from loguru import logger
 
 import numpy as np
 import cv2
-from openslide import OpenSlide
 
 from datamate.core.base_op import Slicer
 from datamate.common.utils import bytes_transform
+from datamate.common.utils.slide_reader import ThreadLocalSlide, get_slide_workers, ordered_parallel_map
 
 
 class AnnotationSlicer(Slicer):
 
     def __init__(self, *args, **kwargs):
         super(AnnotationSlicer, self).__init__(*args, **kwargs)
+        # 切片边长，为0时每个标注区域的外接矩形作为一个切片
+        self._tile_size = int(kwargs.get("tileSize", 0) or 0)
+        # 按切片边长切分时，切片与标注区域重叠面积占比不低于该值才保留
+        self._min_coverage = float(kwargs.get("minCoverage", 0.5))
         self.last_ops = True
 
     def execute(self, sample: Dict[str, Any]) -> List[Dict[str, Any]]:
         start = time.time()
 
-        slide: OpenSlide = OpenSlide(sample[self.filepath_key])
-        if not isinstance(slide, OpenSlide):
-            logger.error("Not desired <Image.Image> object.")
-
         annotation_path: str = sample["extraFilePath"]
         annotations = self.parse_xml_annotations(annotation_path)
 
-        patch_num = self.auto_coordinate_slicer(sample, slide, annotations)
+        with ThreadLocalSlide(sample[self.filepath_key]) as slide:
+            patch_num = self.auto_coordinate_slicer(sample, slide, annotations)
         sample["slice_num"] = patch_num
 
         file_name = sample[self.filename_key]
@@ -74,44 +73,73 @@ class AnnotationSlicer(Slicer):
     def auto_coordinate_slicer(
             self,
             original_sample: Dict,
-            slide: OpenSlide,
+            slide: ThreadLocalSlide,
             annotations: List
     ) -> int:
         """
-        自动根据给定的标注文件切片原图像
+        自动根据给定的标注文件切片原图像，各切片区域在线程池中并行读取、编码并保存
 
         Return: 
-            List[Content] 每个 content 都是一个 data 为 patch 的 content
+            切片数量
         """
         wsi_width, wsi_height = slide.dimensions
 
-        patch_no = 0
+        regions = []
         # 遍历每个 Annotation
         for _, annotation in enumerate(annotations):
-            part_of_group = annotation['part_of_group']
             coordinates = annotation['coordinates']
 
             # 转换坐标为整数（确保在图像范围内）
             coordinates = coordinates.clip(min=0, max=(wsi_width, wsi_height))
 
-            # 创建掩码（mask）图像
-            mask = np.zeros((wsi_height, wsi_width), dtype=np.uint8)
-            cv2.fillPoly(mask, [coordinates], 255)  # 填充多边形区域为白色
-
-            # 找到掩码中的非零区域（肿瘤区域）
-            x, y, w, h = cv2.boundingRect(coordinates)  # 获取多边形的边界框
-
+            # 获取多边形的边界框
+            x, y, w, h = cv2.boundingRect(coordinates)
+            if w == 0 or h == 0:
+                logger.warning(f"Annotation of group {annotation['part_of_group']} is empty, skip it.")
+                continue
+            if self._tile_size > 0:
+                regions.extend(self.get_tile_regions(coordinates, (x, y, w, h)))
+            else:
+                regions.append((x, y, w, h))
+
+        def slice_region(item: Tuple[int, Tuple[int, int, int, int]]):
+            patch_no, (x, y, w, h) = item
             # 读取 WSI 图像的切片区域
-            region = slide.read_region((x, y), 0, (w, h))
+            region_np = slide.read_region_rgb((x, y), 0, (w, h))
+            patch_sample = self.make_patch_sample(original_sample, bytes_transform.numpy_to_bytes(region_np, '.png'))
+            self.save_patch_sample(patch_sample, patch_no, save_format="image")
 
-            # 转换为 NumPy 数组
-            region_np = np.array(region.convert("RGB"))
+        for _ in ordered_parallel_map(slice_region, enumerate(regions, start=1), get_slide_workers()):
+            pass
 
-            patch_sample = copy.deepcopy(original_sample)
-            patch_sample[self.data_key] = bytes_transform.numpy_to_bytes(region_np, '.png')
-            patch_no += 1
-            self.save_patch_sample(patch_sample, patch_no, save_format="image")
+        logger.info(f">>> {len(annotations)} annotations found and sliced into {len(regions)} patches.")
 
-        logger.info(f">>> {patch_no} annotations found and sliced.")
+        return len(regions)
 
-        return patch_no
+    def get_tile_regions(self, coordinates: np.ndarray, bbox: Tuple[int, int, int, int]) -> List:
+        """
+        将标注区域的外接矩形按切片边长切分，在切片局部坐标系中栅格化多边形计算重叠面积，
+        掩码大小与切片边长一致，与整张病理图片的尺寸无关。
+        没有切片满足重叠面积要求时（如标注区域小于切片），保留重叠面积最大的切片并裁剪到外接矩形内，
+        标注区域不会被丢弃
+        """
+        x, y, w, h = bbox
+        size = self._tile_size
+        mask = np.zeros((size, size), dtype=np.uint8)
+        regions = []
+        best_tile, best_coverage = (x, y), -1
+        for tile_y in range(y, y + h, size):
+            for tile_x in range(x, x + w, size):
+                mask[:] = 0
+                cv2.fillPoly(mask, [coordinates - np.array([tile_x, tile_y], dtype=np.int32)], 255)
+                coverage = cv2.countNonZero(mask)
+                if coverage >= self._min_coverage * size * size:
+                    regions.append((tile_x, tile_y, size, size))
+                if coverage > best_coverage:
+                    best_tile, best_coverage = (tile_x, tile_y), coverage
+        if not regions:
+            tile_x, tile_y = best_tile
+            regions.append((tile_x, tile_y, min(size, x + w - tile_x), min(size, y + h - tile_y)))
+            logger.info(f"No tile of annotation {bbox} reaches the coverage {self._min_coverage}, "
+                        f"keep the tile {regions[0]} clipped to the annotation.")
+        return regions
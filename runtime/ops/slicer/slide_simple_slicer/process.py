@@ -4,19 +4,26 @@
 Description: 医疗图片按坐标切片
 Create: 2025/02/08 11:00
 """
-import copy
+import io
+import math
 import time
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Iterator
 
 import itertools
 from loguru import logger
 
-from openslide import OpenSlide
+import cv2
 import numpy as np
 
 from datamate.core.base_op import Slicer
 
-from datamate.common.utils import bytes_transform
+from datamate.common.utils.slide_reader import ThreadLocalSlide, get_slide_workers, get_tissue_mask, \
+    ordered_parallel_map
+
+# 组织检测缩略图的最大边长
+TISSUE_THUMBNAIL_MAX_SIZE = 4096
+# 组织检测缩略图中每个切片至少占据的像素边长
+TISSUE_THUMBNAIL_TILE_PIXELS = 4
 
 
 class SimpleSlicer(Slicer):
@@ -26,6 +33,13 @@ class SimpleSlicer(Slicer):
 
         self._target_size = kwargs.get("sliceSize", [128, 128])
         self._overlap = kwargs.get("overlap", 0)
+        # 切片中组织区域占比低于该值时视为背景跳过，默认为0，不做组织检测，保留全部切片
+        self._min_tissue_ratio = float(kwargs.get("minTissueRatio", 0) or 0)
+        # 切片编码格式：png、jpg或npy（不压缩的RGB数组）
+        self._encode_format = kwargs.get("encodeFormat", "png")
+        # 默认与cv2的PNG压缩级别一致
+        self._png_compression = int(kwargs.get("pngCompression", 3))
+        self._jpeg_quality = int(kwargs.get("jpegQuality", 95))
         self.last_ops = True
 
         if not isinstance(self._target_size, List):
@@ -41,19 +55,25 @@ class SimpleSlicer(Slicer):
                 f"<overlap> received an out of range value: {self._overlap}, "
                 f"but (0 <= overlap <= 1) is expected."
             )
+        if self._min_tissue_ratio < 0 or self._min_tissue_ratio > 1:
+            raise ValueError(
+                f"<minTissueRatio> received an out of range value: {self._min_tissue_ratio}, "
+                f"but (0 <= minTissueRatio <= 1) is expected."
+            )
+        if self._encode_format not in ("png", "jpg", "npy"):
+            raise ValueError(f"<encodeFormat> received as {self._encode_format}, but expected png, jpg or npy.")
+        self.target_file_type = self._encode_format
 
     def execute(self, sample: Dict[str, Any]) -> List[Dict]:
         start = time.time()
 
-        slide: OpenSlide = OpenSlide(sample["filePath"])
-        if not isinstance(slide, OpenSlide):
-            logger.error("Not desired <Image.Image> object.")
-        dimensions: tuple[int, int] = slide.dimensions
+        with ThreadLocalSlide(sample["filePath"]) as slide:
+            dimensions: Tuple[int, int] = slide.dimensions
 
-        target_size = self._target_size
-        overlap = self._overlap
+            target_size = self._target_size
+            overlap = self._overlap
 
-        patch_num = self.auto_simple_slicer(sample, slide, dimensions, target_size, overlap)
+            patch_num = self.auto_simple_slicer(sample, slide, dimensions, target_size, overlap)
         sample["slice_num"] = patch_num
 
         file_name = sample[self.filename_key]
@@ -64,35 +84,77 @@ class SimpleSlicer(Slicer):
     def auto_simple_slicer(
             self,
             original_sample: Dict[str, Any],
-            slide: OpenSlide,
+            slide: ThreadLocalSlide,
             dimensions: Tuple[int, int],
             target_size: Tuple[int, int],
             overlap: float
     ) -> int:
         """
-        自动根据给定规格切片原图像
+        自动根据给定规格切片原图像，跳过背景切片，其余切片在线程池中并行读取、编码并保存
 
-        Return: 
-            List[Content] 每个 content 都是一个 data 为 patch 的 content
+        Return:
+            切片数量
         """
         stride_x, stride_y = map(lambda x: int(x * (1 - overlap)), target_size)
         w, h = target_size
 
-        patch_no = 0
-        for x, y in itertools.product(
-                range(0, dimensions[0] - w + 1, stride_x),
-                range(0, dimensions[1] - h + 1, stride_y)
-        ):
-            # 切片
-            region = slide.read_region((x, y), 0, target_size)
+        tiles = itertools.product(
+            range(0, dimensions[0] - w + 1, stride_x),
+            range(0, dimensions[1] - h + 1, stride_y)
+        )
+        total = len(range(0, dimensions[0] - w + 1, stride_x)) * len(range(0, dimensions[1] - h + 1, stride_y))
+        if self._min_tissue_ratio > 0:
+            tiles = self.filter_tissue_tiles(slide, dimensions, (w, h), tiles)
 
-            region_np = np.array(region.convert("RGB"))
+        def slice_region(item: Tuple[int, Tuple[int, int]]):
+            patch_no, (x, y) = item
+            # 切片
+            region_np = slide.read_region_rgb((x, y), 0, (w, h))
+            patch_sample = self.make_patch_sample(original_sample, self.encode_patch(region_np))
+            self.save_patch_sample(patch_sample, patch_no, save_format="image")
 
-            patch_sample = copy.deepcopy(original_sample)
-            patch_sample[self.data_key] = bytes_transform.numpy_to_bytes(region_np, ".png")
+        patch_no = 0
+        for _ in ordered_parallel_map(slice_region, enumerate(tiles, start=1), get_slide_workers()):
             patch_no += 1
-            self.save_patch_sample(patch_sample, patch_no, save_format="image")
 
-        logger.info(f"One image sliced into pieces: {patch_no}")
+        logger.info(f"One image sliced into pieces: {patch_no}, {total - patch_no} background tiles skipped.")
 
         return patch_no
+
+    def filter_tissue_tiles(
+            self,
+            slide: ThreadLocalSlide,
+            dimensions: Tuple[int, int],
+            tile_size: Tuple[int, int],
+            tiles: Iterator[Tuple[int, int]]
+    ) -> Iterator[Tuple[int, int]]:
+        """在低分辨率缩略图上计算组织掩码，仅保留组织区域占比不低于阈值的切片，背景切片无需读取原图"""
+        downsample = max(1.0, min(tile_size) / TISSUE_THUMBNAIL_TILE_PIXELS,
+                         max(dimensions) / TISSUE_THUMBNAIL_MAX_SIZE)
+        thumbnail = slide.get_thumbnail_rgb((math.ceil(dimensions[0] / downsample),
+                                             math.ceil(dimensions[1] / downsample)))
+        mask = get_tissue_mask(thumbnail)
+        # 积分图，任意矩形区域内的组织像素数可在常数时间内求得
+        integral = cv2.integral(mask)
+        thumb_h, thumb_w = mask.shape
+        scale_x, scale_y = thumb_w / dimensions[0], thumb_h / dimensions[1]
+        for x, y in tiles:
+            x0 = min(int(x * scale_x), thumb_w - 1)
+            y0 = min(int(y * scale_y), thumb_h - 1)
+            x1 = min(max(math.ceil((x + tile_size[0]) * scale_x), x0 + 1), thumb_w)
+            y1 = min(max(math.ceil((y + tile_size[1]) * scale_y), y0 + 1), thumb_h)
+            tissue = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+            if tissue >= self._min_tissue_ratio * (x1 - x0) * (y1 - y0):
+                yield x, y
+
+    def encode_patch(self, region_np: np.ndarray) -> bytes:
+        """按配置的格式编码切片，PNG压缩级别越低、JPEG质量越低编码越快"""
+        if self._encode_format == "npy":
+            with io.BytesIO() as buffer:
+                np.save(buffer, region_np)
+                return buffer.getvalue()
+        if self._encode_format == "jpg":
+            params = [cv2.IMWRITE_JPEG_QUALITY, self._jpeg_quality]
+        else:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self._png_compression]
+        return cv2.imencode(f".{self._encode_format}", region_np, params)[1].tobytes()
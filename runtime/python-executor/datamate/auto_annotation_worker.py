@@ -7,15 +7,17 @@ inference using the ImageObjectDetectionBoundingBox operator, updating
 progress back to the same table so that the datamate-python backend and
 frontend can display real-time status.
 
-设计目标（最小可用版本）:
-- 单实例 worker，串行处理 `pending` 状态的任务。
-- 对指定数据集下的所有已完成文件逐张执行目标检测。
-- 按已处理图片数更新 `processed_images`、`progress`、`detected_objects`、`status` 等字段。
+设计目标:
+- 单实例 worker，最多同时处理 `AUTO_ANNOTATION_MAX_TASKS` 个 `pending` 状态的任务，
+  任务通过条件更新认领，避免重复执行。
+- 对指定数据集下的所有已完成文件按批（`AUTO_ANNOTATION_BATCH_SIZE`）执行目标检测：
+  下一批图片在线程池中预读解码，与当前批次的推理并行。
+- 各任务每次只提交一个批次，多个任务的批次在同一模型服务中排队推理，
+  大任务不会阻塞其它任务。
+- 文件标签、标注结果文件登记和任务进度按批次写入数据库。
 - 失败时将任务标记为 `failed` 并记录 `error_message`。
-
-注意:
-- 为了保持简单，目前不处理 "running" 状态的恢复逻辑；容器重启时，
-  已处于 running 的任务不会被重新拉起，需要后续扩展。
+- 启动时将上次异常退出时遗留的 `running` 任务重置为 `pending`，
+  重新执行时跳过已生成标注结果的文件。
 """
 from __future__ import annotations
 
@@ -25,12 +27,14 @@ import sys
 import threading
 import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, Set
 import urllib.error
 import urllib.request
 
+import cv2
 from loguru import logger
 from sqlalchemy import text
 
@@ -110,26 +114,16 @@ BACKEND_BASE_URL = os.getenv(
 AUTO_SYNC_ENABLED = os.getenv("AUTO_ANNOTATION_SYNC_ENABLED", "true").lower() == "true"
 AUTO_SYNC_TIMEOUT_SECONDS = float(os.getenv("AUTO_ANNOTATION_SYNC_TIMEOUT", "10"))
 
+MAX_CONCURRENT_TASKS = max(1, int(os.getenv("AUTO_ANNOTATION_MAX_TASKS", "2")))
+BATCH_SIZE = max(1, int(os.getenv("AUTO_ANNOTATION_BATCH_SIZE", "8")))
+DECODE_WORKERS = max(1, int(os.getenv("AUTO_ANNOTATION_DECODE_WORKERS", "4")))
 
-def _fetch_pending_task() -> Optional[Dict[str, Any]]:
-    """从 t_dm_auto_annotation_tasks 中取出一个 pending 任务。"""
+_decode_pool: Optional[ThreadPoolExecutor] = None
+_decode_pool_lock = threading.Lock()
 
-    sql = text(
-        """
-        SELECT id, name, dataset_id, dataset_name, config, file_ids, status,
-               total_images, processed_images, detected_objects, output_path
-        FROM t_dm_auto_annotation_tasks
-        WHERE status = 'pending' AND deleted_at IS NULL
-        ORDER BY created_at ASC
-        LIMIT 1
-        """
-    )
 
-    with SQLManager.create_connect() as conn:
-        result = conn.execute(sql).fetchone()
-        if not result:
-            return None
-        row = dict(result._mapping)  # type: ignore[attr-defined]
+def _parse_task_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """解析任务记录中的 config、file_ids 字段。"""
 
     # 兼容 config 字段为 JSONB（dict）或 text（str）的两种情况
     raw_cfg = row.get("config")
@@ -158,6 +152,61 @@ def _fetch_pending_task() -> Optional[Dict[str, Any]]:
     return row
 
 
+def _fetch_pending_tasks(limit: int) -> List[Dict[str, Any]]:
+    """从 t_dm_auto_annotation_tasks 中按创建时间取出最多 limit 个 pending 任务。"""
+
+    sql = text(
+        """
+        SELECT id, name, dataset_id, dataset_name, config, file_ids, status,
+               total_images, processed_images, detected_objects, output_path
+        FROM t_dm_auto_annotation_tasks
+        WHERE status = 'pending' AND deleted_at IS NULL
+        ORDER BY created_at ASC
+        LIMIT :limit
+        """
+    )
+
+    with SQLManager.create_connect() as conn:
+        rows = conn.execute(sql, {"limit": limit}).fetchall()
+        return [_parse_task_row(dict(r._mapping)) for r in rows]  # type: ignore[attr-defined]
+
+
+def _claim_task(task_id: str) -> bool:
+    """将 pending 任务置为 running，仅当任务仍处于 pending 状态时认领成功。"""
+
+    sql = text(
+        """
+        UPDATE t_dm_auto_annotation_tasks
+        SET status = 'running', updated_at = :updated_at
+        WHERE id = :task_id AND status = 'pending' AND deleted_at IS NULL
+        """
+    )
+
+    with SQLManager.create_connect() as conn:
+        result = conn.execute(sql, {"task_id": task_id, "updated_at": datetime.now()})
+        return result.rowcount == 1
+
+
+def _recover_running_tasks() -> None:
+    """将上次异常退出时遗留的 running 任务重置为 pending，由调度循环重新拉起。"""
+
+    sql = text(
+        """
+        UPDATE t_dm_auto_annotation_tasks
+        SET status = 'pending', updated_at = :updated_at
+        WHERE status = 'running' AND deleted_at IS NULL
+        """
+    )
+
+    try:
+        with SQLManager.create_connect() as conn:
+            result = conn.execute(sql, {"updated_at": datetime.now()})
+            if result.rowcount:
+                logger.info("Recovered {} running auto-annotation tasks left over from last run", result.rowcount)
+    except Exception as e:  # pragma: no cover - 防御性日志
+        logger.error("Failed to recover running auto-annotation tasks: {}", e)
+
+
 def _update_task_status(
     task_id: str,
     *,
@@ -320,10 +369,14 @@ def _build_file_tags_from_detections(detections: List[Dict[str, Any]]) -> Option
     ]
 
 
-def _update_dataset_file_tags(file_id: str, tags: List[Dict[str, Any]]) -> None:
-    """将标签写入 t_dm_dataset_files.tags 并更新 tags_updated_at。"""
+def _update_dataset_file_tags(file_tags: List[Tuple[str, List[Dict[str, Any]]]]) -> None:
+    """将一批文件的标签写入 t_dm_dataset_files.tags 并更新 tags_updated_at。
+
+    :param file_tags: (文件ID, 标签) 列表
+    """
 
-    if not file_id:
+    file_tags = [(file_id, tags) for file_id, tags in file_tags if file_id]
+    if not file_tags:
         return
 
     try:
@@ -336,64 +389,69 @@ def _update_dataset_file_tags(file_id: str, tags: List[Dict[str, Any]]) -> None:
             WHERE id = :file_id
             """
         )
-        params = {
-            "file_id": file_id,
-            "tags": json.dumps(tags, ensure_ascii=False),
-            "tags_updated_at": now,
-        }
+        params = [
+            {
+                "file_id": file_id,
+                "tags": json.dumps(tags, ensure_ascii=False),
+                "tags_updated_at": now,
+            }
+            for file_id, tags in file_tags
+        ]
         with SQLManager.create_connect() as conn:
             conn.execute(sql, params)
     except Exception as e:  # pragma: no cover - 防御性日志
         logger.error(
-            "Failed to update tags for dataset file {}: {}",
-            file_id,
+            "Failed to update tags for {} dataset files: {}",
+            len(file_tags),
             e,
         )
 
 
-def _register_annotation_output_file(dataset_id: str, annotations_path: str) -> None:
-    """确保自动标注生成的 JSON 结果文件在 t_dm_dataset_files 中有一条记录。
+def _register_annotation_output_files(dataset_id: str, annotations_paths: List[str]) -> None:
+    """确保自动标注生成的一批 JSON 结果文件在 t_dm_dataset_files 中有记录。
 
     - 若同一 dataset_id + file_path 已存在，则仅更新文件大小和时间戳；
     - 若不存在，则插入一条新的 ACTIVE 记录。
     """
 
-    if not annotations_path:
-        return
-
-    try:
+    file_sizes: Dict[str, int] = {}
+    for annotations_path in annotations_paths:
+        if not annotations_path:
+            continue
         if not os.path.isfile(annotations_path):
             logger.warning(
                 "Annotation JSON file not found when registering dataset file: {}",
                 annotations_path,
             )
-            return
-
-        file_name = os.path.basename(annotations_path)
-        ext = os.path.splitext(file_name)[1].lstrip(".").lower() or "other"
-
+            continue
         try:
-            file_size = os.path.getsize(annotations_path)
+            file_sizes[annotations_path] = os.path.getsize(annotations_path)
         except OSError:
-            file_size = 0
+            file_sizes[annotations_path] = 0
+
+    if not file_sizes:
+        return
 
+    try:
         now = datetime.utcnow()
+        paths = list(file_sizes)
+        placeholders = ", ".join(f":path{i}" for i in range(len(paths)))
 
         with SQLManager.create_connect() as conn:
-            # 先检查是否已经存在同一路径的文件记录
-            existing = conn.execute(
+            # 先查出已经存在同一路径的文件记录
+            existing_rows = conn.execute(
                 text(
-                    """
-                    SELECT id, file_size
+                    f"""
+                    SELECT id, file_path
                     FROM t_dm_dataset_files
                     WHERE dataset_id = :dataset_id
-                      AND file_path = :file_path
+                      AND file_path IN ({placeholders})
                       AND status = 'ACTIVE'
-                    LIMIT 1
                     """,
                 ),
-                {"dataset_id": dataset_id, "file_path": annotations_path},
-            ).fetchone()
+                dict({"dataset_id": dataset_id}, **{f"path{i}": path for i, path in enumerate(paths)}),
+            ).fetchall()
+            existing = {str(r[1]): r[0] for r in existing_rows}
 
             if existing:
                 # 已存在：仅更新文件大小及时间戳，避免重复插入
@@ -407,67 +465,77 @@ def _register_annotation_output_file(dataset_id: str, annotations_path: str) ->
                         WHERE id = :id
                         """,
                     ),
-                    {
-                        "id": existing[0],
-                        "file_size": int(file_size),
-                        "updated_at": now,
-                        "last_access_time": now,
-                    },
+                    [
+                        {
+                            "id": file_id,
+                            "file_size": int(file_sizes[path]),
+                            "updated_at": now,
+                            "last_access_time": now,
+                        }
+                        for path, file_id in existing.items()
+                    ],
                 )
-            else:
-                # 新文件：插入记录，并尽量更新 t_dm_datasets 的统计字段
-                new_id = str(uuid.uuid4())
+
+            new_paths = [path for path in paths if path not in existing]
+            if not new_paths:
+                return
+
+            # 新文件：插入记录，并尽量更新 t_dm_datasets 的统计字段
+            conn.execute(
+                text(
+                    """
+                    INSERT INTO t_dm_dataset_files
+                        (id, dataset_id, file_name, file_path, file_type, file_size, status, upload_time, created_at, updated_at)
+                    VALUES
+                        (:id, :dataset_id, :file_name, :file_path, :file_type, :file_size, 'ACTIVE', :now, :now, :now)
+                    """,
+                ),
+                [
+                    {
+                        "id": str(uuid.uuid4()),
+                        "dataset_id": dataset_id,
+                        "file_name": os.path.basename(path),
+                        "file_path": path,
+                        "file_type": os.path.splitext(path)[1].lstrip(".").lower() or "other",
+                        "file_size": int(file_sizes[path]),
+                        "now": now,
+                    }
+                    for path in new_paths
+                ],
+            )
+
+            # 轻量更新数据集的文件数量和总大小统计
+            try:
                 conn.execute(
                     text(
                         """
-                        INSERT INTO t_dm_dataset_files
-                            (id, dataset_id, file_name, file_path, file_type, file_size, status, upload_time, created_at, updated_at)
-                        VALUES
-                            (:id, :dataset_id, :file_name, :file_path, :file_type, :file_size, 'ACTIVE', :now, :now, :now)
+                        UPDATE t_dm_datasets
+                        SET file_count = COALESCE(file_count, 0) + :count,
+                            size_bytes = COALESCE(size_bytes, 0) + :delta,
+                            updated_at = :now,
+                            status = 'ACTIVE'
+                        WHERE id = :dataset_id
                         """,
                     ),
                     {
-                        "id": new_id,
                         "dataset_id": dataset_id,
-                        "file_name": file_name,
-                        "file_path": annotations_path,
-                        "file_type": ext,
-                        "file_size": int(file_size),
+                        "count": len(new_paths),
+                        "delta": int(sum(file_sizes[path] for path in new_paths)),
                         "now": now,
                     },
                 )
-
-                # 轻量更新数据集的文件数量和总大小统计
-                try:
-                    conn.execute(
-                        text(
-                            """
-                            UPDATE t_dm_datasets
-                            SET file_count = COALESCE(file_count, 0) + 1,
-                                size_bytes = COALESCE(size_bytes, 0) + :delta,
-                                updated_at = :now,
-                                status = 'ACTIVE'
-                            WHERE id = :dataset_id
-                            """,
-                        ),
-                        {
-                            "dataset_id": dataset_id,
-                            "delta": int(file_size),
-                            "now": now,
-                        },
-                    )
-                except Exception as e_ds:  # pragma: no cover - 统计更新失败不影响主流程
-                    logger.warning(
-                        "Failed to update dataset stats for {} when registering annotation file {}: {}",
-                        dataset_id,
-                        annotations_path,
-                        e_ds,
-                    )
+            except Exception as e_ds:  # pragma: no cover - 统计更新失败不影响主流程
+                logger.warning(
+                    "Failed to update dataset stats for {} when registering {} annotation files: {}",
+                    dataset_id,
+                    len(new_paths),
+                    e_ds,
+                )
     except Exception as e:  # pragma: no cover - 防御性日志
         logger.error(
-            "Failed to register annotation output file for dataset {} at {}: {}",
+            "Failed to register {} annotation output files for dataset {}: {}",
+            len(file_sizes),
             dataset_id,
-            annotations_path,
             e,
         )
 
@@ -530,6 +598,114 @@ def _trigger_forward_sync_to_label_studio(task_id: str) -> None:
         )
 
 
+def _get_decode_pool() -> ThreadPoolExecutor:
+    """获取各任务共用的图片预读解码线程池。"""
+
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="auto-annotation-decode")
+        return _decode_pool
+
+
+def _read_image(file_path: str):
+    """读取并解码图片，文件不存在或解码失败时返回 None。"""
+
+    if not file_path or not os.path.exists(file_path):
+        logger.warning("Image file not found: {}", file_path)
+        return None
+    img = cv2.imread(file_path)
+    if img is None:
+        logger.warning("Failed to read image: {}", file_path)
+    return img
+
+
+def _detect_images(detector: Any, images: List[Any], batch: List[Tuple[str, str, str]]) -> List[Optional[List]]:
+    """批量检测一批图片，批量推理失败时逐张重试，仍失败的图片结果为 None。"""
+
+    try:
+        return detector.detect_batch(images)
+    except Exception as e:
+        logger.warning("Batch detection failed, retry one by one: {}", e)
+
+    results: List[Optional[List]] = []
+    for img, (_, file_path, _) in zip(images, batch):
+        try:
+            results.append(detector.detect_batch([img])[0])
+        except Exception as e:
+            logger.error("Failed to detect image: file_path={}, error={}", file_path, e)
+            results.append(None)
+    return results
+
+
+def _process_batch(
+    detector: Any,
+    dataset_id: str,
+    output_dir: str,
+    batch: List[Tuple[str, str, str]],
+    images: List[Any],
+) -> Tuple[int, int]:
+    """对一批已解码的图片执行检测、保存标注结果，并批量写回标签和结果文件记录。
+
+    返回 (已处理图片数, 检测到的目标数)。
+    """
+
+    processed = 0
+    detected_total = 0
+    # 无法读取的图片按没有检测结果处理
+    readable = [(file, img) for file, img in zip(batch, images) if img is not None]
+    processed += len(batch) - len(readable)
+    detections_list = _detect_images(detector, [img for _, img in readable], [file for file, _ in readable])
+
+    annotations_files: List[str] = []
+    file_tags: List[Tuple[str, List[Dict[str, Any]]]] = []
+    for ((file_id, file_path, file_name), img), detections in zip(readable, detections_list):
+        if detections is None:
+            continue
+        try:
+            sample = {
+                "image": file_path,
+                "filename": file_name,
+            }
+            result = detector.save_annotations(sample, file_path, img, detections)
+
+            annotations = (result or {}).get("annotations", {})
+            detected_total += len(annotations.get("detections", []))
+            processed += 1
+
+            # 根据算子返回的 annotations_file 或约定路径，注册 JSON 文件到 t_dm_dataset_files
+            annotations_file = (result or {}).get("annotations_file")
+            if not annotations_file:
+                base_name = os.path.basename(file_path)
+                stem, _ = os.path.splitext(base_name)
+                # 兼容两种目录结构：<output_dir>/annotations/<name>.json 或 <output_dir>/<name>.json
+                candidate1 = os.path.join(output_dir, "annotations", f"{stem}.json")
+                candidate2 = os.path.join(output_dir, f"{stem}.json")
+                if os.path.isfile(candidate1):
+                    annotations_file = candidate1
+                elif os.path.isfile(candidate2):
+                    annotations_file = candidate2
+
+            if annotations_file:
+                annotations_files.append(annotations_file)
+
+            # 基于检测结果生成标签（按类别去重），并写回源数据集文件
+            tags = _build_file_tags_from_detections(annotations.get("detections", []))
+            if tags:
+                file_tags.append((file_id, tags))
+        except Exception as e:
+            logger.error(
+                "Failed to save annotations for dataset {}: file_path={}, error={}",
+                dataset_id,
+                file_path,
+                e,
+            )
+
+    _register_annotation_output_files(dataset_id, annotations_files)
+    _update_dataset_file_tags(file_tags)
+    return processed, detected_total
+
+
 def _process_single_task(task: Dict[str, Any]) -> None:
     """执行单个自动标注任务。"""
 
@@ -692,61 +868,23 @@ def _process_single_task(task: Dict[str, Any]) -> None:
     processed = 0
     detected_total = 0
 
-    # 记录：文件名 -> FileTag JSON，用于给新输出数据集的文件打标签
-    tags_by_filename: Dict[str, List[Dict[str, Any]]] = {}
+    # 下一批图片在线程池中预读解码，与当前批次的推理并行
+    decode_pool = _get_decode_pool()
+    batches = [files[i:i + BATCH_SIZE] for i in range(0, total_images, BATCH_SIZE)]
+    pending_images = [decode_pool.submit(_read_image, file_path) for _, file_path, _ in batches[0]]
 
-    for file_id, file_path, file_name in files:
-        try:
-            sample = {
-                "image": file_path,
-                "filename": file_name,
-            }
-            result = detector.execute(sample)
-
-            annotations = (result or {}).get("annotations", {})
-            detections = annotations.get("detections", [])
-            detected_total += len(detections)
-            processed += 1
+    for batch_idx, batch in enumerate(batches):
+        images = [future.result() for future in pending_images]
+        if batch_idx + 1 < len(batches):
+            pending_images = [decode_pool.submit(_read_image, file_path) for _, file_path, _ in batches[batch_idx + 1]]
 
-            # 根据算子返回的 annotations_file 或约定路径，注册 JSON 文件到 t_dm_dataset_files
-            annotations_file = None
-            try:
-                annotations_file = (result or {}).get("annotations_file")
-            except Exception:
-                annotations_file = None
+        batch_processed, batch_detected = _process_batch(detector, dataset_id, output_dir, batch, images)
+        processed += batch_processed
+        detected_total += batch_detected
 
-            if not annotations_file:
-                base_name = os.path.basename(file_path)
-                stem, _ = os.path.splitext(base_name)
-                # 兼容两种目录结构：<output_dir>/annotations/<name>.json 或 <output_dir>/<name>.json
-                candidate1 = os.path.join(output_dir, "annotations", f"{stem}.json")
-                candidate2 = os.path.join(output_dir, f"{stem}.json")
-                if os.path.isfile(candidate1):
-                    annotations_file = candidate1
-                elif os.path.isfile(candidate2):
-                    annotations_file = candidate2
-
-            if annotations_file:
-                _register_annotation_output_file(dataset_id, annotations_file)
-
-            # 基于检测结果生成标签（按类别去重），并写回源数据集文件
-            file_tags = _build_file_tags_from_detections(detections)
-            if file_tags:
-                try:
-                    _update_dataset_file_tags(file_id, file_tags)
-                    # 使用源文件名作为 key，供输出数据集复用
-                    base_name = os.path.basename(file_path)
-                    tags_by_filename[base_name] = file_tags
-                except Exception as e:
-                    logger.error(
-                        "Failed to persist tags for file {} in dataset {}: {}",
-                        file_id,
-                        dataset_id,
-                        e,
-                    )
-
-            progress = int(processed * 100 / total_images) if total_images > 0 else 100
+        progress = int(processed * 100 / total_images) if total_images > 0 else 100
 
+        try:
             _update_task_status(
                 task_id,
                 status="running",
@@ -757,13 +895,7 @@ def _process_single_task(task: Dict[str, Any]) -> None:
                 output_path=output_dir,
             )
         except Exception as e:
-            logger.error(
-                "Failed to process image for task {}: file_path={}, error={}",
-                task_id,
-                file_path,
-                e,
-            )
-            continue
+            logger.error("Failed to update progress for task {}: {}", task_id, e)
 
     _update_task_status(
         task_id,
@@ -789,23 +921,60 @@ def _process_single_task(task: Dict[str, Any]) -> None:
     _trigger_forward_sync_to_label_studio(task_id)
 
 
+def _run_task(task: Dict[str, Any]) -> None:
+    """执行任务，未预期的异常将任务标记为 failed，避免任务一直停留在 running 状态。"""
+
+    try:
+        _process_single_task(task)
+    except Exception as e:
+        logger.error("Auto-annotation task {} failed: {}", task.get("id"), e)
+        try:
+            _update_task_status(
+                str(task["id"]),
+                status="failed",
+                error_message=f"Auto-annotation task failed: {e}",
+            )
+        except Exception as e_status:  # pragma: no cover - 防御性日志
+            logger.error("Failed to mark auto-annotation task {} as failed: {}", task.get("id"), e_status)
+
+
 def _worker_loop() -> None:
-    """Worker 主循环，在独立线程中运行。"""
+    """Worker 主循环，在独立线程中运行，负责认领任务并分发到任务线程池。"""
 
     logger.info(
-        "Auto-annotation worker started with poll interval {} seconds, output root {}",
+        "Auto-annotation worker started with poll interval {} seconds, output root {}, max concurrent tasks {}",
         POLL_INTERVAL_SECONDS,
         DEFAULT_OUTPUT_ROOT,
+        MAX_CONCURRENT_TASKS,
     )
 
+    _recover_running_tasks()
+
+    executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TASKS, thread_name_prefix="auto-annotation-task")
+    active: Dict[str, Future] = {}
+
     while True:
         try:
-            task = _fetch_pending_task()
-            if not task:
-                time.sleep(POLL_INTERVAL_SECONDS)
+            for task_id in [task_id for task_id, future in active.items() if future.done()]:
+                active.pop(task_id)
+
+            claimed = 0
+            free_slots = MAX_CONCURRENT_TASKS - len(active)
+            if free_slots > 0:
+                for task in _fetch_pending_tasks(free_slots):
+                    task_id = str(task["id"])
+                    if task_id in active or not _claim_task(task_id):
+                        continue
+                    active[task_id] = executor.submit(_run_task, task)
+                    claimed += 1
+
+            if claimed:
                 continue
-
-            _process_single_task(task)
+            # 没有新任务可执行时，等待轮询间隔或任一任务结束
+            if active:
+                wait(list(active.values()), timeout=POLL_INTERVAL_SECONDS, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(POLL_INTERVAL_SECONDS)
         except Exception as e:  # pragma: no cover - 防御性日志
             logger.error("Auto-annotation worker loop error: {}", e)
             time.sleep(POLL_INTERVAL_SECONDS)
@@ -1,5 +1,19 @@
 # -- encoding: utf-8 --
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import uuid
 from collections import deque
+from threading import Lock
+from typing import Iterable, Iterator, List, Tuple
+
+from loguru import logger
+
+# 自动机序列化格式版本，格式变化时已有缓存文件自动失效
+_CACHE_VERSION = 2
+_EMPTY_OUTPUT = ()
 
 
 class TrieNode:
@@ -10,11 +24,233 @@ class TrieNode:
         self.word = None
 
 
+class AcAutomaton:
+    """
+    数组形式的AC自动机。
+
+    状态转移表展开为以 state * alphabet_size + char_id 为键的单层字典，失败指针与输出均为按状态编号的列表，
+    输出在构建时已沿失败指针合并，匹配时无需回溯输出链。
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words: List[str] = sorted({word for word in words if word})
+        self.word_lengths: List[int] = [len(word) for word in self.words]
+        self.max_word_len = max(self.word_lengths, default=0)
+        self.alphabet = {}
+        for word in self.words:
+            for s in word:
+                self.alphabet.setdefault(s, len(self.alphabet))
+        self.alphabet_size = max(len(self.alphabet), 1)
+        self.delta = {}
+        self.fail: List[int] = [0]
+        self.outputs: List[tuple] = [_EMPTY_OUTPUT]
+        self._build()
+
+    @property
+    def lexicon_hash(self) -> str:
+        return get_lexicon_hash(self.words)
+
+    def to_json(self) -> str:
+        """序列化为JSON，缓存文件只包含数据，加载时不会执行任意代码"""
+        return json.dumps({
+            "version": _CACHE_VERSION,
+            "words": self.words,
+            "alphabet": self.alphabet,
+            "delta_keys": list(self.delta.keys()),
+            "delta_values": list(self.delta.values()),
+            "fail": self.fail,
+            "outputs": self.outputs,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, content: str) -> "AcAutomaton":
+        data = json.loads(content)
+        if data.get("version") != _CACHE_VERSION:
+            raise ValueError(f"unsupported cache version {data.get('version')}")
+        automaton = cls.__new__(cls)
+        automaton.words = data["words"]
+        automaton.word_lengths = [len(word) for word in automaton.words]
+        automaton.max_word_len = max(automaton.word_lengths, default=0)
+        automaton.alphabet = data["alphabet"]
+        automaton.alphabet_size = max(len(automaton.alphabet), 1)
+        automaton.delta = dict(zip(data["delta_keys"], data["delta_values"]))
+        automaton.fail = data["fail"]
+        automaton.outputs = [tuple(output) or _EMPTY_OUTPUT for output in data["outputs"]]
+        return automaton
+
+    def iter_matches(self, text: str, special_symbols=frozenset()) -> Iterator[Tuple[int, int, int]]:
+        """
+        匹配词表中的词，特殊字符不参与匹配，但出现在词中间时计入匹配区间。
+
+        Args:
+            text: 文本
+            special_symbols: 特殊字符（需跳过）
+        Returns:
+            (起始位置, 结束位置, 词编号)，区间左闭右开
+        """
+        delta, fail, outputs, alphabet = self.delta, self.fail, self.outputs, self.alphabet
+        size, word_lengths = self.alphabet_size, self.word_lengths
+        # 最近匹配的非特殊字符位置，用于根据词长计算匹配起始位置
+        positions = deque(maxlen=self.max_word_len or 1)
+        state = 0
+        for i, s in enumerate(text):
+            if s in special_symbols:  # 跳过特殊字符
+                continue
+            char_id = alphabet.get(s)
+            if char_id is None:  # 词表中不存在的字符，回到根节点
+                state = 0
+                continue
+            positions.append(i)
+            # 根节点包含全部字符的转移，失败回溯一定可以终止
+            while state * size + char_id not in delta:
+                state = fail[state]
+            state = delta[state * size + char_id]
+            for word_id in outputs[state]:
+                yield positions[-word_lengths[word_id]], i + 1, word_id
+
+    def search_spans(self, text: str, special_symbols=frozenset()) -> List[Tuple[int, int]]:
+        """返回所有匹配区间"""
+        return [(start, end) for start, end, _ in self.iter_matches(text, special_symbols)]
+
+    def _build(self):
+        size = self.alphabet_size
+        children: List[list] = [[]]
+        word_ids: List[list] = [[]]
+        # 构建前缀树
+        for word_id, word in enumerate(self.words):
+            state = 0
+            for s in word:
+                key = state * size + self.alphabet[s]
+                if key not in self.delta:
+                    self.delta[key] = len(children)
+                    children[state].append((self.alphabet[s], len(children)))
+                    children.append([])
+                    word_ids.append([])
+                state = self.delta[key]
+            word_ids[state].append(word_id)
+
+        # 按层次遍历添加失败指针，并沿失败指针合并输出
+        self.fail = [0] * len(children)
+        self.outputs = [_EMPTY_OUTPUT] * len(children)
+        queue = deque()
+        for _, child in children[0]:
+            self.outputs[child] = tuple(word_ids[child]) or _EMPTY_OUTPUT
+            queue.append(child)
+        while queue:
+            state = queue.popleft()
+            for char_id, child in children[state]:
+                fail_state = self.fail[state]
+                while fail_state and fail_state * size + char_id not in self.delta:
+                    fail_state = self.fail[fail_state]
+                self.fail[child] = self.delta.get(fail_state * size + char_id, 0)
+                self.outputs[child] = tuple(word_ids[child]) + self.outputs[self.fail[child]] or _EMPTY_OUTPUT
+                queue.append(child)
+
+        # 根节点补全所有字符的转移
+        for char_id in self.alphabet.values():
+            self.delta.setdefault(char_id, 0)
+
+
+def get_lexicon_hash(words: Iterable[str]) -> str:
+    content = "\n".join(sorted({word for word in words if word}))
+    return hashlib.sha256(f"{_CACHE_VERSION}\n{content}".encode("utf-8")).hexdigest()
+
+
+_automatons = {}
+_automaton_lock = Lock()
+
+
+def get_private_cache_dir(cache_dir: str) -> str:
+    """
+    创建（或校验）仅当前用户可访问的缓存目录：目录权限为0700且属主为当前用户，
+    目录已存在但属主不是当前用户或其他用户可写时返回None，不使用文件缓存
+    """
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    dir_stat = os.stat(cache_dir)
+    if hasattr(os, "getuid") and dir_stat.st_uid != os.getuid():
+        logger.warning(f"Cache directory {cache_dir} is not owned by current user, skip file cache.")
+        return None
+    if dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        logger.warning(f"Cache directory {cache_dir} is writable by other users, skip file cache.")
+        return None
+    return cache_dir
+
+
+def load_automaton(words: Iterable[str], cache_dir: str = None) -> AcAutomaton:
+    """
+    获取词表对应的AC自动机：同一进程内相同词表只构建一次，并以词表哈希为键缓存到文件，
+    其它actor直接加载缓存文件，无需重新构建。缓存目录可通过环境变量AC_CACHE_DIR指定，
+    默认为临时目录下按用户区分的私有目录。
+    """
+    words = {word for word in words if word}
+    lexicon_hash = get_lexicon_hash(words)
+    with _automaton_lock:
+        if lexicon_hash in _automatons:
+            return _automatons[lexicon_hash]
+
+        cache_dir = cache_dir or os.getenv("AC_CACHE_DIR", os.path.join(
+            tempfile.gettempdir(), f"datamate_ac_cache_{os.getuid() if hasattr(os, 'getuid') else 0}"))
+        try:
+            cache_dir = get_private_cache_dir(cache_dir)
+        except OSError as e:
+            logger.warning(f"Create aho-corasick automaton cache directory {cache_dir} failed: {e}")
+            cache_dir = None
+        cache_path = os.path.join(cache_dir, f"{lexicon_hash}.json") if cache_dir else None
+        automaton = None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    automaton = AcAutomaton.from_json(f.read())
+                if automaton.lexicon_hash != lexicon_hash:
+                    raise ValueError("lexicon hash mismatch")
+            except Exception as e:
+                logger.warning(f"Load aho-corasick automaton cache {cache_path} failed, rebuild it: {e}")
+                automaton = None
+        if automaton is None:
+            automaton = AcAutomaton(words)
+            if cache_path:
+                try:
+                    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(automaton.to_json())
+                    os.replace(tmp_path, cache_path)
+                except Exception as e:
+                    logger.warning(f"Save aho-corasick automaton cache {cache_path} failed: {e}")
+        _automatons[lexicon_hash] = automaton
+        return automaton
+
+
+def mask_spans(text: str, spans: Iterable[Tuple[int, int]], mask: str = '*') -> str:
+    """
+    将文本中的匹配区间替换为掩码字符，重叠区间合并后一次遍历完成替换。
+
+    Args:
+        text: 待清洗文本。
+        spans: 匹配区间，左闭右开。
+        mask: 掩码字符。
+    returns:
+        清洗后文本。
+    """
+    pieces = []
+    last_end = 0
+    for start, end in sorted(spans):
+        if end <= last_end:
+            continue
+        start = max(start, last_end)
+        pieces.append(text[last_end:start])
+        pieces.append(mask * (end - start))
+        last_end = end
+    if not pieces:
+        return text
+    pieces.append(text[last_end:])
+    return ''.join(pieces)
+
+
 class AhoCorasic:
     """AC自动机算法进行目标字符串搜索"""
 
     def __init__(self, words):
-        self._root = add_fail_pointer(build_trie(words))
+        self._automaton = load_automaton(words)
 
     def search(self, text: str, special_symbols: set):
         """
@@ -26,35 +262,23 @@ class AhoCorasic:
         Returns:
             匹配成功的字符串列表
         """
-        seq_list = []
-        node = self._root
+        return list({text[start:end] for start, end in self._automaton.search_spans(text, special_symbols)})
 
-        valid_len = 0  # 当前遍历的有效长度
-        for i, s in enumerate(text):
-            if s in special_symbols:  # 跳过特殊字符
-                if valid_len != 0:
-                    valid_len += 1
-                continue
+    def search_spans(self, text: str, special_symbols: set) -> List[Tuple[int, int]]:
+        """
+        匹配敏感词。
 
-            matched = True
-            while s not in node.child:  # 当node.child没有字符s
-                if node == self._root:  # 当node为root（无node.fail），有效长度归0且跳出
-                    valid_len = 0
-                    matched = False
-                    break
-                elif node.fail == self._root:  # node.fail为root场景，有效长度归0，但可继续
-                    valid_len = 0
-                node = node.fail  # 移动到失败指针节点
-            if not matched:
-                continue
+        Args:
+            text: 文本
+            special_symbols: 特殊字符（需跳过）
+        Returns:
+            匹配区间列表，区间左闭右开
+        """
+        return self._automaton.search_spans(text, special_symbols)
 
-            node = node.child.get(s)
-            valid_len += 1
-            if node.word:  # node是单词尾字母
-                sensitive_word = text[i - valid_len + 1:i + 1]
-                seq_list.append(sensitive_word)
-        seq_list = list(set(seq_list))
-        return seq_list
+    def replace(self, text: str, special_symbols: set, mask: str = '*') -> str:
+        """将匹配到的敏感词替换为掩码字符"""
+        return mask_spans(text, self._automaton.search_spans(text, special_symbols), mask)
 
 
 def build_trie(words: list):
@@ -4,6 +4,7 @@ from loguru import logger
 import mimetypes
 from datetime import datetime
 
+from datamate.common.utils.patch_shard import is_shard_index
 from datamate.sql_manager.persistence_atction import TaskInfoPersistence
 
 class FileScanner:
@@ -65,6 +66,8 @@ class FileScanner:
         for root, dirs, files in os.walk(root_dir):
             for file in files:
                 if file.startswith('.'): continue
+                # 切片分片以tar文件为单位登记，分片索引文件不作为数据集文件
+                if is_shard_index(file): continue
 
                 full_path = os.path.join(root, file)
 
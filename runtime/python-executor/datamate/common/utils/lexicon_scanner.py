@@ -0,0 +1,89 @@
+# -- encoding: utf-8 --
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Tuple
+
+from datamate.common.utils.aho_corasick import get_lexicon_hash, load_automaton, mask_spans
+from datamate.core.constant import Fields
+
+
+def get_text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class LexiconScanner:
+    """
+    多词表单次扫描：多个分类词表合并为一个AC自动机，匹配结果携带分类标签。
+
+    扫描结果以JSON字符串缓存在样本的Fields.lexicon_scan字段中，记录词表哈希和文本摘要；
+    同一流水线中后续使用相同词表的算子在文本未变化时直接复用匹配区间，无需重新扫描。
+    """
+
+    def __init__(self, lexicons: Dict[str, Iterable[str]], special_symbols: Iterable[str]):
+        self.categories = sorted(lexicons)
+        self.special_symbols = set(special_symbols)
+        words = set()
+        for category in self.categories:
+            words |= {word for word in lexicons[category] if word}
+        self.automaton = load_automaton(words)
+        # 每个词所属分类的位掩码，按自动机中的词编号存放
+        self.word_masks = [0] * len(self.automaton.words)
+        word_ids = {word: word_id for word_id, word in enumerate(self.automaton.words)}
+        for bit, category in enumerate(self.categories):
+            for word in lexicons[category]:
+                if word:
+                    self.word_masks[word_ids[word]] |= 1 << bit
+        self.lexicon_hash = get_lexicon_hash(
+            [f"{category}:{get_lexicon_hash(lexicons[category])}" for category in self.categories]
+            + [f"special_symbols:{get_lexicon_hash(self.special_symbols)}"])
+
+    def category_mask(self, categories: Iterable[str]) -> int:
+        mask = 0
+        for category in categories:
+            mask |= 1 << self.categories.index(category)
+        return mask
+
+    def scan_text(self, text: str) -> List[Tuple[int, int, int]]:
+        """扫描文本，返回(起始位置, 结束位置, 分类位掩码)，区间左闭右开"""
+        matches = {}
+        for start, end, word_id in self.automaton.iter_matches(text, self.special_symbols):
+            matches[(start, end)] = matches.get((start, end), 0) | self.word_masks[word_id]
+        return [(start, end, mask) for (start, end), mask in matches.items()]
+
+    def scan(self, sample: Dict[str, Any], text_key: str) -> List[Tuple[int, int, int]]:
+        """获取样本文本的匹配结果，样本中已缓存有效的匹配结果时直接复用"""
+        text = sample.get(text_key) or ""
+        digest = get_text_digest(text)
+        cached = sample.get(Fields.lexicon_scan)
+        if cached:
+            try:
+                cached = json.loads(cached)
+                if cached.get("lexicon") == self.lexicon_hash and cached.get("digest") == digest:
+                    return [tuple(match) for match in cached.get("matches", [])]
+            except (TypeError, ValueError):
+                pass
+        matches = self.scan_text(text)
+        self._save(sample, digest, matches)
+        return matches
+
+    def search_spans(self, sample: Dict[str, Any], text_key: str, categories: Iterable[str]) -> List[Tuple[int, int]]:
+        """返回指定分类词的匹配区间"""
+        mask = self.category_mask(categories)
+        return [(start, end) for start, end, match_mask in self.scan(sample, text_key) if match_mask & mask]
+
+    def replace(self, sample: Dict[str, Any], text_key: str, categories: Iterable[str], mask: str = '*') -> str:
+        """
+        将指定分类的敏感词替换为掩码字符，并更新样本中的缓存。
+        替换不改变文本长度，其它分类的匹配区间仍然有效，后续算子可继续复用。
+        """
+        matches = self.scan(sample, text_key)
+        category_mask = self.category_mask(categories)
+        text = mask_spans(sample.get(text_key) or "",
+                          [(start, end) for start, end, match_mask in matches if match_mask & category_mask], mask)
+        self._save(sample, get_text_digest(text), matches)
+        return text
+
+    def _save(self, sample: Dict[str, Any], digest: str, matches: List[Tuple[int, int, int]]):
+        sample[Fields.lexicon_scan] = json.dumps({"lexicon": self.lexicon_hash, "digest": digest,
+                                                  "matches": matches})
+
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+from typing import Dict
+
+from datamate.common.utils.sqlite_cache import SqliteLruCache
+
+
+def get_cache_key(url: str, body: Dict) -> str:
+    """缓存键：服务地址、模型、提示词及其余请求参数的哈希，参数顺序不影响结果"""
+    params = {key: value for key, value in body.items() if key not in ("model", "messages")}
+    content = json.dumps({"url": url, "model": body.get("model"), "messages": body.get("messages"),
+                          "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class LlmResponseCache(SqliteLruCache):
+    """
+    大模型响应缓存：以请求内容哈希为键，将响应保存在本地SQLite数据库中。
+    缓存默认关闭，可通过算子参数或环境变量LLM_CACHE_ENABLED=true开启，数据库路径由LLM_CACHE_PATH指定，
+    条目超过有效期（LLM_CACHE_TTL，秒，默认7天）后失效，数据库超过容量上限（LLM_CACHE_MAX_SIZE，MB）时按最近访问时间淘汰。
+    """
+    NAME = "llm_cache"
+    ENV_PREFIX = "LLM_CACHE"
+    DEFAULT_FILE_NAME = "llm_cache.db"
+    DEFAULT_MAX_SIZE = "1024"
+    DEFAULT_TTL = str(7 * 24 * 3600)
+
+    def encode(self, value: str) -> bytes:
+        return value.encode("utf-8")
+
+    def decode(self, content: bytes) -> str:
+        return content.decode("utf-8")
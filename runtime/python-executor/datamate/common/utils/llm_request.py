@@ -2,43 +2,150 @@
 
 import json
 import os
+import random
 import ssl
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict
-from urllib.request import Request, urlopen
+from threading import BoundedSemaphore, Lock
+from typing import Dict, List
 
-import requests
 import urllib3
 from loguru import logger
 
 from datamate.common.utils import decrypt
+from datamate.common.utils.llm_cache import LlmResponseCache, get_cache_key
+
+# 触发重试的响应码：限流及服务端错误
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def _get_max_concurrency() -> int:
+    return int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+
+class RateLimiter:
+    """令牌桶限流，rate为每秒请求数，不大于0时不限流"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class _ClientRegistry:
+    """进程内共享的连接池、限流器与并发信号量，同一服务地址的请求复用长连接"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.pool_managers = {}
+        self.rate_limiters = {}
+        self.semaphores = {}
+        self.executor = None
+
+    def get_pool_manager(self, key, factory) -> urllib3.PoolManager:
+        with self.lock:
+            if key not in self.pool_managers:
+                self.pool_managers[key] = factory()
+            return self.pool_managers[key]
+
+    def get_rate_limiter(self, url: str) -> RateLimiter:
+        with self.lock:
+            if url not in self.rate_limiters:
+                self.rate_limiters[url] = RateLimiter(float(os.getenv("LLM_RATE_LIMIT", "0")))
+            return self.rate_limiters[url]
+
+    def get_semaphore(self, url: str) -> BoundedSemaphore:
+        with self.lock:
+            if url not in self.semaphores:
+                self.semaphores[url] = BoundedSemaphore(_get_max_concurrency())
+            return self.semaphores[url]
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=_get_max_concurrency(), thread_name_prefix="llm")
+            return self.executor
+
+
+_clients = _ClientRegistry()
 
 
 class LlmReq:
+    """
+    大模型服务请求。
+
+    同一进程内相同服务地址的请求复用连接池（长连接）与证书配置，请求按服务地址限流（LLM_RATE_LIMIT，每秒请求数）
+    并限制并发数（LLM_MAX_CONCURRENCY）；响应码为429或5xx、连接异常时按抖动指数退避重试（LLM_MAX_RETRIES）。
+    传入响应缓存时，请求内容（模型、提示词、参数）相同的请求直接返回缓存的响应。
+    """
     # 定义常量用于解释错误码
     ERRORCODE_INCOMPLETE_CONFIG = 83005
     ERRORCODE_INVALID_RESPONSE = 83006
     ERRORCODE_SERVICE_UNAVAILABLE = 83007
 
     def __init__(self, url: str = None, header: Dict = None, body: Dict = None, access_type: int = None,
-                 is_https: bool = False, is_certificate: bool = False, certificate_path: Path = None):
+                 is_https: bool = False, is_certificate: bool = False, certificate_path: Path = None,
+                 cache: LlmResponseCache = None):
         self.url = url
         self.header = header
         self.access_type = access_type
         self.is_https = is_https
-        self.context = self._load_certificate(certificate_path, is_certificate) if is_https else None
+        self.is_certificate = is_certificate
+        self.certificate_path = certificate_path
         self.body = body
         if not self.body.get("messages", [])[0].get("content"):
             self.body["messages"][0]["content"] = "你好"
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+        self.retry_base_delay = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+        self.retry_max_delay = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+        self.cache = cache
 
     def __call__(self, input_str: str) -> str:
         outputs = ''
         try:
-            self.body["messages"][0]["content"] = input_str
-            outputs = self._call_service()
+            body = self._build_body(input_str)
+            if self.cache is None:
+                return self._call_service(body)
+            key = get_cache_key(self.url, body)
+            outputs = self.cache.get(key)
+            if outputs is None:
+                outputs = self._call_service(body)
+                self.cache.set(key, outputs)
         except KeyError as e:
             logger.error(f"The body format is not completed, error detail: {e}")
-        self.body["messages"][0]["content"] = "你好"
+        return outputs
+
+    def submit(self, input_str: str) -> Future:
+        """异步提交请求，进程内所有请求共用一个有界线程池"""
+        return _clients.get_executor().submit(self, input_str)
+
+    def batch_call(self, input_strs: List[str]) -> List[str]:
+        """并发请求并按输入顺序返回结果，请求失败的位置为空字符串"""
+        futures = [self.submit(input_str) for input_str in input_strs]
+        outputs = []
+        for future in futures:
+            try:
+                outputs.append(future.result())
+            except RuntimeError as e:
+                logger.error(f"Request LLM error, details: {e}")
+                outputs.append('')
         return outputs
 
     @staticmethod
@@ -70,49 +177,78 @@ class LlmReq:
                                            cert_reqs='CERT_REQUIRED',
                                            ca_certs=ca_crt,
                                            assert_hostname='edatamate',
-                                           ssl_version='TLSv1_2')
+                                           ssl_version='TLSv1_2',
+                                           maxsize=_get_max_concurrency())
         return pool_manager
 
-    def _call_service(self):
-        if not all([self.url, self.header, self.body.get("messages", [])[0].get("content")]):
+    def _get_pool_manager(self) -> urllib3.PoolManager:
+        if not self.access_type:
+            # 双向认证的证书口令仅在首次创建连接池时读取并解密
+            return _clients.get_pool_manager("mutual_tls", self._pool_manager)
+        if self.is_https:
+            return _clients.get_pool_manager(
+                ("https", self.is_certificate, str(self.certificate_path)),
+                lambda: urllib3.PoolManager(ssl_context=self._load_certificate(self.certificate_path,
+                                                                               self.is_certificate),
+                                            assert_hostname=False,
+                                            maxsize=_get_max_concurrency()))
+        return _clients.get_pool_manager("http", lambda: urllib3.PoolManager(maxsize=_get_max_concurrency()))
+
+    def _build_body(self, input_str: str) -> Dict:
+        """每次请求使用独立的请求体，支持多线程并发调用"""
+        body = dict(self.body)
+        body["messages"] = [dict(message) for message in self.body["messages"]]
+        body["messages"][0]["content"] = input_str
+        return body
+
+    def _get_retry_delay(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.retry_max_delay)
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def _request(self, body: Dict):
+        pool_manager = self._get_pool_manager()
+        rate_limiter = _clients.get_rate_limiter(self.url)
+        semaphore = _clients.get_semaphore(self.url)
+        data = json.dumps(body).encode()
+        attempt = 0
+        while True:
+            rate_limiter.acquire()
+            response, error = None, None
+            with semaphore:
+                try:
+                    response = pool_manager.request("POST", url=self.url, body=data, headers=self.header,
+                                                    retries=False)
+                except urllib3.exceptions.HTTPError as e:
+                    error = e
+            if error is None and response.status not in RETRY_STATUS:
+                return response
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return response
+            delay = self._get_retry_delay(attempt, response)
+            logger.warning(f"Request LLM failed ({error or response.status}), "
+                           f"retry {attempt + 1}/{self.max_retries} after {delay:.2f} s")
+            time.sleep(delay)
+            attempt += 1
+
+    def _call_service(self, body: Dict):
+        if not all([self.url, self.header, body.get("messages", [])[0].get("content")]):
             logger.error("LLM is not configured completely")
             raise RuntimeError(self.ERRORCODE_INCOMPLETE_CONFIG, "LLM is not configured completely") from None
-        if not self.access_type:
-            try:
-                pool_manager = self._pool_manager()
-                response = pool_manager.request(
-                    "POST",
-                    url=self.url,
-                    body=json.dumps(self.body).encode(),
-                    headers=self.header
-                )
-                logger.info(f"Response status code: {response.status}")
-                response_json = json.loads(response.data.decode('utf-8'))
-                outputs = response_json.get("choices", [])[0].get("message", {}).get("content")
-                if not outputs:
-                    logger.error("Invalid response format for LLM, missing the 'prompt' key word")
-                    raise RuntimeError(self.ERRORCODE_INVALID_RESPONSE,
-                                       "Invalid response format for LLM, missing the 'prompt' key word") from None
-                return outputs
-            except Exception as e:
-                logger.error(f"LLM service is not available, error detail: {e}")
-                raise RuntimeError(self.ERRORCODE_SERVICE_UNAVAILABLE, "LLM service is not available") from None
-        if self.access_type:
-            try:
-                if self.is_https:
-                    req = Request(url=self.url, data=json.dumps(self.body).encode(), headers=self.header, method="POST")
-                    response_json = urlopen(req, context=self.context).read().decode("utf-8")
-                    response = json.loads(response_json)
-                else:
-                    response = requests.post(url=self.url, data=json.dumps(self.body), headers=self.header,
-                                             stream=False).json()
-                outputs = response.get("choices", [])[0].get("message", {}).get("content")
-                if not outputs:
-                    logger.error("Invalid response format for LLM, missing the 'prompt' key word")
-                    raise RuntimeError(self.ERRORCODE_INVALID_RESPONSE,
-                                       "Invalid response format for LLM, missing the 'prompt' key word") from None
-                return outputs
-            except Exception as e:
-                logger.error(f"LLM service is not available, error detail: {e}")
-                raise RuntimeError(self.ERRORCODE_SERVICE_UNAVAILABLE, "LLM service is not available") from None
-        return None  # 确保在所有情况下都返回
+        try:
+            response = self._request(body)
+            logger.info(f"Response status code: {response.status}")
+            response_json = json.loads(response.data.decode('utf-8'))
+            outputs = response_json.get("choices", [])[0].get("message", {}).get("content")
+        except Exception as e:
+            logger.error(f"LLM service is not available, error detail: {e}")
+            raise RuntimeError(self.ERRORCODE_SERVICE_UNAVAILABLE, "LLM service is not available") from None
+        if not outputs:
+            logger.error("Invalid response format for LLM, missing the 'prompt' key word")
+            raise RuntimeError(self.ERRORCODE_INVALID_RESPONSE,
+                               "Invalid response format for LLM, missing the 'prompt' key word") from None
+        return outputs
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import os
+import queue
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional
+
+import ray
+from loguru import logger
+
+from datamate.common.utils.shared_actor import SharedActorProxy, get_shared_actor_options
+
+
+class ModelServer:
+    """
+    模型推理服务：模型只加载一次，各调用方的请求进入同一队列，由推理线程合并为动态批次执行。
+    推理线程取到首个请求后最多等待max_wait_ms收集后续请求，批次达到max_batch_size时立即执行。
+
+    :param loader: 加载模型的函数，返回模型对象
+    :param batch_fn: 批量推理函数，入参为(模型, 输入列表)，返回与输入一一对应的结果列表
+    """
+
+    def __init__(self, loader: Callable[[], Any], batch_fn: Callable[[Any, List], List],
+                 max_batch_size: int = 16, max_wait_ms: float = 10):
+        self.model = loader()
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._requests = queue.Queue()
+        self._lock = Lock()
+        self._metrics = {
+            "requests": 0,
+            "batches": 0,
+            "failed_requests": 0,
+            "infer_seconds": 0.0,
+        }
+        self._thread = Thread(target=self._serve, name="model-server", daemon=True)
+        self._thread.start()
+
+    def infer(self, item):
+        return self.infer_batch([item])[0]
+
+    def infer_batch(self, items: List) -> List:
+        """提交一组输入并等待推理结果，同组输入可能与其它调用方的输入合并为一个批次"""
+        futures = []
+        for item in items:
+            future = Future()
+            self._requests.put((item, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["avg_batch_size"] = metrics["requests"] / metrics["batches"] if metrics["batches"] else 0
+        return metrics
+
+    def _collect_batch(self) -> List:
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, batch: List) -> int:
+        """执行一个批次，返回失败的请求数。批次推理失败时逐个重新推理，避免个别异常输入影响同批次的其它请求"""
+        try:
+            outputs = self.batch_fn(self.model, [item for item, _ in batch])
+            if len(outputs) != len(batch):
+                raise ValueError(f"Model returns {len(outputs)} results for {len(batch)} inputs")
+        except Exception as e:
+            if len(batch) > 1:
+                return sum(self._run([request]) for request in batch)
+            logger.error(f"Model server inference failed: {e}")
+            batch[0][1].set_exception(e)
+            return 1
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+        return 0
+
+    def _serve(self):
+        while True:
+            batch = self._collect_batch()
+            start = time.time()
+            failed = self._run(batch)
+            with self._lock:
+                self._metrics["requests"] += len(batch)
+                self._metrics["batches"] += 1
+                self._metrics["failed_requests"] += failed
+                self._metrics["infer_seconds"] += time.time() - start
+
+
+_model_servers = {}
+_model_servers_lock = Lock()
+
+
+def get_model_server_options(op_kwargs: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    服务actor的资源需求：模型在服务actor中加载并推理，加速卡（gpu、npu）及架构按调用方算子的配置申请，
+    与算子actor的资源需求（get_op_resources）保持一致
+    """
+    op_kwargs = op_kwargs or {}
+    options = {"num_cpus": float(os.getenv("MODEL_SERVER_NUM_CPUS", "1"))}
+    resources = {}
+    if op_kwargs.get("npu", 0) > 0:
+        resources["npu"] = op_kwargs.get("npu")
+    if op_kwargs.get("arch", "arm").startswith("x86"):
+        resources["arch"] = "x86"
+    if resources:
+        options["resources"] = resources
+    if op_kwargs.get("gpu", 0) > 0:
+        options["num_gpus"] = op_kwargs.get("gpu")
+    return options
+
+
+def get_model_server(name: str, loader: Callable[[], Any], batch_fn: Callable[[Any, List], List],
+                     op_kwargs: Optional[Dict[str, Any]] = None):
+    """
+    获取模型推理服务。ray已初始化时以ray命名actor的形式创建，同名actor已存在时直接复用，
+    多个算子actor共用一份模型，不同算子actor的请求在服务端合并为批次推理。
+    服务actor与其它共享actor一样以detached方式创建在当前作业的命名空间中，任务结束时由driver统一释放。
+    ray未初始化或环境变量MODEL_SERVER_ENABLED=false时，在当前进程内加载模型。
+
+    服务配置通过环境变量指定：
+        MODEL_SERVER_REPLICAS: 每个模型的服务actor数，默认1，调用方按进程号选择其中一个
+        MODEL_SERVER_MAX_BATCH_SIZE: 批次上限，默认16
+        MODEL_SERVER_MAX_WAIT_MS: 凑批最长等待时间（毫秒），默认10
+        MODEL_SERVER_NUM_CPUS: 服务actor占用的CPU数，默认1
+
+    :param name: 服务名称，模型或其加载参数不同时应使用不同的名称
+    :param loader: 加载模型的函数，需可被序列化
+    :param batch_fn: 批量推理函数，需可被序列化
+    :param op_kwargs: 调用方算子的初始化参数，服务actor按其中的gpu、npu、arch申请资源
+    """
+    with _model_servers_lock:
+        if name in _model_servers:
+            return _model_servers[name]
+
+        max_batch_size = int(os.getenv("MODEL_SERVER_MAX_BATCH_SIZE", "16"))
+        if not ray.is_initialized() or os.getenv("MODEL_SERVER_ENABLED", "true").lower() != "true":
+            # 进程内只有本算子调用，无需等待凑批
+            server = ModelServer(loader, batch_fn, max_batch_size, 0)
+        else:
+            replica = os.getpid() % max(1, int(os.getenv("MODEL_SERVER_REPLICAS", "1")))
+            actor_name = f"model_server_{name}_{replica}"
+            actor_cls = ray.remote(ModelServer).options(max_concurrency=max(64, max_batch_size * 4),
+                                                        **get_model_server_options(op_kwargs),
+                                                        **get_shared_actor_options(actor_name))
+            max_wait_ms = float(os.getenv("MODEL_SERVER_MAX_WAIT_MS", "10"))
+            server = SharedActorProxy(lambda: actor_cls.remote(loader, batch_fn, max_batch_size, max_wait_ms))
+            logger.info(f"Get model server named {actor_name}.")
+        _model_servers[name] = server
+        return server
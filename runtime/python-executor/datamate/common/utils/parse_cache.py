@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from datamate.common.utils.sqlite_cache import SqliteLruCache
+
+# 缓存内容格式的版本，格式变化时递增使旧条目失效
+PARSE_CACHE_VERSION = "1"
+
+
+def get_file_hash(filepath: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容的sha256，大文件无需整体读入内存"""
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_parse_cache_key(filepath: str, filetype: str, parser_version: str) -> str:
+    """缓存键：文件内容哈希、文件类型及解析器版本，内容相同的文件无论路径如何共用一个条目"""
+    content = f"{get_file_hash(filepath)}:{filetype}:{parser_version}:{PARSE_CACHE_VERSION}"
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ParseCache(SqliteLruCache):
+    """
+    文件解析结果缓存：以文件内容哈希和解析器版本为键，将抽取的文本或解码后的图片保存在本地SQLite数据库中。
+    缓存默认关闭，可通过算子参数或环境变量PARSE_CACHE_ENABLED=true开启，数据库路径由PARSE_CACHE_PATH指定，
+    数据库超过容量上限（PARSE_CACHE_MAX_SIZE，MB）时按最近访问时间淘汰，条目默认不过期。
+    """
+    NAME = "parse_cache"
+    ENV_PREFIX = "PARSE_CACHE"
+    DEFAULT_FILE_NAME = "parse_cache.db"
+    DEFAULT_MAX_SIZE = "4096"
+    EVICT_INTERVAL = 50
+
+    def encode(self, value: bytes) -> bytes:
+        return value
+
+    def decode(self, content: bytes) -> bytes:
+        return content
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import tarfile
+import time
+from threading import Lock
+from typing import Dict, Iterator, List, Tuple
+
+from loguru import logger
+
+SHARD_SUFFIX = ".tar"
+# 分片索引文件，每行记录一个切片在tar文件中的名称、数据偏移和大小
+SHARD_INDEX_SUFFIX = ".tar.idx"
+
+
+def is_shard_index(path: str) -> bool:
+    return path.endswith(SHARD_INDEX_SUFFIX)
+
+
+class PatchShardWriter:
+    """
+    切片分片写入器：将同一源文件的切片依次追加到tar分片中（兼容WebDataset格式），
+    分片中的切片数或大小达到上限后切换到新分片，关闭分片时写出索引文件。
+    分片写入过程中使用隐藏的临时文件名，关闭后重命名，文件扫描不会登记未写完的分片。
+
+    :param export_path: 分片保存目录
+    :param prefix: 分片文件名前缀，分片命名为{prefix}_{分片序号}.tar
+    :param max_count: 单个分片的切片数上限
+    :param max_bytes: 单个分片的大小上限
+    """
+
+    def __init__(self, export_path: str, prefix: str, max_count: int, max_bytes: int):
+        self.export_path = export_path
+        self.prefix = prefix
+        self.max_count = max(1, max_count)
+        self.max_bytes = max_bytes
+        self.shard_paths: List[str] = []
+        self._lock = Lock()
+        self._tar = None
+        self._tmp_path = None
+        self._index: List[Dict] = []
+        os.makedirs(export_path, exist_ok=True)
+
+    def write(self, name: str, data: bytes):
+        """追加一个切片，多线程并发调用时按调用顺序写入"""
+        with self._lock:
+            if self._tar is not None and (len(self._index) >= self.max_count
+                                          or 0 < self.max_bytes <= self._tar.offset + len(data)):
+                self._close_shard()
+            if self._tar is None:
+                self._open_shard()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o640
+            self._tar.addfile(info, io.BytesIO(data))
+            # 数据按512字节对齐，写入后的偏移减去对齐后的数据长度即为数据起始偏移
+            offset = self._tar.offset - (len(data) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+            self._index.append({"name": name, "offset": offset, "size": len(data)})
+
+    def close(self) -> List[str]:
+        """关闭当前分片，返回已写出的所有分片路径"""
+        with self._lock:
+            if self._tar is not None:
+                self._close_shard()
+            return list(self.shard_paths)
+
+    def _open_shard(self):
+        shard_name = f"{self.prefix}_{len(self.shard_paths):05d}{SHARD_SUFFIX}"
+        self._tmp_path = os.path.join(self.export_path, f".{shard_name}.tmp")
+        self._tar = tarfile.open(self._tmp_path, "w", format=tarfile.PAX_FORMAT)
+        self._index = []
+
+    def _close_shard(self):
+        self._tar.close()
+        shard_path = os.path.join(self.export_path, os.path.basename(self._tmp_path)[1:-len(".tmp")])
+        with open(shard_path[:-len(SHARD_SUFFIX)] + SHARD_INDEX_SUFFIX, "w", encoding="utf-8") as f:
+            for entry in self._index:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(self._tmp_path, shard_path)
+        os.chmod(shard_path, 0o640)
+        self.shard_paths.append(shard_path)
+        logger.info(f"Patch shard {shard_path} closed with {len(self._index)} patches.")
+        self._tar, self._tmp_path, self._index = None, None, []
+
+
+class PatchShardReader:
+    """
+    切片分片读取器：根据索引文件随机读取分片中的切片，索引文件不存在时遍历tar文件重建索引。
+
+    示例::
+
+        with PatchShardReader(path) as reader:
+            for name, data in reader:
+                ...
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index = self._load_index()
+        self._file = open(path, "rb")
+
+    def names(self) -> List[str]:
+        return list(self._index)
+
+    def read(self, name: str) -> bytes:
+        offset, size = self._index[name]
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self) -> Iterator[Tuple[str, bytes]]:
+        for name in self._index:
+            yield name, self.read(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _load_index(self) -> Dict[str, Tuple[int, int]]:
+        index_path = self.path[:-len(SHARD_SUFFIX)] + SHARD_INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                entries = (json.loads(line) for line in f if line.strip())
+                return {entry["name"]: (entry["offset"], entry["size"]) for entry in entries}
+        with tarfile.open(self.path, "r") as tar:
+            return {member.name: (member.offset_data, member.size) for member in tar if member.isfile()}
@@ -0,0 +1,316 @@
+# -- encoding: utf-8 --
+import bisect
+import hashlib
+import ipaddress
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from datamate.core.constant import Fields
+
+try:
+    from email_validator import validate_email, EmailNotValidError
+except ImportError:
+    validate_email, EmailNotValidError = None, ValueError
+
+# 扫描结果格式版本，检测规则变化时已缓存的扫描结果自动失效
+_SCAN_VERSION = 2
+# 文本首尾的占位符，使处于文本开头和结尾的敏感信息也能满足前后边界的断言
+_PAD = "\n"
+
+
+def _get_credit_card_pattern() -> str:
+    separator_symbol = r"([- ]?)"
+    # American Express 以 34 或 37 开头的 15 位数号码 格式:NNNN-NNNNNN-NNNNN 或 NNNN NNNNNN NNNNN
+    american_express = "3[47][0-9]{2}" + separator_symbol + "[0-9]{6}" + separator_symbol + "[0-9]{5}"
+    # 中国银联 以 62 或 60 开头，是一个 16 位数号码。 格式:NNNN-NNNN-NNNN-NNNN 或 NNNN NNNN NNNN NNNN
+    china_union_pay = r"(6[02]\d{2})" + r"(%s\d{%d}){%d}" % (separator_symbol, 4, 3)
+    # Diner's Club 以 300–305、36、38 或 39、3095 开头, 14 位数号码  格式:NNNN-NNNNNN-NNNN 或 NNNN NNNNNN NNNN。
+    diners_club = r"(30[0-5]\d|3[689]\d{2}|3095)" + separator_symbol + r"[0-9]{6}" + separator_symbol + r"[0-9]{4}"
+    # Discover 以 6011、644–649 或 65 开头的 16 位数号码 格式:NNNN-NNNN-NNNN-NNNN 或 NNNN NNNN NNNN NNNN
+    discover = r"(64[4-9]\d|65\d{2}|6011)" + r"(%s\d{%d}){%d}" % (separator_symbol, 4, 3)
+    # JCB 以 3528 到 3589 开头的 16 位数字, 格式:NNNN-NNNN-NNNN-NNNN 或 NNNN NNNN NNNNNNNN
+    jcb = r"(352[89]|35[3-8]\d)" + separator_symbol + r"[0-9]{4}" + (
+            r"((%s\d{%d}){%d}" % (separator_symbol, 4, 2) + ")|" + separator_symbol + r"[0-9]{8}")
+    # Mastercard 以 51–55 或 2221–2720 开头的 16 位数字 格式:NNNN-NNNN-NNNN-NNNN 或 NNNN NNNN NNNN NNNN
+    master_card = r"(5[1-5]\d{2}|222[1-9]|22[3-9]\d|2[3-6]\d{2}|27[01]\d|2720)" + r"(%s\d{%d}){%d}" \
+                  % (separator_symbol, 4, 3)
+    # visa 以4开头 16 位数号码 格式:NNNN-NNNN-NNNN-NNNN 或 NNNN NNNN NNNN NNNN
+    visa = r"4\d{3}" + r"(%s\d{%d}){%d}" % (separator_symbol, 4, 3)
+    return r"(?<=[^\d])(?:%s|%s|%s|%s|%s|%s|%s)(?=[^\d])" % (
+        american_express, china_union_pay, diners_club, discover, jcb, master_card, visa)
+
+
+def _get_phone_pattern() -> str:
+    """
+    前缀：（0086）、（86）、(0086)、(86) 、无
+    电话号码：第一位1，第二位3-9，后续数字可以为0-9，数字按照3-4-4进行间隔，间隔符为空格、-、无
+    固定电话号码：0AX-CXXX-XXXX、0BXX-CXXX-XXXX、0BXX-CXX-XXXX A为1-2、B为3-9、C为2-8、X为0-9
+    约束：电话号码前后皆为非数字
+    """
+    number_prefix = r'([\(（]?\+?(00)?86[)\）]?[- ]?)?'
+    cellphone_pattern = r"1[3-9]\d[- ]?\d{4}[- ]?\d{4}"
+    landline_pattern = (r'[(（]?(0?[12]\d)[)）]?[ -]?[2-8]\d{3}[ -]?\d{4}'
+                        r'|[(（]?(0?[3-9]\d{2})[)）]?[ -]?[2-8]\d{2}\d?[ -]?\d{4}')
+    return rf'(?<=[^\d]){number_prefix}(?:{cellphone_pattern}|{landline_pattern})(?=[^\d])'
+
+
+# 中国身份证号共计18位，1,2位省份，3,4位城市，5,6位县区码，7~14位为出生日期，最后一位为校验码，做了严格限定
+ID_NUMBER_PATTERN = r'(?<=[^0-9])' \
+                    r'(1[1-5]|2[1-3]|3[1-7]|4[1-6]|5[0-4]|6[1-5]|71|81|82)' \
+                    r'(0[0-9]|1[0-9]|2[0-9]|3[0-4]|4[0-3]|5[1-3]|90)' \
+                    r'(0[0-9]|1[0-9]|2[0-9]|3[0-9]|4[0-3]|5[1-7]|6[1-4]|7[1-4]|8[1-7])' \
+                    r'(18|19|20)\d{2}(0[1-9]|1[0-2])(0[1-9]|[12][0-9]|3[01])' \
+                    r'\d{3}[0-9xX]' \
+                    r'(?=[^0-9xX])'
+EMAIL_PATTERN = r'(?<=[^0-9a-zA-Z\!\#\$\%\&\'\*\+\-\/\=\?\^\_\`\{\|\}\~\-])' \
+                r'[a-zA-Z\d.\-+_]+\s?@\s?[a-zA-Z\d.\-+_]+\.[a-zA-Z0-9]{2,6}' \
+                r'(?=[^0-9a-zA-Z\!\#\$\%\&\'\*\+\-\/\=\?\^\_\`\{\|\}\~\-])'
+URL_PATTERN = r'(?:(?:https?|ftp|file)://|(?<![a-zA-Z\-\.])www\.)' \
+              r'[\-A-Za-z0-9\+&@\(\)#/%\?=\^~_|!:\,\.\;]+[\-A-Za-z0-9\+&@#/%=\~_\|]' \
+              r'(?![\-A-Za-z0-9\+&@#/%=\~_\|])'
+IPV4_PATTERN = r"(?<![\d.])\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?![.\d])"
+IPV6_PATTERN = r"(?<![0-9a-fA-F:])(?:[0-9a-fA-F]{0,4}:)+[0-9a-fA-F]{0,4}(?![0-9a-fA-F:])"
+# X.X.X.X与四级目录格式相同，避免误清洗，该格式的IP地址必须匹配 IP/IP地址等字样
+SINGLE_BYTE_IPV4_RE = re.compile(r'(?<![\.\d])\d\.\d\.\d\.\d(?![\.\d])')
+SINGLE_BYTE_IPV4_WITH_PREFIX_RE = re.compile(
+    r'ip(地址| address|v4)?( |:|：)*(?<![\.\d])\d\.\d\.\d\.\d(?![\.\d])', re.IGNORECASE)
+
+ID_COEFFICIENT = (7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2)
+ID_VERIFICATION = ("1", "0", "X", "9", "8", "7", "6", "5", "4", "3", "2")
+
+
+def verify_credit_card_num(credit_card_num: str) -> bool:
+    """信用卡号码Luhn校验"""
+    # 从右到左翻转
+    digits = [int(x) for x in reversed(credit_card_num) if x.isdigit()]
+    # 对偶数位数字翻倍，翻倍之后结果是一个两位数时将这两位数字加在一起
+    even_sum = sum(d * 2 // 10 + d * 2 % 10 for d in digits[1::2])
+    # 将卡号里从右到左奇数位上所有数字相加，总和能被10整除为合法
+    return (sum(digits[::2]) + even_sum) % 10 == 0
+
+
+def verify_id_number(id_number: str) -> bool:
+    """身份证号码校验码正确性校验，校验不通过时按宽松规则匹配类似身份证的字符串"""
+    id_sum = sum(int(num) * coe for num, coe in zip(id_number[:-1], ID_COEFFICIENT))
+    if id_number[-1].upper() == ID_VERIFICATION[id_sum % 11]:
+        return True
+    return len(id_number) == 18 and id_number[:17].isdigit() and id_number[-1].upper() in set('0123456789X')
+
+
+def verify_ip_address(ip: str) -> bool:
+    """验证字符串是否为合法ip地址"""
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return True
+
+
+def verify_email(email: str) -> bool:
+    if validate_email is None:
+        return True
+    try:
+        validate_email(email, check_deliverability=False)
+    except EmailNotValidError as err:
+        # 日志打印该电子邮件地址无效（不显示具体电子邮件地址）
+        logger.error(f"email is abnormal email form: {err}")
+        return False
+    return True
+
+
+def _verify_ipv4(text: str, start: int, end: int) -> bool:
+    ipv4 = text[start:end]
+    if not verify_ip_address(ipv4):
+        return False
+    if not SINGLE_BYTE_IPV4_RE.fullmatch(ipv4):
+        return True
+    # 单字节ip地址需搜索关键字眼，所在行中有关键字眼时该行的单字节ip地址匿名化
+    line_start = text.rfind("\n", 0, start) + 1
+    line_end = text.find("\n", end)
+    return SINGLE_BYTE_IPV4_WITH_PREFIX_RE.search(text, line_start, len(text) if line_end < 0 else line_end) \
+        is not None
+
+
+class PiiDetector:
+    """敏感信息检测规则：正则表达式、匿名化替换文本及命中后的校验函数"""
+
+    def __init__(self, label: str, pattern: str, replacement: str,
+                 validator: Optional[Callable[[str, int, int], bool]] = None):
+        self.label = label
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.replacement = replacement
+        self.validator = validator
+
+    def is_valid(self, text: str, start: int, end: int) -> bool:
+        return self.validator is None or self.validator(text, start, end)
+
+
+# 同一次替换的多个类别在同一位置命中时按列表顺序优先
+DEFAULT_DETECTORS = [
+    PiiDetector("url", URL_PATTERN, "<url>"),
+    PiiDetector("email", EMAIL_PATTERN, "<email>", lambda text, start, end: verify_email(text[start:end])),
+    PiiDetector("id_number", ID_NUMBER_PATTERN, "<id>", lambda text, start, end: verify_id_number(text[start:end])),
+    PiiDetector("credit_card", _get_credit_card_pattern(), "<credit_card_number>",
+                lambda text, start, end: verify_credit_card_num(text[start:end])),
+    PiiDetector("phone", _get_phone_pattern(), "<tel>"),
+    PiiDetector("ipv4", IPV4_PATTERN, "<ip>", _verify_ipv4),
+    PiiDetector("ipv6", IPV6_PATTERN, "<ip>", lambda text, start, end: verify_ip_address(text[start:end])),
+]
+
+
+def get_text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class PiiScrubber:
+    """
+    敏感信息单次扫描匿名化引擎。
+
+    所有检测规则合并为一个正则表达式，一次扫描定位任一规则可能命中的位置，仅在这些位置上逐个规则匹配并校验
+    （Luhn、身份证校验码等），得到各类别各自互不重叠的命中区间；不同类别的区间可以重叠，
+    替换时只在请求的类别之间按起始位置及规则顺序解决重叠，再根据区间列表一次性重写文本。
+    扫描结果按类别缓存在样本的Fields.pii_scan字段中，流水线中首个匿名化算子扫描全部类别，后续算子直接复用；
+    替换后未受影响的类别按替换后的偏移修正区间，区间与替换位置重叠或相邻的类别从缓存中移除，
+    由使用它的算子在替换后的文本上重新扫描该类别。
+    """
+
+    def __init__(self, detectors: List[PiiDetector] = None):
+        self.detectors = detectors or DEFAULT_DETECTORS
+        self.detector_map = {detector.label: detector for detector in self.detectors}
+        self.priority = {detector.label: index for index, detector in enumerate(self.detectors)}
+        self._combined_regexes = {}
+        self.config_hash = hashlib.sha256(json.dumps(
+            [_SCAN_VERSION] + [[detector.label, detector.pattern, detector.replacement]
+                               for detector in self.detectors]).encode("utf-8")).hexdigest()[:16]
+
+    def _get_combined_regex(self, labels: Tuple[str, ...]):
+        if labels not in self._combined_regexes:
+            self._combined_regexes[labels] = re.compile(
+                "|".join(f"(?:{self.detector_map[label].pattern})" for label in labels))
+        return self._combined_regexes[labels]
+
+    def scan_text(self, text: str, labels: Iterable[str] = None) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        一次扫描文本中指定类别（默认全部类别）的敏感信息，返回各类别按位置排序、互不重叠的(起始位置, 结束位置)，
+        区间左闭右开。各类别的结果与单独扫描该类别一致：命中校验不通过时从下一个位置继续，通过时从区间末尾继续。
+        """
+        selected = None if labels is None else set(labels)
+        labels = tuple(label for label in self.detector_map if selected is None or label in selected)
+        combined_regex = self._get_combined_regex(labels)
+        detectors = [self.detector_map[label] for label in labels]
+        padded = f"{_PAD}{text}{_PAD}"
+        matches = {label: [] for label in labels}
+        next_pos = {label: 0 for label in labels}
+        pos = 0
+        while True:
+            match = combined_regex.search(padded, pos)
+            if match is None:
+                break
+            start = match.start()
+            # 任一规则可在该位置命中，逐个规则在该位置匹配，已命中区间内的位置不再匹配同一类别
+            for detector in detectors:
+                if start < next_pos[detector.label]:
+                    continue
+                label_match = detector.regex.match(padded, start)
+                if label_match and detector.is_valid(padded, start, label_match.end()):
+                    matches[detector.label].append((start - len(_PAD), label_match.end() - len(_PAD)))
+                    next_pos[detector.label] = max(label_match.end(), start + 1)
+            pos = start + 1
+        return matches
+
+    def scan(self, sample: Dict[str, Any], text_key: str, labels: Iterable[str]) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        获取样本文本中指定类别的扫描结果：样本中没有有效的缓存时一次扫描全部类别，
+        缓存中缺少个别类别（替换后被移除）时只扫描缺失的类别
+        """
+        text = sample.get(text_key) or ""
+        digest = get_text_digest(text)
+        matches = None
+        cached = sample.get(Fields.pii_scan)
+        if cached:
+            try:
+                cached = json.loads(cached)
+                if cached.get("config") == self.config_hash and cached.get("digest") == digest:
+                    matches = {label: [tuple(span) for span in spans]
+                               for label, spans in cached.get("matches", {}).items()}
+            except (TypeError, ValueError, AttributeError):
+                matches = None
+        if matches is None:
+            matches = self.scan_text(text)
+        else:
+            missing = [label for label in labels if label not in matches]
+            if not missing:
+                return matches
+            matches.update(self.scan_text(text, missing))
+        self._save(sample, digest, matches)
+        return matches
+
+    def scrub(self, sample: Dict[str, Any], text_key: str, labels: Iterable[str]) -> str:
+        """将指定类别的敏感信息替换为匿名化文本，并更新样本中缓存的其余类别区间偏移"""
+        selected = set(labels)
+        labels = [label for label in self.detector_map if label in selected]
+        text = sample.get(text_key) or ""
+        matches = self.scan(sample, text_key, labels)
+        candidates = sorted(((start, end, label) for label in labels for start, end in matches[label]),
+                            key=lambda item: (item[0], self.priority[item[2]]))
+        replaced = []
+        for start, end, label in candidates:
+            if replaced and start < replaced[-1][1]:
+                # 与已选区间重叠
+                continue
+            replaced.append((start, end, label))
+        if not replaced:
+            return text
+
+        pieces, shifts = [], []
+        last_end, offset = 0, 0
+        for start, end, label in replaced:
+            replacement = self.detector_map[label].replacement
+            pieces.append(text[last_end:start])
+            pieces.append(replacement)
+            offset += len(replacement) - (end - start)
+            shifts.append((end, offset))
+            last_end = end
+        pieces.append(text[last_end:])
+        text = "".join(pieces)
+
+        remaining = {}
+        for label, spans in matches.items():
+            if label in labels or any(self._touches(span, replaced) for span in spans):
+                continue
+            remaining[label] = []
+            for start, end in spans:
+                shift = self._shift(start, shifts)
+                remaining[label].append((start + shift, end + shift))
+        self._save(sample, get_text_digest(text), remaining)
+        return text
+
+    @staticmethod
+    def _touches(span: Tuple[int, int], replaced: List[Tuple[int, int, str]]) -> bool:
+        """区间与任一替换区间重叠或相邻，相邻字符变化可能改变前后边界断言的结果"""
+        index = bisect.bisect_right(replaced, (span[1], float("inf"), ""))
+        return index > 0 and replaced[index - 1][1] >= span[0]
+
+    @staticmethod
+    def _shift(pos: int, shifts: List[Tuple[int, int]]) -> int:
+        """位于pos之前的替换带来的累计偏移"""
+        index = bisect.bisect_right(shifts, (pos, float("inf")))
+        return shifts[index - 1][1] if index > 0 else 0
+
+    def _save(self, sample: Dict[str, Any], digest: str, matches: Dict[str, List[Tuple[int, int]]]):
+        sample[Fields.pii_scan] = json.dumps({"config": self.config_hash, "digest": digest, "matches": matches})
+
+
+_default_scrubber = None
+
+
+def get_pii_scrubber() -> PiiScrubber:
+    """进程内共享的默认匿名化引擎，各匿名化算子共用同一份编译后的正则表达式"""
+    global _default_scrubber
+    if _default_scrubber is None:
+        _default_scrubber = PiiScrubber()
+    return _default_scrubber
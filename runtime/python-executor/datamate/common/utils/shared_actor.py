@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+from typing import Any, Dict
+
+import ray
+from loguru import logger
+
+SHARED_ACTOR_NAMESPACE = "datamate"
+
+
+def get_shared_actor_namespace() -> str:
+    """共享actor所在的命名空间，每个ray作业（即每个清洗任务）一个，作业结束时统一释放"""
+    return f"{SHARED_ACTOR_NAMESPACE}_{ray.get_runtime_context().get_job_id()}"
+
+
+def get_shared_actor_options(name: str) -> Dict[str, Any]:
+    """
+    共享actor的创建参数：以detached方式创建，生命周期不依赖创建它的算子actor，
+    算子actor池缩容或退出时共享状态不会丢失，由driver在任务结束时调用release_shared_actors释放
+    """
+    return {
+        "name": name,
+        "namespace": get_shared_actor_namespace(),
+        "get_if_exists": True,
+        "lifetime": "detached",
+    }
+
+
+class SharedActorProxy:
+    """ray actor同步调用代理，使共享对象与进程内对象的调用方式一致"""
+
+    def __init__(self, create_handle):
+        self._create_handle = create_handle
+        self._handle = create_handle()
+
+    def __getattr__(self, name):
+        def _call(*args, **kwargs):
+            try:
+                return ray.get(getattr(self._handle, name).remote(*args, **kwargs))
+            except ray.exceptions.RayActorError:
+                # 共享actor异常退出时，重新获取（或创建）同名actor后重试
+                logger.warning(f"Shared actor is unavailable, recreate it and retry {name}.")
+                self._handle = self._create_handle()
+                return ray.get(getattr(self._handle, name).remote(*args, **kwargs))
+
+        return _call
+
+    def submit(self, name, *args, **kwargs):
+        """异步调用，不等待执行结果，适用于上报计数等无需返回值的调用"""
+        return getattr(self._handle, name).remote(*args, **kwargs)
+
+
+class LocalInstanceProxy:
+    """进程内共享对象的代理，提供与SharedActorProxy一致的submit接口"""
+
+    def __init__(self, instance):
+        self._instance = instance
+
+    def __getattr__(self, name):
+        return getattr(self._instance, name)
+
+    def submit(self, name, *args, **kwargs):
+        return getattr(self._instance, name)(*args, **kwargs)
+
+
+_shared_instances = {}
+_shared_lock = Lock()
+
+
+def get_shared_instance(cls, name: str, *args, **kwargs):
+    """
+    获取跨算子actor共享的对象：以ray命名actor的形式创建，同名actor已存在时直接复用。
+    actor内的方法串行执行，天然保证检查与写入的原子性。ray未初始化时（如本地调试）返回进程内对象。
+    共享对象可实现close方法，任务结束释放actor前会调用该方法（如持久化尚未写入数据库的数据）。
+    返回的代理对象同步调用共享对象的方法，无需等待结果的调用可通过submit(方法名, *参数)异步执行。
+
+    :param cls: 共享对象的类
+    :param name: 共享对象名称，同一任务内相同名称共享同一个对象
+    """
+    with _shared_lock:
+        if name in _shared_instances:
+            return _shared_instances[name]
+
+        if not ray.is_initialized():
+            instance = LocalInstanceProxy(cls(*args, **kwargs))
+        else:
+            actor_cls = ray.remote(cls).options(num_cpus=0, **get_shared_actor_options(name))
+            instance = SharedActorProxy(lambda: actor_cls.remote(*args, **kwargs))
+            logger.info(f"Get shared actor named {name}.")
+        _shared_instances[name] = instance
+        return instance
+
+
+def release_shared_actors():
+    """任务结束时由driver调用：依次关闭并销毁当前作业创建的全部共享actor"""
+    if not ray.is_initialized():
+        # 本地调试时共享对象均在当前进程内
+        with _shared_lock:
+            instances = list(_shared_instances.values())
+            _shared_instances.clear()
+        for instance in instances:
+            if hasattr(instance, "close"):
+                instance.close()
+        return
+    namespace = get_shared_actor_namespace()
+    for actor in ray.util.list_named_actors(all_namespaces=True):
+        if actor["namespace"] != namespace:
+            continue
+        try:
+            handle = ray.get_actor(actor["name"], namespace=namespace)
+        except ValueError:
+            continue
+        try:
+            ray.get(handle.close.remote())
+        except AttributeError:
+            pass
+        except Exception as e:
+            logger.warning(f"Close shared actor {actor['name']} failed: {e}")
+        ray.kill(handle)
+        logger.info(f"Shared actor {actor['name']} is released.")
+
+
+def _get_alive_job_ids():
+    """仍在运行的ray作业id，获取失败时返回None"""
+    try:
+        from ray._private.state import jobs
+        return {job["JobID"] for job in jobs() if not job.get("IsDead", False)}
+    except Exception as e:
+        logger.warning(f"Query ray jobs failed: {e}")
+        return None
+
+
+def reap_stale_shared_actors():
+    """
+    任务启动时由driver调用：销毁所属作业已结束的共享actor。
+    driver被强制结束（如SIGKILL）时来不及释放detached共享actor，由后续任务在启动时回收。
+    """
+    alive_job_ids = _get_alive_job_ids()
+    if alive_job_ids is None:
+        return
+    prefix = f"{SHARED_ACTOR_NAMESPACE}_"
+    for actor in ray.util.list_named_actors(all_namespaces=True):
+        namespace = actor["namespace"]
+        if not namespace.startswith(prefix) or namespace[len(prefix):] in alive_job_ids:
+            continue
+        try:
+            ray.kill(ray.get_actor(actor["name"], namespace=namespace))
+            logger.info(f"Stale shared actor {actor['name']} in namespace {namespace} is released.")
+        except Exception as e:
+            logger.warning(f"Release stale shared actor {actor['name']} failed: {e}")
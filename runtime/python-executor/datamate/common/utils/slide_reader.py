@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Tuple, TypeVar
+
+import cv2
+import numpy as np
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def get_slide_workers() -> int:
+    """切片并行线程数，可通过环境变量SLIDE_SLICER_WORKERS指定"""
+    return max(1, int(os.getenv("SLIDE_SLICER_WORKERS", str(min(8, os.cpu_count() or 1)))))
+
+
+class ThreadLocalSlide:
+    """
+    线程本地的OpenSlide句柄：每个线程首次读取时打开一个句柄并在该线程内复用，
+    多线程并行读取区域时互不阻塞。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+
+    @property
+    def slide(self):
+        slide = getattr(self._local, "slide", None)
+        if slide is None:
+            from openslide import OpenSlide
+
+            slide = OpenSlide(self.path)
+            self._local.slide = slide
+            with self._lock:
+                self._handles.append(slide)
+        return slide
+
+    @property
+    def dimensions(self) -> Tuple[int, int]:
+        return self.slide.dimensions
+
+    def read_region_rgb(self, location: Tuple[int, int], level: int, size: Tuple[int, int]) -> np.ndarray:
+        """读取区域并转换为RGB数组"""
+        return np.array(self.slide.read_region(location, level, size).convert("RGB"))
+
+    def get_thumbnail_rgb(self, size: Tuple[int, int]) -> np.ndarray:
+        """读取不超过指定尺寸的缩略图，OpenSlide自动选择最接近的金字塔层级缩放"""
+        return np.array(self.slide.get_thumbnail(size).convert("RGB"))
+
+    def close(self):
+        with self._lock:
+            handles, self._handles = self._handles, []
+        for slide in handles:
+            slide.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def get_tissue_mask(thumbnail: np.ndarray, min_saturation: int = 20) -> np.ndarray:
+    """
+    根据低分辨率缩略图计算组织区域掩码：染色组织饱和度较高，空白背景接近白色或灰色，
+    对饱和度通道做Otsu阈值分割，阈值不低于min_saturation，避免纯背景图片被分割出噪声。
+
+    Return:
+        与缩略图同尺寸的uint8掩码，组织区域为1
+    """
+    saturation = cv2.cvtColor(thumbnail, cv2.COLOR_RGB2HSV)[:, :, 1]
+    saturation = cv2.GaussianBlur(saturation, (5, 5), 0)
+    threshold, _ = cv2.threshold(saturation, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return (saturation > max(threshold, min_saturation)).astype(np.uint8)
+
+
+def ordered_parallel_map(fn: Callable[[T], R], items: Iterable[T], max_workers: int) -> Iterator[R]:
+    """
+    在线程池中并行执行fn并按输入顺序返回结果。
+    同时执行的任务数不超过max_workers的2倍，待返回的结果不会随输入数量无限累积。
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="slide-slicer") as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(fn, item))
+            if len(futures) >= max_workers * 2:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import os
+import sqlite3
+import tempfile
+import time
+from threading import Lock
+from typing import Any, Dict, Optional, Union
+
+from loguru import logger
+
+from datamate.common.utils.task_metrics import report_task_metrics
+
+
+class SqliteLruCache:
+    """
+    本地SQLite键值缓存（进程内按路径单例）：同一节点上的actor共用一个数据库文件，
+    条目超过有效期后失效，数据库超过容量上限时按最近访问时间淘汰。
+    命中、未命中等计数由调用方在每个样本（批次）处理完成后通过report_metrics异步上报至任务级汇总对象。
+
+    子类指定缓存名称（NAME）及环境变量前缀（ENV_PREFIX），并实现值与数据库存储格式之间的转换。
+    缓存默认关闭，可通过环境变量{ENV_PREFIX}_ENABLED=true开启，{ENV_PREFIX}_PATH指定数据库路径，
+    {ENV_PREFIX}_MAX_SIZE指定容量上限（MB），{ENV_PREFIX}_TTL指定有效期（秒，不大于0时不过期）。
+    """
+    NAME = "cache"
+    ENV_PREFIX = "CACHE"
+    DEFAULT_FILE_NAME = "cache.db"
+    DEFAULT_MAX_SIZE = "1024"
+    DEFAULT_TTL = "0"
+    # 每写入若干条检查一次容量
+    EVICT_INTERVAL = 100
+
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __init__(self, path: str, ttl: float, max_bytes: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._writes_since_evict = 0
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "writes": 0,
+            "evicted": 0,
+            "errors": 0,
+        }
+        self._reported = dict(self._metrics)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, content BLOB NOT NULL, "
+                           "created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed)")
+        atexit.register(self.close)
+
+    @classmethod
+    def enable(cls, enabled: Union[bool, str, None] = None) -> Optional["SqliteLruCache"]:
+        """获取当前进程的缓存，enabled为None时由环境变量{ENV_PREFIX}_ENABLED决定，缓存关闭时返回None"""
+        if enabled is None:
+            enabled = os.getenv(f"{cls.ENV_PREFIX}_ENABLED", "false")
+        if isinstance(enabled, str):
+            enabled = enabled.lower() == "true"
+        if not enabled:
+            return None
+        path = os.getenv(f"{cls.ENV_PREFIX}_PATH",
+                         os.path.join(tempfile.gettempdir(), "datamate", cls.DEFAULT_FILE_NAME))
+        with cls._instances_lock:
+            if (cls, path) not in cls._instances:
+                try:
+                    cls._instances[(cls, path)] = cls(
+                        path, float(os.getenv(f"{cls.ENV_PREFIX}_TTL", cls.DEFAULT_TTL)),
+                        int(float(os.getenv(f"{cls.ENV_PREFIX}_MAX_SIZE", cls.DEFAULT_MAX_SIZE)) * 1024 * 1024))
+                except sqlite3.Error as e:
+                    logger.error(f"Open {cls.NAME} {path} failed, cache is disabled: {e}")
+                    return None
+            return cls._instances[(cls, path)]
+
+    def encode(self, value: Any) -> bytes:
+        """值转换为数据库中保存的内容（子类实现）"""
+        raise NotImplementedError
+
+    def decode(self, content: bytes) -> Any:
+        """数据库中保存的内容转换为值（子类实现）"""
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        try:
+            with self._lock:
+                if self._conn is None:
+                    return None
+                row = self._conn.execute("SELECT content, created FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self._metrics["misses"] += 1
+                    return None
+                if self.ttl > 0 and now - row[1] > self.ttl:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._metrics["expired"] += 1
+                    self._metrics["misses"] += 1
+                    return None
+                self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+                self._metrics["hits"] += 1
+                content = bytes(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"Read {self.NAME} failed: {e}")
+            self._metrics["errors"] += 1
+            return None
+        return self.decode(content)
+
+    def set(self, key: str, value: Any):
+        content = self.encode(value)
+        if 0 < self.max_bytes < len(content):
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                if self._conn is None:
+                    return
+                self._conn.execute("INSERT OR REPLACE INTO entries (key, content, created, accessed, size) "
+                                   "VALUES (?, ?, ?, ?, ?)", (key, sqlite3.Binary(content), now, now, len(content)))
+                self._metrics["writes"] += 1
+                self._writes_since_evict += 1
+                if self._writes_since_evict >= self.EVICT_INTERVAL:
+                    self._writes_since_evict = 0
+                    self._evict(now)
+        except sqlite3.Error as e:
+            logger.warning(f"Write {self.NAME} failed: {e}")
+            self._metrics["errors"] += 1
+
+    def _evict(self, now: float):
+        """删除过期条目，容量仍超限时按最近访问时间淘汰至上限的90%"""
+        evicted = 0
+        if self.ttl > 0:
+            evicted += self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,)).rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if self.max_bytes > 0 and total > self.max_bytes:
+            target = total - int(self.max_bytes * 0.9)
+            rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall()
+            keys = []
+            for key, size in rows:
+                if target <= 0:
+                    break
+                keys.append((key,))
+                target -= size
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            evicted += len(keys)
+        self._metrics["evicted"] += evicted
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._metrics)
+
+    def report_metrics(self):
+        """异步上报自上次上报以来的计数增量，不阻塞调用方"""
+        metrics = self.metrics()
+        delta = {key: value - self._reported.get(key, 0) for key, value in metrics.items()
+                 if value != self._reported.get(key, 0)}
+        self._reported = metrics
+        report_task_metrics(self.NAME, delta)
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            conn, self._conn = self._conn, None
+            conn.close()
+        logger.info(f"{self.NAME} closed, metrics: {self.metrics()}")
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+from typing import Any, Dict
+
+from loguru import logger
+
+from datamate.common.utils.shared_actor import get_shared_instance
+
+# 任务级计数汇总对象的共享名称
+TASK_METRICS_NAME = "task_metrics"
+
+
+class TaskMetricsCollector:
+    """任务级计数汇总：各actor上报计数增量，actor被销毁后已上报的计数仍然保留，任务结束时由driver输出"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = {}
+
+    def add(self, name: str, delta: Dict[str, Any]):
+        with self._lock:
+            metrics = self._metrics.setdefault(name, {})
+            for key, value in delta.items():
+                metrics[key] = metrics.get(key, 0) + value
+
+    def get(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: dict(metrics) for name, metrics in self._metrics.items()}
+
+
+def report_task_metrics(name: str, delta: Dict[str, Any]):
+    """异步上报计数增量，不等待汇总对象处理完成，上报失败时只记录日志"""
+    if not delta:
+        return
+    try:
+        get_shared_instance(TaskMetricsCollector, TASK_METRICS_NAME).submit("add", name, delta)
+    except Exception as e:
+        logger.warning(f"Report {name} metrics failed: {e}")
+
+
+def get_task_metrics() -> Dict[str, Dict[str, Any]]:
+    """当前任务各组件的汇总计数"""
+    return get_shared_instance(TaskMetricsCollector, TASK_METRICS_NAME).get()
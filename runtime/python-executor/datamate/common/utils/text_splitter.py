@@ -1,17 +1,23 @@
 #!/user/bin/python
 
 import re
-from typing import List
-from collections import deque
+from typing import List, Tuple
 
 from loguru import logger
 
+Span = Tuple[int, int]
+
 
 class TextSplitter:
-    """文本切片"""
+    """文本切片
+
+    切分过程只在原文上记录字符区间(start, end)，每一级分隔符对文本只遍历一次，
+    合并与overlap均按区间长度计算，仅在输出时截取字符串。
+    """
     # 基于常用标点符号分句，保持句子完整
     COMMON_PUNCTUATIONS = ["，", "。", "？", "！", "；", ",", "?", "!", ";"]
     PUNC_PATTERN = f"[{''.join(COMMON_PUNCTUATIONS)}]"
+    PUNC_RE = re.compile(PUNC_PATTERN)
 
     def __init__(self, max_characters: int, chunk_size: int, chunk_overlap: int):
         """文本切片初始化
@@ -30,142 +36,135 @@ class TextSplitter:
         self.separators = ["\n\n", "\n"]
 
     @staticmethod
-    def split_text_by_separator(text: str, separator: str):
-        """指定分隔符对文本进行切分，并且切分后的片段需要保留分隔符"""
-        # 处理一个换行符与两个换行符之间的冲突
-        if text.startswith("\n\n") and separator == "\n":
-            chunks = re.split(f"({separator})", text.strip())
-            chunks[0] = f"\n\n{chunks[0]}"
-        else:
-            chunks = re.split(f"({separator})", text)
-        new_chunks = [chunks[idx] + chunks[idx + 1] for idx in range(1, len(chunks), 2)]
-        new_chunks = [chunks[0]] + new_chunks
-        return [chunk for chunk in new_chunks if chunk.strip() != ""]
+    def strip_span(text: str, span: Span) -> Span:
+        """去除区间首尾的空白字符"""
+        start, end = span
+        chunk = text[start:end]
+        left = len(chunk) - len(chunk.lstrip())
+        if left == len(chunk):
+            return start, start
+        return start + left, start + len(chunk.rstrip())
 
     @staticmethod
-    def split_sentences(chunk: str):
+    def split_text_by_separator(text: str, span: Span, separator: str) -> List[Span]:
+        """指定分隔符对文本区间进行切分，分隔符保留在其后的片段开头，去除仅包含空白字符的片段"""
+        start, end = span
+        strip_start, strip_end = TextSplitter.strip_span(text, span)
+        spans = []
+        pos = text.find(separator, strip_start, strip_end)
+        while pos != -1:
+            spans.append((start, pos))
+            start = pos
+            pos = text.find(separator, pos + len(separator), strip_end)
+        spans.append((start, end))
+        return [(s, e) for s, e in spans if text[s:e].strip()]
+
+    @staticmethod
+    def split_sentences(text: str, span: Span) -> List[Span]:
         """对切片按照标点符号切分成句子，并且保持标点符号不丢失"""
-        sentences = re.split(TextSplitter.PUNC_PATTERN, chunk)
-        delimiters = [s for s in chunk if s in TextSplitter.COMMON_PUNCTUATIONS]
-        restore_chunks = []
-        for chunk, delimiter in zip(sentences[:-1], delimiters):
-            restore_chunks.append(chunk + delimiter)
-        return restore_chunks + [sentences[-1]]
-
-    def split_text(self, input_data: str):
+        start, end = span
+        spans = []
+        for match in TextSplitter.PUNC_RE.finditer(text, start, end):
+            spans.append((start, match.end()))
+            start = match.end()
+        if start < end:
+            spans.append((start, end))
+        return spans
+
+    def split_text(self, input_data: str) -> List[str]:
         if self.max_characters > 0:
             logger.info(f"The document characters should be within: {self.max_characters}")
             input_data = input_data[:self.max_characters]
-        logger.info(f"characters of the document: {len(input_data)}")
-        chunks = self.split_text_recursive(input_data, self.separators)
-        final_chunks = self.merge_chunks(chunks)
-        final_chunks = self.split_text_by_chunk_size(final_chunks)
-        return [chunk.strip() for chunk in final_chunks if chunk]
+        return [input_data[start:end] for start, end in self.split_spans(input_data)]
 
-    def split_text_recursive(self, input_data: str, separators: List[str]):
-        """对文档按照分隔符优先级进行递归切分：
+    def split_spans(self, input_data: str) -> List[Span]:
+        """切分文本，返回去除首尾空白后各切片在原文中的区间"""
+        logger.info(f"characters of the document: {len(input_data)}")
+        spans = self.split_text_recursive(input_data, (0, len(input_data)), self.separators)
+        spans = self.merge_chunks(spans)
+        spans = self.split_text_by_chunk_size(input_data, spans)
+        spans = [self.strip_span(input_data, span) for span in spans]
+        return [(start, end) for start, end in spans if end > start]
+
+    def split_text_recursive(self, text: str, span: Span, separators: List[str]) -> List[Span]:
+        """对文档按照分隔符优先级逐级切分：
             1. 符合chunk_size要求的切片不再切分。
-            2. 大于chunk_size要求的切片，继续进行递归切分。
+            2. 大于chunk_size要求的切片，使用下一级分隔符继续切分。
         Args:
-            input_data: 输入文本
+            text: 输入文本
+            span: 待切分的区间
             separators: 分隔符
 
         Returns:
-            List[str]: 切分后的文本片段
-
+            List[Span]: 切分后的文本区间
         """
-        chunks = []
-        cur_separator = ""
-        next_separators = []
-        for idx, sep in enumerate(separators):
-            sep = re.escape(sep)
-            if re.search(sep, input_data.strip()):
-                cur_separator = sep
-                next_separators = separators[idx + 1:]
-                break
-
-        if not cur_separator:
-            return [input_data]
-        else:
-            cur_chunks = TextSplitter.split_text_by_separator(input_data, cur_separator)
-
-        for chunk in cur_chunks:
-            if len(chunk.strip()) <= self.chunk_size:
-                chunks.append(chunk)
-            else:
-                if not next_separators:
-                    chunks.append(chunk)
+        spans = [span]
+        for sep in separators:
+            next_spans = []
+            for cur_span in spans:
+                strip_start, strip_end = self.strip_span(text, cur_span)
+                if strip_end - strip_start <= self.chunk_size or text.find(sep, strip_start, strip_end) == -1:
+                    next_spans.append(cur_span)
                 else:
-                    next_chunks = self.split_text_recursive(chunk, next_separators)
-                    chunks.extend(next_chunks)
-        return chunks
+                    next_spans.extend(self.split_text_by_separator(text, cur_span, sep))
+            spans = next_spans
+        return spans
 
-    def merge_chunks(self, chunks: List[str]):
-        """对切分后的文本片段进行合并，合并过程考虑overlap"""
-        final_chunks = []
+    def merge_chunks(self, spans: List[Span]) -> List[Span]:
+        """对切分后的相邻区间进行合并，合并过程考虑overlap"""
+        final_spans = []
         idx = 0
-        while idx < len(chunks):
-            if len(chunks[idx]) >= self.chunk_size:
-                final_chunks.append(chunks[idx])
+        while idx < len(spans):
+            start, end = spans[idx]
+            if end - start >= self.chunk_size:
+                final_spans.append(spans[idx])
                 idx += 1
                 continue
-            merge_idxes = self.get_merge_idxes(idx, chunks)
-            content = ""
-            for inner_idx in merge_idxes:
-                content += chunks[inner_idx]
-            final_chunks.append(content)
-            idx = merge_idxes[-1] + 1
-        return final_chunks
-
-    def get_merge_idxes(self, cur_idx: int, chunks: List[str]):
-        """获取可以合并的分片index，前向尽可能满足overlap，后向尽可能满足chunk_size"""
-        idxes = deque([cur_idx])
-        overlap_idx = cur_idx - 1
-        cur_len = len(chunks[cur_idx])
-        cur_idx += 1
+            first_idx, last_idx = self.get_merge_idxes(idx, spans)
+            final_spans.append((spans[first_idx][0], spans[last_idx][1]))
+            idx = last_idx + 1
+        return final_spans
+
+    def get_merge_idxes(self, cur_idx: int, spans: List[Span]) -> Tuple[int, int]:
+        """获取可以合并的区间范围，前向尽可能满足overlap，后向尽可能满足chunk_size"""
+        cur_len = spans[cur_idx][1] - spans[cur_idx][0]
         # 获取overlap的index
+        first_idx = cur_idx
         over_lap_len = 0
-        while overlap_idx >= 0:
-            over_lap_len += len(chunks[overlap_idx])
-            if over_lap_len > self.chunk_overlap or (cur_len + over_lap_len) > self.chunk_size:
-                over_lap_len -= len(chunks[overlap_idx])
+        while first_idx > 0:
+            span_len = spans[first_idx - 1][1] - spans[first_idx - 1][0]
+            if over_lap_len + span_len > self.chunk_overlap or cur_len + over_lap_len + span_len > self.chunk_size:
                 break
-            idxes.appendleft(overlap_idx)
-            overlap_idx -= 1
+            over_lap_len += span_len
+            first_idx -= 1
         cur_len += over_lap_len
         # 获取merge的index
-        while cur_idx < len(chunks):
-            cur_len += len(chunks[cur_idx])
+        last_idx = cur_idx
+        while last_idx + 1 < len(spans):
+            cur_len += spans[last_idx + 1][1] - spans[last_idx + 1][0]
             if cur_len > self.chunk_size:
                 break
-            idxes.append(cur_idx)
-            cur_idx += 1
-        return idxes
-
-    def split_chunks(self, chunks: List[str]):
-        """对超过`chunk_size`限制的切片进行截断，过程中需要考虑overlap参数"""
-        final_chunks = []
-        for chunk in chunks:
-            if len(chunk) <= self.chunk_size:
-                final_chunks.append(chunk)
-            else:
-                start = 0
-                end = self.chunk_size
-                while end < len(chunk):
-                    final_chunks.append(chunk[start: end])
-                    start += self.chunk_size - self.chunk_overlap
-                    end = start + self.chunk_size
-                final_chunks.append(chunk[start:])
-        return final_chunks
-
-    def split_text_by_chunk_size(self, chunks: List[str]):
-        """对切片后超长的文本块进行二次切分，使用截断，并考虑overlap"""
-        final_chunks = []
-        for chunk in chunks:
-            if len(chunk) <= self.chunk_size:
-                final_chunks.append(chunk)
+            last_idx += 1
+        return first_idx, last_idx
+
+    def split_chunks(self, spans: List[Span]) -> List[Span]:
+        """对超过`chunk_size`限制的区间进行截断，过程中需要考虑overlap参数"""
+        final_spans = []
+        step = self.chunk_size - self.chunk_overlap
+        for start, end in spans:
+            while end - start > self.chunk_size:
+                final_spans.append((start, start + self.chunk_size))
+                start += step
+            final_spans.append((start, end))
+        return final_spans
+
+    def split_text_by_chunk_size(self, text: str, spans: List[Span]) -> List[Span]:
+        """对切片后超长的区间按句子二次切分，仍超长的句子使用截断，并考虑overlap"""
+        final_spans = []
+        for span in spans:
+            if span[1] - span[0] <= self.chunk_size:
+                final_spans.append(span)
                 continue
-            sentences = TextSplitter.split_sentences(chunk)
-            sub_chunks = self.merge_chunks(sentences)
-            final_chunks.extend(self.split_chunks(sub_chunks))
-        return final_chunks
+            sub_spans = self.merge_chunks(self.split_sentences(text, span))
+            final_spans.extend(self.split_chunks(sub_spans))
+        return final_spans
@@ -0,0 +1,32 @@
+# -- encoding: utf-8 --
+import os
+from threading import Lock
+from typing import List
+
+_tokenizer = None
+_tokenizer_lock = Lock()
+
+
+def get_tokenizer():
+    """
+    获取进程内共享的jieba分词器，首次获取时即加载词典，避免首个样本承担词典加载耗时。
+    jieba将解析后的词典缓存为文件，可通过环境变量JIEBA_CACHE_DIR指定各actor共用的缓存目录，
+    同一节点上的actor只需构建一次词典缓存。
+    """
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            import jieba
+
+            cache_dir = os.getenv("JIEBA_CACHE_DIR")
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+                jieba.dt.tmp_dir = cache_dir
+            jieba.dt.initialize()
+            _tokenizer = jieba.dt
+        return _tokenizer
+
+
+def lcut(text: str) -> List[str]:
+    return get_tokenizer().lcut(text)
+
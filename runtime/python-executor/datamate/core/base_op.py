@@ -3,11 +3,13 @@
 import json
 import mimetypes
 import os
+import threading
 import time
 import traceback
 import uuid
+from importlib import metadata
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import Any, Callable, Dict, List, Tuple
 
 import cv2
 import numpy as np
@@ -15,7 +17,10 @@ from loguru import logger
 from unstructured.partition.auto import partition
 
 from datamate.common.error_code import ERROR_CODE_TABLE, UNKNOWN_ERROR_CODE
+from datamate.common.utils.llm_cache import LlmResponseCache
 from datamate.common.utils.llm_request import LlmReq
+from datamate.common.utils.parse_cache import ParseCache, get_parse_cache_key
+from datamate.common.utils.patch_shard import PatchShardWriter
 from datamate.common.utils.registry import Registry
 from datamate.common.utils import check_valid_path
 from datamate.core.constant import Fields
@@ -23,6 +28,20 @@ from datamate.sql_manager.persistence_atction import TaskInfoPersistence
 
 OPERATORS = Registry("Operators")
 
+
+def _get_package_version(package: str) -> str:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# 解析器版本作为解析结果缓存键的一部分，升级解析库后旧的缓存条目不再命中
+PARSER_VERSIONS = {
+    "partition": f"unstructured-{_get_package_version('unstructured')}",
+    "image": f"opencv-{cv2.__version__}",
+}
+
 FAILED_STATUS = "FAILED"
 SUCCESS_STATUS = "COMPLETED"
 
@@ -55,6 +74,10 @@ class BaseOp:
 
     use_model = False
     custom_ops = False
+    # 是否以批处理方式(map_batches)调度该算子，可在算子配置中通过use_batch覆盖
+    use_batch = False
+    # 是否在算子执行成功后保存中间结果（适用于耗时较长的算子），可在算子配置中通过checkpoint_output覆盖
+    checkpoint_output = False
 
     def __init__(self, *args, **kwargs):
         self.accelerator = kwargs.get("accelerator", "cpu")
@@ -75,6 +98,11 @@ class BaseOp:
         self.export_path_key = kwargs.get("export_path_key", "export_path")
         self.ext_params_key = kwargs.get("ext_params_key", "ext_params")
         self.target_type_key = kwargs.get("target_type_key", "target_type")
+        self.op_index = kwargs.get("op_index", -1)
+        # 开启检查点的算子执行成功后保存中间结果，任务重试时从该结果继续执行
+        self.checkpointer = kwargs.get("checkpointer", None)
+        # 文件解析结果缓存默认关闭，可通过算子参数parseCache或环境变量PARSE_CACHE_ENABLED开启
+        self.parse_cache = ParseCache.enable(kwargs.get("parseCache", None))
 
     @property
     def name(self):
@@ -117,6 +145,22 @@ class BaseOp:
 
         return error_code, exc_info
 
+    def should_skip(self, sample: Dict[str, Any]) -> bool:
+        """前序算子已执行该文件失败，或文件已从该算子及之后的检查点恢复，则跳过"""
+        if sample.get(Fields.result) is False:
+            return True
+        resume_index = sample.get(Fields.resume_index)
+        return resume_index is not None and resume_index >= self.op_index
+
+    def save_checkpoint(self, sample: Dict[str, Any]):
+        if self.checkpointer is None or self.is_last_op:
+            return
+        try:
+            self.checkpointer.save_stage(sample, self.op_index)
+        except Exception as e:
+            # 检查点保存失败不影响文件处理
+            logger.warning(f"Ops named {self.name} save checkpoint failed: {e}")
+
     def use_npu(self):
         """确认算子是否可以使用npu"""
         return self.accelerator == "npu" and self.is_npu_available()
@@ -137,6 +181,49 @@ class BaseOp:
             "This is in BaseOp, plese re-define this method in Sub-classes"
         )
 
+    def execute_batch(self, samples: List[Dict[str, Any]]) -> List[Any]:
+        """
+        批量执行函数，默认逐条调用execute。
+
+        子类可重写该方法以摊销初始化开销或进行向量化处理，返回结果需与输入一一对应。
+        重写后的方法抛出异常时，会回退为逐条调用execute，以保证单文件失败不影响其他文件。
+        """
+        return [self.execute(sample) for sample in samples]
+
+    def _execute_samples(self, samples: List[Dict[str, Any]]) -> List[Any]:
+        """批量执行样本，返回与输入一一对应的执行结果，执行失败的位置为异常对象"""
+        if type(self).execute_batch is not BaseOp.execute_batch:
+            try:
+                results = self.execute_batch(samples)
+                if len(results) != len(samples):
+                    raise ValueError(
+                        f"execute_batch returns {len(results)} results for {len(samples)} samples"
+                    )
+                return results
+            except Exception as e:
+                logger.warning(
+                    f"Ops named {self.name} execute batch failed, fallback to execute one by one. "
+                    f"Error Info: {e}"
+                )
+
+        results = []
+        for sample in samples:
+            try:
+                results.append(self.execute(sample))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _prepare_batch(self, samples: List[Dict[str, Any]], **kwargs) -> List[int]:
+        """填充批次内样本参数，返回需要执行的样本下标（跳过无需执行的样本）"""
+        pending = []
+        for idx, sample in enumerate(samples):
+            if self.should_skip(sample):
+                continue
+            self.fill_sample_params(sample, **kwargs)
+            pending.append(idx)
+        return pending
+
     def fill_sample_params(self, sample: Dict[str, Any], **kwargs):
         if not sample.get(self.text_key, None):
             sample[self.text_key] = ""
@@ -163,8 +250,12 @@ class BaseOp:
         filepath = sample[self.filepath_key]
         filetype = sample[self.filetype_key]
         if filetype in ["ppt", "pptx", "docx", "doc", "xlsx", "csv", "md", "pdf"]:
-            elements = partition(filename=filepath)
-            sample[self.text_key] = "\n\n".join([str(el) for el in elements])
+            def parse_document() -> bytes:
+                elements = partition(filename=filepath)
+                return "\n\n".join([str(el) for el in elements]).encode("utf-8")
+
+            sample[self.text_key] = self.parse_with_cache(filepath, filetype, "partition",
+                                                          parse_document).decode("utf-8")
             sample[self.data_key] = b""
         elif filetype in ["txt", "md", "markdown", "xml", "html", "json", "jsonl"]:
             with open(filepath, "rb") as f:
@@ -174,14 +265,36 @@ class BaseOp:
                 )
                 sample[self.data_key] = b""
         elif filetype in ["jpg", "jpeg", "png", "bmp"]:
-            image_np = cv2.imdecode(np.fromfile(filepath, dtype=np.uint8), -1)
-            if image_np.size:
-                data = cv2.imencode(f".{filetype}", image_np)[1]
-                image_bytes = data.tobytes()
+            def decode_image() -> bytes:
+                image_np = cv2.imdecode(np.fromfile(filepath, dtype=np.uint8), -1)
+                if image_np.size:
+                    data = cv2.imencode(f".{filetype}", image_np)[1]
+                    return data.tobytes()
+                return b""
+
+            image_bytes = self.parse_with_cache(filepath, filetype, "image", decode_image)
+            if image_bytes:
                 sample[self.data_key] = image_bytes
                 sample[self.text_key] = ""
         return sample
 
+    def parse_with_cache(self, filepath: str, filetype: str, parser: str, parse_fn: Callable[[], bytes]) -> bytes:
+        """优先从解析结果缓存中读取，未命中时解析文件并写入缓存"""
+        if self.parse_cache is None:
+            return parse_fn()
+        try:
+            key = get_parse_cache_key(filepath, filetype, PARSER_VERSIONS[parser])
+        except OSError as e:
+            logger.warning(f"Hash file {filepath} failed, skip parse cache: {e}")
+            return parse_fn()
+        content = self.parse_cache.get(key)
+        if content is None:
+            content = parse_fn()
+            if content:
+                self.parse_cache.set(key, content)
+        self.parse_cache.report_metrics()
+        return content
+
     def read_file_first(self, sample):
         if self.is_first_op:
             self.read_file(sample)
@@ -220,31 +333,49 @@ class Mapper(BaseOp):
         super(Mapper, self).__init__(*args, **kwargs)
 
     def __call__(self, sample: Dict[str, Any], **kwargs):
-        # 该算子前已有算子执行该文件失败
-        if sample.get(Fields.result) is False:
+        # 该算子前已有算子执行该文件失败，或文件已从该算子之后的检查点恢复
+        if self.should_skip(sample):
             return sample
 
         self.fill_sample_params(sample, **kwargs)
-        execute_status = FAILED_STATUS
         try:
             sample = self.execute(sample)
-            execute_status = SUCCESS_STATUS
         except Exception as e:
-            # 算子执行失败，记录文件执行信息到数据库，并更该文件执行结果状态
-            self.create_failure_sample(sample, self.name, e)
-            logger.error(
-                f"Ops named {self.name} map failed, Error Info: \n"
-                f"{str(get_exception_info(e))}"
-            )
-            sample["execute_status"] = execute_status
-            sample[self.filesize_key] = "0"
-            sample[self.filetype_key] = ""
-            sample["execute_result"] = False
-            TaskInfoPersistence().update_task_result(sample)
-            # 不抛出异常，跳过当前文件继续处理下一个文件
-            return sample
+            return self._handle_failure(sample, e)
+        return self._handle_success(sample)
+
+    def call_batch(self, samples: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+        """批量处理入口，失败语义与逐条处理保持一致"""
+        pending = self._prepare_batch(samples, **kwargs)
+        if not pending:
+            return samples
+
+        results = self._execute_samples([samples[idx] for idx in pending])
+        for idx, result in zip(pending, results):
+            if isinstance(result, Exception):
+                samples[idx] = self._handle_failure(samples[idx], result)
+            else:
+                samples[idx] = self._handle_success(result)
+        return samples
+
+    def _handle_failure(self, sample: Dict[str, Any], e: Exception) -> Dict[str, Any]:
+        # 算子执行失败，记录文件执行信息到数据库，并更该文件执行结果状态
+        self.create_failure_sample(sample, self.name, e)
+        logger.error(
+            f"Ops named {self.name} map failed, Error Info: \n"
+            f"{str(get_exception_info(e))}"
+        )
+        sample["execute_status"] = FAILED_STATUS
+        sample[self.filesize_key] = "0"
+        sample[self.filetype_key] = ""
+        sample["execute_result"] = False
+        TaskInfoPersistence().update_task_result(sample)
+        # 不抛出异常，跳过当前文件继续处理下一个文件
+        return sample
 
-        sample["execute_status"] = execute_status
+    def _handle_success(self, sample: Dict[str, Any]) -> Dict[str, Any]:
+        sample["execute_status"] = SUCCESS_STATUS
+        self.save_checkpoint(sample)
         # 加载文件成功执行信息到数据库
         if self.is_last_op:
             # 文件无内容会被过滤
@@ -269,10 +400,22 @@ class Slicer(BaseOp):
     def __init__(self, *args, **kwargs):
         super(Slicer, self).__init__(*args, **kwargs)
         self.target_file_type = None
+        # 开启后同一源文件的切片打包写入tar分片，而不是每个切片保存为单独的文件，
+        # 可通过算子参数shardOutput或环境变量SLICER_SHARD_OUTPUT开启
+        shard_output = kwargs.get("shardOutput", None)
+        if shard_output is None:
+            shard_output = os.getenv("SLICER_SHARD_OUTPUT", "false")
+        if isinstance(shard_output, str):
+            shard_output = shard_output.lower() == "true"
+        self.shard_output = shard_output
+        self.shard_max_count = int(os.getenv("SLICER_SHARD_MAX_COUNT", "10000"))
+        self.shard_max_bytes = int(float(os.getenv("SLICER_SHARD_MAX_SIZE", "1024")) * 1024 * 1024)
+        self._shard_writers: Dict[str, PatchShardWriter] = {}
+        self._shard_writers_lock = threading.Lock()
 
     def __call__(self, sample: Dict[str, Any], **kwargs):
-        # 该算子前已有算子执行该文件失败
-        if sample.get(Fields.result) is False:
+        # 该算子前已有算子执行该文件失败，或文件已从该算子之后的检查点恢复
+        if self.should_skip(sample):
             return sample
 
         self.fill_sample_params(sample, **kwargs)
@@ -282,6 +425,7 @@ class Slicer(BaseOp):
             sample_list = self.execute(sample)
             execute_status = SUCCESS_STATUS
         except Exception as e:
+            self.close_patch_shards(sample)
             # 算子执行失败，记录文件执行信息到数据库，并更该文件执行结果状态
             self.create_failure_sample(sample, self.name, e)
             self.load_sample_to_sample(sample, sample_list)
@@ -295,6 +439,7 @@ class Slicer(BaseOp):
             TaskInfoPersistence().update_task_result(sample)
             return [sample]
 
+        self.close_patch_shards(sample)
         self.load_sample_to_sample(sample, sample_list)
         sample["execute_status"] = execute_status
 
@@ -304,6 +449,15 @@ class Slicer(BaseOp):
 
         return [sample]
 
+    def call_batch(self, samples: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+        """批量处理入口，切片算子逐条执行后合并结果"""
+        results = []
+        for sample in samples:
+            # 跳过的样本直接返回样本本身，执行后的样本以列表返回
+            result = self(sample, **kwargs)
+            results.extend(result if isinstance(result, list) else [result])
+        return results
+
     @staticmethod
     def load_sample_to_sample(sample: Dict, sample_list: List[Dict]):
         """使用sample中的k-v更新sample"""
@@ -319,6 +473,16 @@ class Slicer(BaseOp):
             "This is in Mapper Class, plese re-define this method in Sub-classes"
         )
 
+    def make_patch_sample(self, sample: Dict[str, Any], data: bytes = b"", text: str = "") -> Dict[str, Any]:
+        """构建切片保存所需的轻量样本，仅包含保存路径相关字段，避免深拷贝原样本"""
+        return {
+            self.text_key: text,
+            self.data_key: data,
+            self.export_path_key: sample[self.export_path_key],
+            self.filename_key: sample[self.filename_key],
+            self.fileid_key: sample[self.fileid_key],
+        }
+
     def save_patch_sample(self, sample: Dict[str, Any], patch_no, save_format="text"):
         if save_format == "text":
             target_file_type = "txt"
@@ -330,9 +494,32 @@ class Slicer(BaseOp):
 
         if self.target_file_type:
             target_file_type = self.target_file_type
+        if self.shard_output:
+            file_id = str(sample[self.fileid_key])
+            self.get_shard_writer(sample).write(f"{file_id}_{patch_no}.{target_file_type}", self.get_file_bytes(sample))
+            return
         save_path = self.get_save_path(sample, patch_no, target_file_type)
         self.save_file(sample, save_path)
 
+    def get_shard_writer(self, sample: Dict[str, Any]) -> PatchShardWriter:
+        """获取源文件对应的分片写入器，同一源文件的切片可在多个线程中并发写入"""
+        file_id = str(sample[self.fileid_key])
+        with self._shard_writers_lock:
+            writer = self._shard_writers.get(file_id)
+            if writer is None:
+                writer = PatchShardWriter(os.path.abspath(sample[self.export_path_key]), file_id,
+                                          self.shard_max_count, self.shard_max_bytes)
+                self._shard_writers[file_id] = writer
+            return writer
+
+    def close_patch_shards(self, sample: Dict[str, Any]):
+        """源文件切片完成后关闭其分片写入器，写出分片索引"""
+        with self._shard_writers_lock:
+            writer = self._shard_writers.pop(str(sample.get(self.fileid_key)), None)
+        if writer is not None:
+            shard_paths = writer.close()
+            logger.info(f"fileName: {sample.get(self.filename_key)}, patches saved into {len(shard_paths)} shards.")
+
     def get_save_path(self, sample: Dict[str, Any], patch_no, target_type) -> str:
         export_path = os.path.abspath(sample[self.export_path_key])
         logger.info(f"export path: {export_path}.")
@@ -347,13 +534,16 @@ class Slicer(BaseOp):
         res = os.path.join(export_path, new_file_name)
         return res
 
-    def save_file(self, sample, save_path):
-        # 以二进制格式保存文件
-        file_sample = (
+    def get_file_bytes(self, sample) -> bytes:
+        return (
             sample[self.text_key].encode("utf-8")
             if sample[self.text_key]
             else sample[self.data_key]
         )
+
+    def save_file(self, sample, save_path):
+        # 以二进制格式保存文件
+        file_sample = self.get_file_bytes(sample)
         with open(save_path, "wb") as f:
             f.write(file_sample)
 
@@ -372,20 +562,41 @@ class Filter(BaseOp):
         super(Filter, self).__init__(*args, **kwargs)
 
     def __call__(self, sample: Dict[str, Any], **kwargs):
-        # 该算子前已有算子执行该文件失败
-        if sample.get(Fields.result) is False:
+        # 该算子前已有算子执行该文件失败，或文件已从该算子之后的检查点恢复
+        if self.should_skip(sample):
             return sample
 
         self.fill_sample_params(sample, **kwargs)
-        execute_status = FAILED_STATUS
         try:
             sample = self.execute(sample)
-            execute_status = SUCCESS_STATUS
         except Exception as e:
             # 如果filter算子过滤失败, 不保留文件， 并记录文件执行信息到数据库
             self.create_failure_sample(sample, self.name, e)
             return False
-        sample["execute_status"] = execute_status
+        return self._handle_success(sample)
+
+    def call_batch(self, samples: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+        """批量处理入口，返回保留下来的样本"""
+        pending = self._prepare_batch(samples, **kwargs)
+        if not pending:
+            return samples
+
+        results = dict(zip(pending, self._execute_samples([samples[idx] for idx in pending])))
+        kept = []
+        for idx, sample in enumerate(samples):
+            if idx not in results:
+                kept.append(sample)
+                continue
+            result = results[idx]
+            if isinstance(result, Exception):
+                # 如果filter算子过滤失败, 不保留文件
+                self.create_failure_sample(sample, self.name, result)
+            elif self._handle_success(result):
+                kept.append(result)
+        return kept
+
+    def _handle_success(self, sample: Dict[str, Any]) -> bool:
+        sample["execute_status"] = SUCCESS_STATUS
 
         # 文件无内容会被过滤
         if sample[self.text_key] == "" and sample[self.data_key] == b"":
@@ -408,6 +619,8 @@ class Filter(BaseOp):
 
 
 class LLM(Mapper):
+    checkpoint_output = True
+
     def __init__(self, *args, **kwargs):
         super(LLM, self).__init__(*args, **kwargs)
         self.llm = self.get_llm(*args, **kwargs)
@@ -415,6 +628,24 @@ class LLM(Mapper):
 
         self.target_file_type = None
 
+    def __call__(self, sample: Dict[str, Any], **kwargs):
+        try:
+            return super(LLM, self).__call__(sample, **kwargs)
+        finally:
+            self.report_cache_metrics()
+
+    def call_batch(self, samples: List[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+        try:
+            return super(LLM, self).call_batch(samples, **kwargs)
+        finally:
+            self.report_cache_metrics()
+
+    def report_cache_metrics(self):
+        """样本（批次）处理完成后上报响应缓存计数，actor被销毁时不会丢失"""
+        cache = getattr(self.llm, "cache", None)
+        if cache is not None:
+            cache.report_metrics()
+
     def execute(self, sample: Dict[str, Any]) -> Dict[str, Any]:
         """执行函数（子类实现）"""
         raise NotImplementedError(
@@ -430,6 +661,8 @@ class LLM(Mapper):
         is_https = kwargs.get("isHttps", False)
         is_certificate = kwargs.get("isCertificate", False)
         certificate_path = kwargs.get("certificatePath", None)
+        # 响应缓存默认关闭，可通过算子参数llmCache或环境变量LLM_CACHE_ENABLED开启
+        cache = LlmResponseCache.enable(kwargs.get("llmCache", None))
         return LlmReq(
             url=url,
             header=header,
@@ -438,6 +671,7 @@ class LLM(Mapper):
             is_https=is_https,
             is_certificate=is_certificate,
             certificate_path=certificate_path,
+            cache=cache,
         )
 
     def build_llm_prompt(self, *args, **kwargs):
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import uuid
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from datamate.core.constant import Fields
+
+CHECKPOINT_ROOT = "/flow"
+
+
+def get_chain_hash(cfg_process: List[Dict]) -> str:
+    """算子链哈希：算子及其参数发生变化时，已有检查点不再复用"""
+    content = json.dumps(cfg_process, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+class FileCheckpointer:
+    """
+    按文件记录清洗进度的检查点
+
+    目录结构: {root}/{instance_id}/checkpoint/{chain_hash}/
+        completed/{pid}-{uuid}.jsonl   已完成整个算子链的源文件ID，每个进程追加写入各自的文件
+        stage_{op_index}/{file_id}.pkl 开启检查点的算子执行成功后的中间结果
+    """
+
+    def __init__(self, instance_id: str, chain_hash: str, root: str = CHECKPOINT_ROOT):
+        self.instance_id = instance_id
+        self.chain_hash = chain_hash
+        self.checkpoint_dir = os.path.join(root, str(instance_id), "checkpoint", chain_hash)
+        self._completed = None
+        self._completed_file = None
+
+    def __getstate__(self):
+        # 已完成文件集合及文件句柄不随对象序列化，在各进程内按需加载
+        state = self.__dict__.copy()
+        state["_completed"] = None
+        state["_completed_file"] = None
+        return state
+
+    @staticmethod
+    def get_file_id(sample: Dict[str, Any]) -> str:
+        return str(sample.get("sourceFileId") or sample.get("fileId"))
+
+    @property
+    def completed_dir(self):
+        return os.path.join(self.checkpoint_dir, "completed")
+
+    def stage_dir(self, op_index: int):
+        return os.path.join(self.checkpoint_dir, f"stage_{op_index}")
+
+    def load_completed(self) -> set:
+        if self._completed is not None:
+            return self._completed
+        completed = set()
+        if os.path.isdir(self.completed_dir):
+            for name in os.listdir(self.completed_dir):
+                with open(os.path.join(self.completed_dir, name), "r", encoding="utf-8") as f:
+                    completed.update(line.strip() for line in f if line.strip())
+        self._completed = completed
+        return completed
+
+    def is_pending(self, sample: Dict[str, Any]) -> bool:
+        """文件是否还未完成整个算子链"""
+        return self.get_file_id(sample) not in self.load_completed()
+
+    def mark_completed(self, sample: Dict[str, Any]) -> Dict[str, Any]:
+        """记录执行成功、走完整个算子链的文件"""
+        if sample.get(Fields.result) is False:
+            return sample
+        if self._completed_file is None:
+            os.makedirs(self.completed_dir, exist_ok=True)
+            file_name = f"{os.getpid()}-{uuid.uuid4().hex}.jsonl"
+            self._completed_file = open(os.path.join(self.completed_dir, file_name), "a", encoding="utf-8")
+        self._completed_file.write(self.get_file_id(sample) + "\n")
+        self._completed_file.flush()
+        return sample
+
+    def close(self):
+        if self._completed_file is not None:
+            self._completed_file.close()
+            self._completed_file = None
+
+    def cleanup(self):
+        """任务执行完成后删除该任务的全部检查点"""
+        checkpoint_root = os.path.dirname(self.checkpoint_dir)
+        shutil.rmtree(checkpoint_root, ignore_errors=True)
+        logger.info(f"Checkpoints under {checkpoint_root} are removed.")
+
+    def save_stage(self, sample: Dict[str, Any], op_index: int):
+        """保存算子执行后的中间结果，先写临时文件再重命名，避免进程中断留下不完整的检查点"""
+        stage_dir = self.stage_dir(op_index)
+        os.makedirs(stage_dir, exist_ok=True)
+        save_path = os.path.join(stage_dir, f"{self.get_file_id(sample)}.pkl")
+        tmp_path = f"{save_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(dict(sample), f)
+        os.replace(tmp_path, save_path)
+
+    def restore(self, sample: Dict[str, Any], stage_indexes: List[int]) -> Dict[str, Any]:
+        """使用最靠后的中间结果恢复样本，并标记从该算子之后继续执行"""
+        file_id = self.get_file_id(sample)
+        for op_index in sorted(stage_indexes, reverse=True):
+            stage_path = os.path.join(self.stage_dir(op_index), f"{file_id}.pkl")
+            if not os.path.exists(stage_path):
+                continue
+            try:
+                with open(stage_path, "rb") as f:
+                    restored = pickle.load(f)
+            except Exception as e:
+                logger.warning(f"Load checkpoint {stage_path} failed, skip it: {e}")
+                continue
+            sample.update(restored)
+            sample[Fields.resume_index] = op_index
+            logger.info(f"fileId: {file_id} resumes from checkpoint after op index {op_index}.")
+            break
+        return sample
+
+
+class CheckpointFilter:
+    """过滤已完成整个算子链的文件，以actor运行使已完成文件集合在每个actor中仅加载一次"""
+
+    def __init__(self, checkpointer: FileCheckpointer):
+        self.checkpointer = checkpointer
+        self.checkpointer.load_completed()
+
+    def __call__(self, sample: Dict[str, Any]) -> bool:
+        return self.checkpointer.is_pending(sample)
+
+
+class CheckpointMarker:
+    """
+    记录已完成整个算子链的文件，以actor运行，每个actor只打开一个记录文件，actor销毁时关闭
+    """
+
+    def __init__(self, checkpointer: FileCheckpointer):
+        self.checkpointer = checkpointer
+
+    def __call__(self, sample: Dict[str, Any]) -> Dict[str, Any]:
+        return self.checkpointer.mark_completed(sample)
+
+    def __del__(self):
+        self.checkpointer.close()
+
+
+def create_checkpointer(instance_id: Optional[str], cfg_process: List[Dict]) -> Optional[FileCheckpointer]:
+    """创建任务检查点，检查点默认关闭，可通过环境变量ENABLE_CHECKPOINT=true开启"""
+    if not instance_id or os.getenv("ENABLE_CHECKPOINT", "false").lower() != "true":
+        return None
+    root = os.getenv("CHECKPOINT_ROOT", CHECKPOINT_ROOT)
+    if not os.path.isdir(os.path.join(root, str(instance_id))):
+        return None
+    return FileCheckpointer(instance_id, get_chain_hash(cfg_process), root)
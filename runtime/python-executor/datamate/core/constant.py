@@ -4,5 +4,6 @@ class Fields(object):
     result = 'execute_result'
     instance_id = 'instance_id'
     export_path = 'export_path'
-
-
+    resume_index = 'resume_index'
+    lexicon_scan = 'lexicon_scan'
+    pii_scan = 'pii_scan'
@@ -14,8 +14,10 @@ from loguru import logger
 from ray import data as rd
 
 from datamate.core.base_op import Filter, Mapper, Slicer
+from datamate.core.checkpoint import CheckpointFilter, CheckpointMarker
 from datamate.core.constant import Fields
 from datamate.core.base_op import OPERATORS, BaseOp
+from datamate.sql_manager.persistence_atction import is_result_buffer_enabled, result_buffer
 
 from core.base_op import Filter as RELATIVE_Filter, Mapper as RELATIVE_Mapper, Slicer as RELATIVE_Slicer
 
@@ -83,6 +85,121 @@ def preprocess_dataset(dataset: rd.Dataset, cfg) -> rd.Dataset:
     return dataset
 
 
+def _to_arrow_array(values: list, field_type: pa.DataType = None) -> pa.Array:
+    """
+    将一列取值转换为arrow数组：优先使用输入表中该列的类型，取值类型不一致时逐个转换为该类型
+    （例如失败样本的fileSize为字符串"0"，而清单中为整数），仍无法转换时按全部取值推断类型，
+    最后退化为字符串
+    """
+    if field_type is not None:
+        try:
+            return pa.array(values, type=field_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        try:
+            return pa.array([None if value is None else pa.scalar(value).cast(field_type).as_py()
+                             for value in values], type=field_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+def samples_to_table(samples: list, schema: pa.Schema) -> pa.Table:
+    """
+    按统一的schema构建输出表：列为输入表的列加上各样本新增的键（而不是仅取第一条样本的键），
+    各列类型与输入表保持一致
+    """
+    names = list(schema.names)
+    known = set(names)
+    for sample in samples:
+        for key in sample:
+            if key not in known:
+                known.add(key)
+                names.append(key)
+    arrays = [_to_arrow_array([sample.get(name) for sample in samples],
+                              schema.field(name).type if name in schema.names else None)
+              for name in names]
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+class BatchOpRunner:
+    """
+    批处理方式驱动算子，每个批次依次调用各算子的call_batch
+
+    传入多个算子时即为融合执行：样本在同一个actor内顺序经过各算子，不再在算子间跨actor传输。
+    """
+
+    def __init__(self, operators_cls_list, init_kwargs_list):
+        self.ops = [operators_cls(**init_kwargs)
+                    for operators_cls, init_kwargs in zip(operators_cls_list, init_kwargs_list)]
+
+    def __call__(self, table: pa.Table, **kwargs) -> pa.Table:
+        samples = table.to_pylist()
+        # 批次内各算子的执行结果记录缓冲后批量写入，在批次返回前完成写入
+        with result_buffer():
+            for op in self.ops:
+                if not samples:
+                    break
+                samples = op.call_batch(samples, **kwargs)
+        if not samples:
+            return table.slice(0, 0)
+        return samples_to_table(samples, table.schema)
+
+
+def get_op_resources(init_kwargs):
+    """
+    获取算子运行所需资源
+    :return: (自定义资源, cpu, memory)
+    """
+    resources = {}
+
+    if init_kwargs.get("npu", 0) > 0:
+        resources["npu"] = init_kwargs.get("npu")
+
+    if init_kwargs.get("arch", "arm").startswith("x86"):
+        resources["arch"] = "x86"
+
+    cpu = init_kwargs.get("cpu", 0.05)
+    memory = init_kwargs.get("memory", None)
+    return resources, cpu, memory
+
+
+def is_fusible_op(operators_cls, init_kwargs):
+    """仅CPU上运行的Mapper和Filter算子可以融合，算子可通过fusible: false关闭融合"""
+    if not init_kwargs.get("fusible", True):
+        return False
+    if init_kwargs.get("npu", 0) > 0 or init_kwargs.get("gpu", 0) > 0:
+        return False
+    return issubclass(operators_cls, (Mapper, Filter, RELATIVE_Mapper, RELATIVE_Filter))
+
+
+def plan_fused_ops(operators_cls_list, init_kwargs_list):
+    """
+    算子融合规划：将连续的、资源需求一致的可融合算子划分为同一组
+
+    :return: 算子下标分组列表，例如 [[0, 1, 2], [3], [4, 5]]
+    """
+    groups = []
+    last_key = None
+    for index, (operators_cls, init_kwargs) in enumerate(zip(operators_cls_list, init_kwargs_list)):
+        if not is_fusible_op(operators_cls, init_kwargs):
+            groups.append([index])
+            last_key = None
+            continue
+
+        resources, cpu, memory = get_op_resources(init_kwargs)
+        key = (tuple(sorted(resources.items())), cpu, memory)
+        if groups and key == last_key:
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+        last_key = key
+    return groups
+
+
 class RayDataset(BasicDataset):
 
     def __init__(self,
@@ -117,12 +234,57 @@ class RayDataset(BasicDataset):
             if index == len(cfg_process) - 1:
                 init_kwargs["is_last_op"] = True
             init_kwargs["instance_id"] = kwargs.get("instance_id", str(uuid.uuid4()))
+            init_kwargs["op_index"] = index
             init_kwargs_list.append(init_kwargs)
 
-        for cls_id, operators_cls in enumerate(operators_cls_list):
-            self._run_single_op(operators_cls, init_kwargs_list[cls_id], **kwargs)
+        if checkpointer is not None:
+            self._restore_checkpoint(checkpointer, operators_cls_list, init_kwargs_list)
+
+        # 算子融合默认关闭，可通过环境变量ENABLE_OP_FUSION=true开启
+        if os.getenv("ENABLE_OP_FUSION", "false").lower() == "true":
+            groups = plan_fused_ops(operators_cls_list, init_kwargs_list)
+        else:
+            groups = [[index] for index in range(len(operators_cls_list))]
+
+        for group in groups:
+            if len(group) == 1:
+                self._run_single_op(operators_cls_list[group[0]], init_kwargs_list[group[0]], **kwargs)
+            else:
+                self._run_fused_ops([operators_cls_list[index] for index in group],
+                                    [init_kwargs_list[index] for index in group], **kwargs)
+
+        if checkpointer is not None:
+            self.data = self.data.map(CheckpointMarker,
+                                      fn_constructor_args=(checkpointer,),
+                                      num_cpus=0.05,
+                                      compute=rd.ActorPoolStrategy(min_size=1,
+                                                                   max_size=int(os.getenv("MAX_ACTOR_NUMS", "20"))))
         return self
 
+    def _restore_checkpoint(self, checkpointer, operators_cls_list, init_kwargs_list):
+        """
+        跳过已完成整个算子链的文件，并使用开启检查点的算子保存的中间结果恢复文件
+        """
+        max_actor_nums = os.getenv("MAX_ACTOR_NUMS", "20")
+        self.data = self.data.filter(CheckpointFilter,
+                                     fn_constructor_args=(checkpointer,),
+                                     num_cpus=0.05,
+                                     compute=rd.ActorPoolStrategy(min_size=1, max_size=int(max_actor_nums)))
+
+        stage_indexes = []
+        for index, (operators_cls, init_kwargs) in enumerate(zip(operators_cls_list, init_kwargs_list)):
+            if init_kwargs.get("is_last_op"):
+                continue
+            if init_kwargs.get("checkpoint_output", getattr(operators_cls, "checkpoint_output", False)):
+                init_kwargs["checkpointer"] = checkpointer
+                stage_indexes.append(index)
+
+        if stage_indexes:
+            logger.info(f"Ops with index {stage_indexes} will save checkpoints to {checkpointer.checkpoint_dir}.")
+            self.data = self.data.map(checkpointer.restore,
+                                      fn_kwargs={"stage_indexes": stage_indexes},
+                                      num_cpus=0.05)
+
     def load_ops_module(self, op_name):
         '''
         加载算子模块
@@ -151,23 +313,57 @@ class RayDataset(BasicDataset):
             res = None
         return res
 
-    def _run_single_op(self, operators_cls, init_kwargs, **kwargs):
+    def _run_fused_ops(self, operators_cls_list, init_kwargs_list, **kwargs):
         max_actor_nums = os.getenv("MAX_ACTOR_NUMS", "20")
 
-        resources = {}
+        # 融合组内算子资源需求一致，取第一个算子的配置即可
+        resources, cpu, memory = get_op_resources(init_kwargs_list[0])
+        batch_size = min(int(init_kwargs.get("batch_size", os.getenv("OP_BATCH_SIZE", "32")))
+                         for init_kwargs in init_kwargs_list)
+        logger.info(f"Fuse ops {[init_kwargs.get('op_name') for init_kwargs in init_kwargs_list]} "
+                    f"into one stage.")
 
-        if init_kwargs.get("npu", 0) > 0:
-            resources["npu"] = init_kwargs.get("npu")
+        kwargs.update({"ext_params": {}, "failed_reason": {}, "target_type": None})
+        try:
+            self.data = self.data.map_batches(BatchOpRunner,
+                                              fn_constructor_args=(operators_cls_list, init_kwargs_list),
+                                              fn_kwargs=kwargs,
+                                              batch_size=batch_size,
+                                              batch_format="pyarrow",
+                                              resources=resources,
+                                              num_cpus=cpu,
+                                              memory=memory,
+                                              compute=rd.ActorPoolStrategy(min_size=1,
+                                                                           max_size=int(max_actor_nums)))
+        except Exception as e:
+            logger.error(e)
+            raise Exception("Error! Ops Details:") from e
 
-        if init_kwargs.get("arch", "arm").startswith("x86"):
-            resources["arch"] = "x86"
+    def _run_single_op(self, operators_cls, init_kwargs, **kwargs):
+        max_actor_nums = os.getenv("MAX_ACTOR_NUMS", "20")
 
-        cpu = init_kwargs.get("cpu", 0.05)
-        memory = init_kwargs.get("memory", None)
+        resources, cpu, memory = get_op_resources(init_kwargs)
 
         kwargs.update({"ext_params": {}, "failed_reason": {}, "target_type": None})
         try:
-            if issubclass(operators_cls, (Mapper, RELATIVE_Mapper)):
+            # 开启结果写缓冲时Mapper、Filter算子也以批处理方式调度，批次内的执行结果记录批量写入数据库
+            use_batch = init_kwargs.get("use_batch", getattr(operators_cls, "use_batch", False) or (
+                is_result_buffer_enabled()
+                and issubclass(operators_cls, (Mapper, Filter, RELATIVE_Mapper, RELATIVE_Filter))))
+            if use_batch:
+                batch_size = int(init_kwargs.get("batch_size", os.getenv("OP_BATCH_SIZE", "32")))
+                self.data = self.data.map_batches(BatchOpRunner,
+                                                  fn_constructor_args=([operators_cls], [init_kwargs]),
+                                                  fn_kwargs=kwargs,
+                                                  batch_size=batch_size,
+                                                  batch_format="pyarrow",
+                                                  resources=resources,
+                                                  num_cpus=cpu,
+                                                  memory=memory,
+                                                  compute=rd.ActorPoolStrategy(min_size=1,
+                                                                               max_size=int(max_actor_nums)))
+
+            elif issubclass(operators_cls, (Mapper, RELATIVE_Mapper)):
                 self.data = self.data.map(operators_cls,
                                           fn_constructor_kwargs=init_kwargs,
                                           fn_kwargs=kwargs,
@@ -2,23 +2,135 @@
 
 import json
 import os
+import threading
 import time
 import uuid
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from threading import Lock
+from typing import Dict, Any, Optional
 
 from loguru import logger
 from sqlalchemy import text
 
+from datamate.common.utils.task_metrics import report_task_metrics
 from datamate.sql_manager.sql_manager import SQLManager
 
 
+class ResultBuffer:
+    """
+    结果写缓冲：在批处理范围内按SQL语句缓存待插入的记录，范围结束时批量写入数据库。
+    批处理范围由result_buffer()开启，批次结果返回给Ray之前即完成写入，不依赖actor退出时的刷写，
+    dataset物化完成时所有记录均已入库。范围外的写入直接写入数据库。
+    每次刷写的计数增量异步上报至任务级汇总对象，任务结束时由driver输出。
+    """
+    _local = threading.local()
+    _metrics_lock = Lock()
+    _metrics = {
+        "buffered_rows": 0,
+        "flushed_rows": 0,
+        "failed_rows": 0,
+        "flush_count": 0,
+        "flush_seconds": 0.0,
+    }
+
+    def __init__(self, flush_size: int):
+        self.flush_size = flush_size
+        self._rows = defaultdict(list)
+        self._row_count = 0
+
+    @classmethod
+    def get_instance(cls) -> Optional["ResultBuffer"]:
+        """当前线程所在批处理范围的缓冲，不在批处理范围内时返回None"""
+        return getattr(cls._local, "buffer", None)
+
+    @classmethod
+    def metrics(cls) -> Dict[str, Any]:
+        with cls._metrics_lock:
+            return dict(cls._metrics)
+
+    def add(self, data: Dict[str, Any], sql: str):
+        self._rows[sql].append(data)
+        self._row_count += 1
+        if self._row_count >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        pending, self._rows = self._rows, defaultdict(list)
+        buffered, self._row_count = self._row_count, 0
+        if not pending:
+            return
+
+        start = time.time()
+        flushed, failed = 0, 0
+        for sql, rows in pending.items():
+            success = self._write_rows(sql, rows)
+            flushed += success
+            failed += len(rows) - success
+
+        delta = {
+            "buffered_rows": buffered,
+            "flushed_rows": flushed,
+            "failed_rows": failed,
+            "flush_count": 1,
+            "flush_seconds": time.time() - start,
+        }
+        with self._metrics_lock:
+            for key, value in delta.items():
+                self._metrics[key] += value
+        report_task_metrics("result_buffer", delta)
+
+    @staticmethod
+    def _write_rows(sql: str, rows) -> int:
+        """批量写入，失败时逐条写入，返回写入成功的记录数"""
+        try:
+            TaskInfoPersistence.batch_execute(sql, rows)
+            return len(rows)
+        except Exception as e:
+            logger.warning(f"Result buffer batch write {len(rows)} rows failed, retry one by one: {e}")
+
+        success = 0
+        for row in rows:
+            try:
+                TaskInfoPersistence.insert_result(row, sql)
+                success += 1
+            except Exception as e:
+                logger.error(f"Result buffer write row failed: {e}")
+        return success
+
+
+def is_result_buffer_enabled() -> bool:
+    """结果写缓冲默认开启，可通过环境变量RESULT_BUFFER_ENABLED=false关闭"""
+    return os.getenv("RESULT_BUFFER_ENABLED", "true").lower() == "true"
+
+
+@contextmanager
+def result_buffer():
+    """
+    开启批处理范围的结果写缓冲，范围结束时写入缓冲的记录，可通过环境变量RESULT_BUFFER_ENABLED=false关闭。
+    嵌套调用时复用外层的缓冲。
+    """
+    if ResultBuffer.get_instance() is not None or not is_result_buffer_enabled():
+        yield
+        return
+    buffer = ResultBuffer(int(os.getenv("RESULT_BUFFER_FLUSH_SIZE", "200")))
+    ResultBuffer._local.buffer = buffer
+    try:
+        yield
+    finally:
+        ResultBuffer._local.buffer = None
+        buffer.flush()
+
+
 class TaskInfoPersistence:
     def __init__(self):
         self.sql_dict = self.load_sql_dict()
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def load_sql_dict():
         """获取sql语句"""
         sql_config_path = str(Path(__file__).parent / 'sql' / 'sql_config.json')
@@ -53,7 +165,7 @@ class TaskInfoPersistence:
             "status": status,
             "result": failed_reason
         }
-        self.insert_result(result_data, str(self.sql_dict.get("insert_clean_result_sql")))
+        self.write_result(result_data, str(self.sql_dict.get("insert_clean_result_sql")))
 
     def update_file_result(self, sample, file_id):
         file_size = str(sample.get("fileSize"))
@@ -76,7 +188,7 @@ class TaskInfoPersistence:
             "created_at": create_time,
             "updated_at": create_time
         }
-        self.insert_result(file_data, str(self.sql_dict.get("insert_dataset_file_sql")))
+        self.write_result(file_data, str(self.sql_dict.get("insert_dataset_file_sql")))
 
     def query_existing_files(self, dataset_id: str):
         result = None
@@ -95,6 +207,15 @@ class TaskInfoPersistence:
         self.update_task_result(sample, file_id)
         self.update_file_result(sample, file_id)
 
+    @staticmethod
+    def write_result(data, sql):
+        """当前进程开启结果写缓冲时写入缓冲，否则直接写入数据库"""
+        buffer = ResultBuffer.get_instance()
+        if buffer is not None:
+            buffer.add(data, sql)
+        else:
+            TaskInfoPersistence.insert_result(data, sql)
+
     @staticmethod
     def insert_result(data, sql):
         retries = 0
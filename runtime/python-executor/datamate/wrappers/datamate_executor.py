@@ -2,6 +2,7 @@
 
 import base64
 import json
+import signal
 import time
 
 import ray
@@ -9,6 +10,9 @@ import yaml
 from jsonargparse import ArgumentParser
 from loguru import logger
 
+from datamate.common.utils.task_metrics import get_task_metrics
+from datamate.common.utils.shared_actor import reap_stale_shared_actors, release_shared_actors
+from datamate.core.checkpoint import create_checkpointer
 from datamate.core.dataset import RayDataset
 from datamate.wrappers.executor import RayExecutor
 
@@ -25,7 +29,17 @@ class DataMateExecutor(RayExecutor):
     def __init__(self, cfg = None, meta = None):
         super().__init__(cfg, meta)
 
+    @staticmethod
+    def _exit_on_sigterm(signum, frame):
+        """任务取消或超时时调度器发送SIGTERM，转换为SystemExit，使finally中的共享actor释放得以执行"""
+        logger.warning(f"Received signal {signum}, exit and release shared actors.")
+        raise SystemExit(128 + signum)
+
     def run(self):
+        # 回收此前被强制结束的任务遗留的共享actor
+        reap_stale_shared_actors()
+        signal.signal(signal.SIGTERM, self._exit_on_sigterm)
+
         # 1. 加载数据集
         logger.info('Loading dataset with Ray...')
 
@@ -36,18 +50,30 @@ class DataMateExecutor(RayExecutor):
         else:
             dataset = self.load_dataset()
         dataset = RayDataset(dataset, self.cfg)
+        checkpointer = create_checkpointer(getattr(self.cfg, 'instance_id', None), self.cfg.process)
 
         # 3. 处理数据
         logger.info('Processing data...')
         tstart = time.time()
-        dataset.process(self.cfg.process, **getattr(self.cfg, 'kwargs', {}))
-        tend = time.time()
-        logger.info(f'All Ops are done in {tend - tstart:.3f}s.')
-
-        dataset.data.materialize()
+        try:
+            dataset.process(self.cfg.process, checkpointer=checkpointer, **getattr(self.cfg, 'kwargs', {}))
+            tend = time.time()
+            logger.info(f'All Ops are done in {tend - tstart:.3f}s.')
+
+            dataset.data.materialize()
+            task_metrics = get_task_metrics()
+            if task_metrics:
+                logger.info(f'Task metrics: {task_metrics}')
+        finally:
+            # 共享actor以detached方式创建，不随算子actor退出，任务结束时统一关闭并释放
+            release_shared_actors()
 
         self.scan_files()
 
+        # 任务执行完成，检查点不再需要
+        if checkpointer is not None:
+            checkpointer.cleanup()
+
 if __name__ == '__main__':
 
     parser = ArgumentParser(description="Create API for Submitting Job to ray")
@@ -14,6 +14,10 @@ from datamate.common.utils import check_valid_path
 from datamate.sql_manager.persistence_atction import TaskInfoPersistence
 
 
+def load_meta_row(row, load_func, dataset_id):
+    return load_func(row["text"], dataset_id)
+
+
 class RayExecutor:
     """
     基于Ray的执行器.
@@ -36,7 +40,8 @@ class RayExecutor:
         logger.info('Initing Ray ...')
         ray.init()
 
-    def load_meta(self, line):
+    @staticmethod
+    def load_meta(line, dataset_id):
         meta = json.loads(line)
         if meta.get("fileId"):
             meta["sourceFileId"] = meta.get("fileId")
@@ -54,10 +59,11 @@ class RayExecutor:
             meta["extraFilePath"] = None
         if not meta.get("extraFileType"):
             meta["extraFileType"] = None
-        meta["dataset_id"] = self.cfg.dataset_id
+        meta["dataset_id"] = dataset_id
         return meta
 
-    def load_dj_meta(self, line):
+    @staticmethod
+    def load_dj_meta(line, dataset_id):
         meta = json.loads(line)
         filepath = ""
         file = ""
@@ -79,48 +85,40 @@ class RayExecutor:
         if filepath and file:
             filename = f"{Path(meta['fileName']).stem}{file.suffix}"
             meta["fileName"] = filename
-            meta["filePath"] = f"/dataset/{self.cfg.dataset_id}/{filename}"
+            meta["filePath"] = f"/dataset/{dataset_id}/{filename}"
             meta["fileType"] = file.suffix[1:]
             meta["fileSize"] = file.stat().st_size
-            os.makedirs(f"/dataset/{self.cfg.dataset_id}", exist_ok=True)
-            shutil.move(filepath, f"/dataset/{self.cfg.dataset_id}/{filename}")
+            os.makedirs(f"/dataset/{dataset_id}", exist_ok=True)
+            shutil.move(filepath, f"/dataset/{dataset_id}/{filename}")
         return {k: v for k, v in meta.items() if not (isinstance(k, str) and k.startswith('_'))}
 
     def run(self):
         pass
 
     def load_dataset(self, jsonl_file_path = None):
-        retry = 0
-        dataset = None
-        if jsonl_file_path is None:
-            jsonl_file_path = self.cfg.dataset_path
-        while True:
-            if check_valid_path(jsonl_file_path):
-                with open(jsonl_file_path, "r", encoding='utf-8') as meta:
-                    lines = meta.readlines()
-                    dataset = ray.data.from_items([self.load_meta(line) for line in lines])
-                    break
-            if retry < 5:
-                retry += 1
-                time.sleep(retry)
-                continue
-            else:
-                logger.error(f"can not load dataset from dataset_path")
-                raise RuntimeError(f"Load dataset Failed!, dataset_path: {self.cfg.dataset_path}.")
-
-        return dataset
+        return self.read_dataset(jsonl_file_path, self.load_meta)
 
     def load_dj_dataset(self, jsonl_file_path = None):
+        return self.read_dataset(jsonl_file_path, self.load_dj_meta)
+
+    def read_dataset(self, jsonl_file_path, load_func):
+        """
+        流式读取jsonl数据集：按数据块读取文件，元数据解析在各数据块上并行执行，driver不再持有完整数据集
+        """
         retry = 0
         dataset = None
         if jsonl_file_path is None:
             jsonl_file_path = self.cfg.dataset_path
         while True:
             if check_valid_path(jsonl_file_path):
-                with open(jsonl_file_path, "r", encoding='utf-8') as meta:
-                    lines = meta.readlines()
-                    dataset = ray.data.from_items([self.load_dj_meta(line) for line in lines])
-                    break
+                read_blocks = os.getenv("DATASET_READ_BLOCKS")
+                dataset = ray.data.read_text(jsonl_file_path,
+                                             encoding='utf-8',
+                                             override_num_blocks=int(read_blocks) if read_blocks else None)
+                dataset = dataset.map(load_meta_row,
+                                      fn_kwargs={"load_func": load_func, "dataset_id": self.cfg.dataset_id},
+                                      num_cpus=0.05)
+                break
             if retry < 5:
                 retry += 1
                 time.sleep(retry)